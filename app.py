@@ -1,107 +1,158 @@
 """Define the Gradio interface for the agent."""
 
+import contextlib
+import functools
 import os
+import time
+from pathlib import Path
 
 import gradio as gr
 import smolagents
 from huggingface_hub import login
-from smolagents import (
-    CodeAgent,
-    ToolCollection,
+
+from src.agents import get_manager_factory
+from src.async_bridge import call_blocking, iterate_async
+from src.chat import stream_chat_messages
+from src.logger import disable_live_display_refresh, logger, setup_langfuse
+from src.profiler import AgentProfiler
+from src.sandbox import CODE_WORKERS, code_worker_pool
+from src.serving import (
+    AGENT_ASYNC_WORKERS,
+    AdmissionError,
+    AgentRun,
+    AgentServer,
+    QueuePosition,
 )
 
-from mcp import StdioServerParameters
-from src.agents import get_web_agent
-from src.logger import logger, setup_langfuse
-from src.mcp import process_mcp_tools
-from src.models import get_model
-from src.tools import calculate_cargo_travel_time
+# Set PROFILE_DIR to profile every run, and write its flame graph there
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+# Set AGENT_ASYNC to run the agents on an event loop instead of worker threads
+AGENT_ASYNC = os.getenv("AGENT_ASYNC", "false").lower() == "true"
 
+# The agent graph and its tools are imported and built on the first run
+manager_factory = get_manager_factory()
 
-def call_agent(task: str) -> list[gr.ChatMessage]:  # type: ignore  # noqa: PGH003
-    """Get the agent and call it with the prompt."""
-    setup_langfuse()
 
+@functools.cache
+def get_agent_server() -> AgentServer:
+    """Return the server running the agents of the app."""
+    if AGENT_ASYNC:
+        return AgentServer(AGENT_ASYNC_WORKERS, asynchronous=True)
+    return AgentServer()
+
+
+def run_agent(task: str) -> list[gr.ChatMessage]:  # type: ignore  # noqa: PGH003
+    """Get the agent and call it with the prompt."""
     # Login to Hugging Face Hub
-    login(token=os.getenv("HF_TOKEN"))
+    call_blocking(login, token=os.getenv("HF_TOKEN"))
 
-    server_parameters = StdioServerParameters(
-        command="uvx",
-        args=["--quiet", "pubmedmcp@0.1.3"],
-        env={"UV_PYTHON": "3.11", **os.environ},
+    setup_start = time.perf_counter()
+    agent = call_blocking(manager_factory.new_agent)
+    setup_time = time.perf_counter() - setup_start
+
+    logger.info(
+        f"Agent's available tools: {list(agent.tools.keys())}",
     )
-    with ToolCollection.from_mcp(
-        server_parameters,
-        trust_remote_code=True,
-    ) as tool_collection:
-        mcp_tools = process_mcp_tools(tool_collection)
-        model = get_model("mistral")
-        agent = CodeAgent(
-            tools=[calculate_cargo_travel_time, *mcp_tools],
-            model=model,
-            managed_agents=[get_web_agent(model)],
-            add_base_tools=False,
-            additional_authorized_imports=[
-                "geopandas",
-                "plotly",
-                "plotly.graph_objects",
-                "plotly.express",
-                "plotly.express.colors",
-                "plotly.express.colors.sequential",
-                "plotly.express.graph_objects",
-                "matplotlib",
-                "matplotlib.pyplot",
-                "shapely",
-                "json",
-                "pandas",
-                "numpy",
-            ],
-            planning_interval=5,
-            verbosity_level=2,
-            max_steps=20,
-            stream_outputs=True,
+
+    try:
+        with (
+            AgentProfiler(agent) if PROFILE_DIR else contextlib.nullcontext()
+        ) as profiler:
+            yield from stream_chat_messages(agent, task)
+    finally:
+        # Give the worker running the code of the agent back to the pool
+        agent.cleanup()
+    if profiler:
+        profile_path = (
+            Path(PROFILE_DIR) / f"run_{time.strftime('%Y%m%d_%H%M%S')}.folded"
         )
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.export_folded(profile_path)
+        logger.info(f"Run profile, written to {profile_path}:\n{profiler.summary()}")
+
+    run_time = sum(
+        step.timing.duration
+        for step in agent.memory.steps
+        if isinstance(step, (smolagents.ActionStep, smolagents.PlanningStep))
+    )
+    token_usage = agent.monitor.get_total_token_counts()
+    logger.info(
+        f"Agent setup: {setup_time:.3f}s | Agent steps: {run_time:.2f}s | "
+        f"Input tokens: {token_usage.input_tokens:,} | "
+        f"Output tokens: {token_usage.output_tokens:,}",
+    )
+
 
-        logger.info(
-            f"Agent's available tools: {list(agent.tools.keys())}",
+def submit_run(task: str, request: gr.Request) -> AgentRun:
+    """Queue an agent run for the user, refused with an error message."""
+    # Behind a proxy, the client hosts of anonymous users would all be the same
+    user = request.username or request.session_hash or "anonymous"
+    try:
+        if AGENT_ASYNC:
+            return get_agent_server().submit(
+                user,
+                lambda: iterate_async(run_agent, task),
+            )
+        return get_agent_server().submit(user, lambda: run_agent(task))
+    except AdmissionError as error:
+        raise gr.Error(str(error)) from error
+
+
+def to_chat_messages(
+    update: QueuePosition | list[gr.ChatMessage],
+) -> list[gr.ChatMessage]:
+    """Return the chat messages of an update of a run."""
+    if isinstance(update, QueuePosition):
+        return [
+            gr.ChatMessage(
+                role="assistant",
+                content=f"⏳ Waiting for a free agent: {update.position} of "
+                f"{update.queue_length} in the queue.",
+            ),
+        ]
+    return update
+
+
+def call_agent(task: str, request: gr.Request) -> list[gr.ChatMessage]:  # type: ignore  # noqa: PGH003
+    """Queue an agent run for the user, and stream its position then its messages."""
+    for update in submit_run(task, request).updates():
+        yield to_chat_messages(update)
+
+
+async def acall_agent(task: str, request: gr.Request) -> list[gr.ChatMessage]:  # type: ignore  # noqa: PGH003
+    """Stream an agent run as ``call_agent``, from Gradio's event loop."""
+    async for update in submit_run(task, request).aupdates():
+        yield to_chat_messages(update)
+
+
+def build_app() -> gr.Blocks:
+    """Return the Gradio interface."""
+    agent_server = get_agent_server()
+    with gr.Blocks() as app:
+        chatbot = gr.Chatbot(type="messages", height=700)
+        textbox = gr.Textbox(label="Task", value="")
+        submit = gr.Button("Submit")
+        # Admission and queueing are handled by the agent server
+        submit.click(
+            acall_agent if AGENT_ASYNC else call_agent,
+            inputs=textbox,
+            outputs=chatbot,
+            concurrency_limit=agent_server.workers + agent_server.queue_size,
         )
+    return app
+
+
+def main() -> None:
+    """Set up tracing and the code workers, and launch the app."""
+    setup_langfuse()
+    disable_live_display_refresh()
+    if CODE_WORKERS:
+        # The workers running the code of the agents import its modules in the
+        # background. They import this module too, as ``__mp_main__``, so it must
+        # have no side effect outside of ``main``.
+        code_worker_pool.start()
+    build_app().launch(share=False)
+
 
-        messages = []
-        for step in agent.run(task, stream=True):
-            if isinstance(step, (smolagents.ActionStep, smolagents.PlanningStep)):
-                memory_step: smolagents.ActionStep | smolagents.PlanningStep = step
-                for message in memory_step.to_messages():
-                    role = "user" if message["role"] == "user" else "assistant"
-                    for content in message["content"]:
-                        if content["type"] == "text":
-                            metadata = {}
-                            if message["role"] == smolagents.MessageRole.TOOL_CALL:
-                                metadata = {"title": "🛠️ Tool call"}
-                            if message["role"] == smolagents.MessageRole.TOOL_RESPONSE:
-                                metadata = {"title": "➡️ Tool response"}
-                            if message["role"] == smolagents.MessageRole.SYSTEM:
-                                metadata = {"title": "️⚙️ System"}
-                            messages.append(
-                                gr.ChatMessage(
-                                    role=role,
-                                    content=content["text"],
-                                    metadata=metadata,
-                                ),
-                            )
-            if isinstance(step, smolagents.FinalAnswerStep):
-                messages.append(
-                    gr.ChatMessage(
-                        role="assistant",
-                        content=f"**Final answer:**\n{step.output}",
-                    ),
-                )
-            yield messages
-
-
-with gr.Blocks() as app:
-    chatbot = gr.Chatbot(type="messages", height=700)
-    textbox = gr.Textbox(label="Task", value="")
-    submit = gr.Button("Submit")
-    submit.click(call_agent, inputs=textbox, outputs=chatbot)
-
-app.launch(share=False)
+if __name__ == "__main__":
+    main()
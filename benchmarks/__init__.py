@@ -0,0 +1 @@
+"""Benchmarks of the agents' hot paths, run with ``python -m benchmarks.<name>``."""
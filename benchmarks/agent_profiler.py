@@ -0,0 +1,119 @@
+"""
+Profile a scripted 20-step agent run and measure the overhead of the profiler.
+
+A ``CodeAgent`` is driven by a scripted model answering in ``MODEL_LATENCY``
+seconds with code calling a slow tool, a managed agent on some steps and a step
+callback standing in for the screenshot capture. The run is timed with and
+without ``AgentProfiler``, whose summary table and flame graph are printed.
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from smolagents import ActionStep, ChatMessage, CodeAgent, Model, tool
+from smolagents.monitoring import TokenUsage
+
+from src.profiler import AgentProfiler
+
+N_STEPS = 20
+MODEL_LATENCY = 0.02
+TOOL_LATENCY = 0.01
+SCREENSHOT_LATENCY = 0.005
+
+
+class ScriptedModel(Model):
+    """Model answering with code calling the tools, then the final answer."""
+
+    def __init__(self, *, managed: bool = False) -> None:
+        """Script the manager agent, or the managed one."""
+        super().__init__(model_id="scripted")
+        self.managed = managed
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        stop_sequences: list[str] | None = None,
+        **kwargs,  # noqa: ANN003, ARG002
+    ) -> ChatMessage:
+        """Return the next step of the script."""
+        time.sleep(MODEL_LATENCY)
+        if stop_sequences and "<end_plan>" in stop_sequences:
+            content = "1. Search.\n2. Answer.\n<end_plan>"
+        elif self.managed:
+            content = "<code>\nfinal_answer('found it')\n</code>"
+        else:
+            step = sum(message.role == "tool-call" for message in messages) + 1
+            if step >= N_STEPS:
+                content = "Thought: done.\n<code>\nfinal_answer('42')\n</code>"
+            elif step % 5 == 0:
+                content = "<code>\nprint(helper(task='search'))\n</code>"
+            else:
+                content = "<code>\nprint(slow_search(query='cake'))\n</code>"
+        return ChatMessage(
+            role="assistant",
+            content=content,
+            token_usage=TokenUsage(
+                input_tokens=sum(len(str(message.content)) for message in messages)
+                // 4,
+                output_tokens=len(content) // 4,
+            ),
+        )
+
+
+@tool
+def slow_search(query: str) -> str:
+    """
+    Search for a query, slowly.
+
+    Args:
+        query: The query.
+
+    """
+    time.sleep(TOOL_LATENCY)
+    return f"results for {query}"
+
+
+def capture_screenshot(memory_step: ActionStep) -> None:  # noqa: ARG001
+    """Stand in for the screenshot step callback."""
+    time.sleep(SCREENSHOT_LATENCY)
+
+
+def get_agent() -> CodeAgent:
+    """Return the scripted agent and its managed agent."""
+    helper = CodeAgent(
+        tools=[],
+        model=ScriptedModel(managed=True),
+        name="helper",
+        description="A managed helper agent.",
+        verbosity_level=0,
+    )
+    return CodeAgent(
+        tools=[slow_search],
+        model=ScriptedModel(),
+        managed_agents=[helper],
+        step_callbacks=[capture_screenshot],
+        planning_interval=5,
+        max_steps=N_STEPS,
+        verbosity_level=0,
+    )
+
+
+if __name__ == "__main__":
+    get_agent().run("Warm up")
+    agent = get_agent()
+    start = time.perf_counter()
+    agent.run("Plan a party")
+    print(f"unprofiled: {time.perf_counter() - start:.3f}s")  # noqa: T201
+
+    agent = get_agent()
+    start = time.perf_counter()
+    with AgentProfiler(agent) as profiler:
+        agent.run("Plan a party")
+    print(f"profiled:   {time.perf_counter() - start:.3f}s\n")  # noqa: T201
+    print(profiler.summary())  # noqa: T201
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "run.folded"
+        profiler.export_folded(path)
+        print("\n" + "\n".join(path.read_text().splitlines()[:12]))  # noqa: T201
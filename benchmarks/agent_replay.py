@@ -0,0 +1,227 @@
+"""
+Benchmark the orchestration overhead of end-to-end agent runs, replayed offline.
+
+The tasks of the fixtures recorded by ``python -m src.replay`` into
+``REPLAY_FIXTURES_DIR`` are replayed ``N_RUNS`` times each on the manager agent
+served by the app, the model and the tools answering from the fixture. No latency
+is injected by default, so that only the time spent by the app is measured; use
+``--latency-scale`` to replay a share of the recorded latencies, and
+``--model-latency`` and ``--tool-latency`` to add fixed ones.
+
+The wall and CPU time of each step, from ``AgentProfiler``, and of the whole run
+are reported, with the peak memory allocated by Python in a separate run traced
+by ``tracemalloc``. Results are appended to ``REPLAY_BENCHMARK_RESULTS`` with the
+current commit, and compared with the latest results of another commit, or of
+``--against COMMIT``: a run slower or larger than its baseline by more than
+``REGRESSION_TOLERANCE`` and the minimum difference of its metric is reported as a
+regression, and the benchmark exits with an error.
+"""
+
+import argparse
+import functools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any
+
+from src.agents import AgentFactory
+from src.batch import silence
+from src.logger import disable_live_display_refresh, setup_langfuse
+from src.profiler import AgentProfiler
+from src.replay import Fixture, Latency, build_replay_agent
+from src.sandbox import CODE_WORKERS, code_worker_pool
+
+REPLAY_FIXTURES_DIR = Path(os.getenv("REPLAY_FIXTURES_DIR", "benchmarks/fixtures"))
+REPLAY_BENCHMARK_RESULTS = Path(
+    os.getenv("REPLAY_BENCHMARK_RESULTS", ".cache/agent_replay_results.jsonl"),
+)
+N_RUNS = 5
+REGRESSION_TOLERANCE = 0.2
+# Smallest difference reported as a regression, for each metric
+MIN_REGRESSIONS = {"wall_seconds": 0.02, "cpu_seconds": 0.02, "peak_mb": 2.0}
+
+
+def current_commit() -> str:
+    """Return the short hash of the checked out commit, marked if modified."""
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    changes = subprocess.run(
+        ["git", "status", "--porcelain", "--untracked-files=no"],  # noqa: S607
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    return f"{commit}-dirty" if changes else commit
+
+
+def replay(
+    factory: AgentFactory,
+    fixture: Fixture,
+    task: str,
+    *,
+    trace_memory: bool = False,
+) -> dict[str, Any]:
+    """Replay a task and return its wall time, CPU time, peak memory and steps."""
+    fixture.rewind()
+    agent = factory.new_agent()
+    silence(agent)
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        with AgentProfiler(agent) as profiler:
+            agent.run(task)
+    finally:
+        agent.cleanup()
+    metrics = {
+        "wall_seconds": time.perf_counter() - start,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "steps": {step.name: step.seconds for step in profiler.steps},
+    }
+    if trace_memory:
+        metrics["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return metrics
+
+
+def benchmark_task(
+    factory: AgentFactory,
+    fixture: Fixture,
+    task: str,
+) -> dict[str, Any]:
+    """Return the median metrics of ``N_RUNS`` replays of a task, after a warmup."""
+    replay(factory, fixture, task)
+    runs = [replay(factory, fixture, task) for _ in range(N_RUNS)]
+    return {
+        "wall_seconds": statistics.median(run["wall_seconds"] for run in runs),
+        "cpu_seconds": statistics.median(run["cpu_seconds"] for run in runs),
+        "peak_mb": replay(factory, fixture, task, trace_memory=True)["peak_mb"],
+        "steps": {
+            name: statistics.median(run["steps"].get(name, 0.0) for run in runs)
+            for name in runs[0]["steps"]
+        },
+    }
+
+
+def find_baseline(
+    result: dict[str, Any],
+    history: list[dict[str, Any]],
+    against: str | None,
+) -> dict[str, Any] | None:
+    """Return the latest result of the same run at another, or the given, commit."""
+    for previous in reversed(history):
+        if (
+            previous["fixture"],
+            previous["task"],
+            previous["latency"],
+        ) != (result["fixture"], result["task"], result["latency"]):
+            continue
+        if (
+            previous["commit"].startswith(against)
+            if against
+            else previous["commit"] != result["commit"]
+        ):
+            return previous
+    return None
+
+
+def regressions(result: dict[str, Any], baseline: dict[str, Any]) -> list[str]:
+    """Return the metrics of a run worse than in its baseline."""
+    return [
+        f"{metric}: {baseline[metric]:.3f} -> {result[metric]:.3f}"
+        for metric, min_regression in MIN_REGRESSIONS.items()
+        if result[metric] > baseline[metric] * (1 + REGRESSION_TOLERANCE)
+        and result[metric] - baseline[metric] > min_regression
+    ]
+
+
+def main() -> None:
+    """Replay the fixtures, store their results and compare them."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("fixtures", nargs="*", type=Path, help="JSON fixtures")
+    parser.add_argument("--latency-scale", type=float, default=0.0)
+    parser.add_argument("--model-latency", type=float, default=0.0)
+    parser.add_argument("--tool-latency", type=float, default=0.0)
+    parser.add_argument("--against", help="commit to compare the results with")
+    arguments = parser.parse_args()
+    latency = Latency(
+        arguments.latency_scale,
+        arguments.model_latency,
+        arguments.tool_latency,
+    )
+    paths = arguments.fixtures or sorted(REPLAY_FIXTURES_DIR.glob("*.json"))
+    if not paths:
+        print(  # noqa: T201
+            f"No fixture in {REPLAY_FIXTURES_DIR}, record one with"
+            " `python -m src.replay tasks.jsonl"
+            f" {REPLAY_FIXTURES_DIR}/<name>.json`",
+        )
+        sys.exit(1)
+
+    setup_langfuse()
+    disable_live_display_refresh()
+    if CODE_WORKERS:
+        code_worker_pool.start()
+    history = (
+        [json.loads(line) for line in REPLAY_BENCHMARK_RESULTS.read_text().splitlines()]
+        if REPLAY_BENCHMARK_RESULTS.exists()
+        else []
+    )
+    commit = current_commit()
+    found = []
+    results = []
+    for path in paths:
+        fixture = Fixture(path)
+        factory = AgentFactory(functools.partial(build_replay_agent, fixture, latency))
+        for task_number, task in enumerate(fixture.tasks):
+            result = {
+                "commit": commit,
+                "time": time.time(),
+                "fixture": path.stem,
+                "task": task_number,
+                "latency": [latency.scale, latency.model_seconds, latency.tool_seconds],
+                **benchmark_task(factory, fixture, task),
+            }
+            results.append(result)
+            baseline = find_baseline(result, history, arguments.against)
+            print(  # noqa: T201
+                f"{path.stem} task {task_number}:"
+                f" wall={result['wall_seconds'] * 1000:8.1f} ms"
+                f"  cpu={result['cpu_seconds'] * 1000:8.1f} ms"
+                f"  peak memory={result['peak_mb']:6.1f} MB"
+                + (f"  (baseline {baseline['commit']})" if baseline else ""),
+            )
+            for name, seconds in result["steps"].items():
+                before = (
+                    f"  (baseline {baseline['steps'][name] * 1000:.1f} ms)"
+                    if baseline and name in baseline["steps"]
+                    else ""
+                )
+                print(f"  {name:<12}{seconds * 1000:8.1f} ms{before}")  # noqa: T201
+            if baseline:
+                found.extend(
+                    f"{path.stem} task {task_number} {regression}"
+                    for regression in regressions(result, baseline)
+                )
+
+    REPLAY_BENCHMARK_RESULTS.parent.mkdir(parents=True, exist_ok=True)
+    with REPLAY_BENCHMARK_RESULTS.open("a") as file:
+        file.writelines(json.dumps(result) + "\n" for result in results)
+    print(f"\nResults of {commit} appended to {REPLAY_BENCHMARK_RESULTS}")  # noqa: T201
+    if found:
+        print("\nRegressions:\n" + "\n".join(found))  # noqa: T201
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Compare the threads and memory of 100 concurrent sessions, threaded or async.
+
+Each session runs a streaming ``CodeAgent`` through ``AgentServer`` for three
+model calls to a local stand-in chat completion server answering in
+``MODEL_LATENCY`` seconds, the agent's code calling a blocking tool. The threaded
+path runs each session in a worker thread, read by a thread as Gradio does for
+synchronous handlers. The async path runs the sessions on the server's event loop
+through the greenlet bridge, read by coroutines. Each path is measured in a
+process of its own, the fake server running in another one.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from smolagents import CodeAgent, tool
+
+from benchmarks.fake_llm_server import FakeLLMServer, fake_model, fixed_latency
+from src.async_bridge import AsyncToolsExecutor, async_client, iterate_async
+from src.chat import stream_chat_messages
+from src.logger import disable_live_display_refresh
+from src.serving import AgentRun, AgentServer
+
+N_SESSIONS = 100
+MODEL_LATENCY = 1.0
+TOOL_LATENCY = 0.05
+SAMPLE_INTERVAL = 0.01
+
+
+def reply(messages: list) -> list[str]:
+    """Reply with a code step calling the tool, then with the final answer."""
+    steps = sum("Observation:" in json.dumps(message) for message in messages)
+    code = "final_answer(lookup('cake'))" if steps >= 2 else "print(lookup('tea'))"  # noqa: PLR2004
+    return [f"<code>\n{code}\n</code>"]
+
+
+@tool
+def lookup(query: str) -> str:
+    """
+    Look up a query, blocking.
+
+    Args:
+        query: The query.
+
+    """
+    time.sleep(TOOL_LATENCY)
+    return f"results for {query}"
+
+
+def serve(ports: multiprocessing.Queue) -> None:
+    """Serve fake chat completions until terminated."""
+    with FakeLLMServer(fixed_latency(MODEL_LATENCY), reply=reply) as server:
+        ports.put(server.server_port)
+        threading.Event().wait()
+
+
+def get_agent(port: int) -> CodeAgent:
+    """Return a streaming agent of the fake server, set up as the app's agents."""
+    agent = CodeAgent(
+        tools=[lookup],
+        model=async_client(fake_model(port)),
+        stream_outputs=True,
+        max_steps=5,
+        verbosity_level=0,
+    )
+    agent.python_executor = AsyncToolsExecutor(agent.python_executor)
+    return agent
+
+
+class Sampler:
+    """Record the peak thread count of the process, from a thread of its own."""
+
+    def __init__(self) -> None:
+        """Start sampling."""
+        self.max_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling."""
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            # The sampler's own thread is not counted
+            self.max_threads = max(self.max_threads, threading.active_count() - 1)
+
+
+def submit_sessions(server: AgentServer, port: int, *, asynchronous: bool) -> list:
+    """Submit the sessions, each one for a user of its own."""
+    runs = []
+    for session in range(N_SESSIONS):
+        agent = get_agent(port)
+        if asynchronous:
+            job = lambda agent=agent: iterate_async(  # noqa: E731
+                stream_chat_messages,
+                agent,
+                "Plan a party",
+            )
+        else:
+            job = lambda agent=agent: stream_chat_messages(agent, "Plan a party")  # noqa: E731
+        runs.append(server.submit(f"user-{session}", job))
+    return runs
+
+
+def read_threaded(runs: list[AgentRun]) -> list:
+    """Read the runs from a thread each."""
+    answers = [None] * len(runs)
+
+    def read(index: int) -> None:
+        for messages in runs[index].updates():
+            answers[index] = messages[-1].content
+
+    readers = [threading.Thread(target=read, args=(i,)) for i in range(len(runs))]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    return answers
+
+
+async def read_async(runs: list[AgentRun]) -> list:
+    """Read the runs from a coroutine each."""
+
+    async def read(run: AgentRun) -> str:
+        answer = None
+        async for messages in run.aupdates():
+            answer = messages[-1].content
+        return answer
+
+    return await asyncio.gather(*(read(run) for run in runs))
+
+
+def measure(path: str, port: int) -> dict:
+    """Run the sessions on a path, return its wall time, threads and memory."""
+    asynchronous = path == "async"
+    disable_live_display_refresh()
+    # Warm up the model client and the agent code, outside of the measure
+    for _ in stream_chat_messages(get_agent(port), "Warm up"):
+        pass
+    server = AgentServer(
+        workers=N_SESSIONS,
+        queue_size=N_SESSIONS,
+        asynchronous=asynchronous,
+    )
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sampler = Sampler()
+    start = time.perf_counter()
+    runs = submit_sessions(server, port, asynchronous=asynchronous)
+    answers = asyncio.run(read_async(runs)) if asynchronous else read_threaded(runs)
+    seconds = time.perf_counter() - start
+    sampler.stop()
+    return {
+        "path": path,
+        "seconds": seconds,
+        "max_threads": sampler.max_threads,
+        "rss_growth_mb": (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        )
+        / 1024,
+        "answered": sum(
+            answer == "**Final answer:**\nresults for cake" for answer in answers
+        ),
+    }
+
+
+if __name__ == "__main__":
+    for name in ("LiteLLM", "httpx", "openai", "src.logger", "asyncio"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    if len(sys.argv) == 3:  # noqa: PLR2004
+        print(json.dumps(measure(sys.argv[1], int(sys.argv[2]))))  # noqa: T201
+        sys.exit()
+    ports = multiprocessing.Queue()
+    server_process = multiprocessing.Process(target=serve, args=(ports,), daemon=True)
+    server_process.start()
+    port = ports.get()
+    print(  # noqa: T201
+        f"{N_SESSIONS} sessions of 3 model calls of {MODEL_LATENCY}s"
+        f" and 2 tool calls of {TOOL_LATENCY}s",
+    )
+    for path in ("threads", "async"):
+        output = subprocess.run(  # noqa: S603
+            [sys.executable, "-m", "benchmarks.async_sessions", path, str(port)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(  # noqa: T201
+            f"{path:>8}: {result['seconds']:5.2f}s"
+            f"  peak threads={result['max_threads']:4}"
+            f"  peak RSS growth={result['rss_growth_mb']:6.1f} MB"
+            f"  answered={result['answered']}/{N_SESSIONS}",
+        )
+    server_process.terminate()
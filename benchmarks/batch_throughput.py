@@ -0,0 +1,83 @@
+"""
+Measure the throughput of batch runs against the number of workers.
+
+Tasks run on a ``CodeAgent`` driven by a fake model answering in ``MODEL_LATENCY``
+seconds, which serves at most ``PROVIDER_CONCURRENCY`` requests at once, as a rate
+limited provider would. Tasks per minute should grow with the workers up to that
+limit, then plateau. The batch is then run again on the same output, to check that
+the tasks already done are skipped.
+"""
+
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from smolagents import ChatMessage, CodeAgent, Model
+from smolagents.monitoring import TokenUsage
+
+from src.agents import AgentFactory
+from src.batch import BatchRunner, JsonlResultWriter
+
+N_TASKS = 48
+N_STEPS = 3
+MODEL_LATENCY = 0.2
+PROVIDER_CONCURRENCY = 8
+WORKER_COUNTS = (1, 2, 4, 8, 16)
+
+
+class FakeModel(Model):
+    """Model answering with ``N_STEPS`` code steps, at most a few at once."""
+
+    def __init__(self) -> None:
+        """Create the model."""
+        super().__init__(model_id="fake")
+        self.slots = threading.BoundedSemaphore(PROVIDER_CONCURRENCY)
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        stop_sequences: list[str] | None = None,  # noqa: ARG002
+        **kwargs,  # noqa: ANN003, ARG002
+    ) -> ChatMessage:
+        """Return the next step, after ``MODEL_LATENCY`` seconds."""
+        with self.slots:
+            time.sleep(MODEL_LATENCY)
+        step = sum(message.role == "tool-call" for message in messages) + 1
+        code = "final_answer('done')" if step >= N_STEPS else f"print({step})"
+        return ChatMessage(
+            role="assistant",
+            content=f"<code>\n{code}\n</code>",
+            token_usage=TokenUsage(input_tokens=100, output_tokens=10),
+        )
+
+
+def run_batch(output: Path, workers: int) -> str:
+    """Run the batch into ``output``, return its report."""
+    factory = AgentFactory(
+        lambda: CodeAgent(tools=[], model=FakeModel(), verbosity_level=0),
+    )
+    writer = JsonlResultWriter(output)
+    try:
+        completed = writer.completed_ids()
+        tasks = [(str(number), f"Task {number}") for number in range(N_TASKS)]
+        runner = BatchRunner(factory, writer, workers)
+        report = runner.run(
+            (task_id, task) for task_id, task in tasks if task_id not in completed
+        )
+        report.skipped = len(completed)
+    finally:
+        writer.close()
+    return str(report)
+
+
+if __name__ == "__main__":
+    print(  # noqa: T201
+        f"{N_TASKS} tasks of {N_STEPS} steps, model latency {MODEL_LATENCY}s,"
+        f" {PROVIDER_CONCURRENCY} concurrent requests at most",
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in WORKER_COUNTS:
+            output = Path(directory) / f"results_{workers}.jsonl"
+            print(f"{workers:>3} workers: {run_batch(output, workers)}")  # noqa: T201
+        print(f"    resumed: {run_batch(output, workers)}")  # noqa: T201
@@ -0,0 +1,114 @@
+"""Benchmark the on-disk BM25 index against the langchain BM25 retriever."""
+
+import importlib.util
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.retrievers import BM25Retriever
+
+from src.bm25 import BM25Index
+
+SIZES = [10_000, 100_000, 1_000_000]
+VOCABULARY_SIZE = 50_000
+CHUNK_LENGTH = 60
+BATCH_SIZE = 50_000
+N_QUERIES = 500
+# Share of the chunks deleted after the build, then purged by a merge
+DELETE_FRACTION = 0.1
+# The langchain retriever, which needs rank_bm25, scores every chunk of the corpus:
+# only run it on small corpora
+MAX_BASELINE_SIZE = 100_000
+RUN_BASELINE = importlib.util.find_spec("rank_bm25") is not None
+
+WORD_PROBABILITIES = 1 / np.arange(1, VOCABULARY_SIZE + 1) ** 1.1
+WORD_PROBABILITIES /= WORD_PROBABILITIES.sum()
+
+
+def make_chunks(rng: np.random.Generator, start: int, n_chunks: int) -> list[Document]:
+    """Draw chunks of words following a Zipf distribution, like natural text."""
+    words = rng.choice(
+        VOCABULARY_SIZE,
+        size=(n_chunks, CHUNK_LENGTH),
+        p=WORD_PROBABILITIES,
+    )
+    return [
+        Document(
+            id=str(start + i),
+            page_content=" ".join(f"w{word}" for word in chunk_words),
+        )
+        for i, chunk_words in enumerate(words.tolist())
+    ]
+
+
+def percentiles_ms(search: Callable[[str], object], queries: list[str]) -> str:
+    """Format the p50 and p99 latency of a search function in milliseconds."""
+    durations = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        durations.append(time.perf_counter() - start)
+    quantiles = statistics.quantiles(durations, n=100)
+    return f"p50={quantiles[49] * 1000:8.2f} ms  p99={quantiles[98] * 1000:8.2f} ms"
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    rng = np.random.default_rng(0)
+    queries = [
+        " ".join(
+            f"w{word}"
+            for word in rng.choice(VOCABULARY_SIZE, size=n_words, p=WORD_PROBABILITIES)
+        )
+        for n_words in rng.integers(2, 5, N_QUERIES)
+    ]
+
+    for size in sizes:
+        print(f"--- {size:,} chunks")  # noqa: T201
+        with tempfile.TemporaryDirectory() as index_dir:
+            build_time = 0.0
+            index = BM25Index(index_dir)
+            for start in range(0, size, BATCH_SIZE):
+                chunks = make_chunks(rng, start, min(BATCH_SIZE, size - start))
+                batch_start = time.perf_counter()
+                index.add(chunks)
+                build_time += time.perf_counter() - batch_start
+            load_start = time.perf_counter()
+            index = BM25Index(index_dir)
+            load_time = time.perf_counter() - load_start
+            print(  # noqa: T201
+                f"    index: build={build_time:7.2f}s  load={load_time * 1000:7.2f} ms"
+                f"  {percentiles_ms(index.search, queries)}",
+            )
+
+            deleted_ids = [
+                str(doc)
+                for doc in rng.choice(size, int(size * DELETE_FRACTION), replace=False)
+            ]
+            delete_start = time.perf_counter()
+            for start in range(0, len(deleted_ids), BATCH_SIZE // 10):
+                index.delete(deleted_ids[start : start + BATCH_SIZE // 10])
+            delete_time = time.perf_counter() - delete_start
+            deleted_latency = percentiles_ms(index.search, queries)
+            merge_start = time.perf_counter()
+            index.merge()
+            merge_time = time.perf_counter() - merge_start
+            print(  # noqa: T201
+                f"  deletes: delete={delete_time:6.2f}s  merge={merge_time:7.2f}s"
+                f"  before merge {deleted_latency}"
+                f"  after {percentiles_ms(index.search, queries)}",
+            )
+
+        if RUN_BASELINE and size <= MAX_BASELINE_SIZE:
+            chunks = make_chunks(rng, 0, size)
+            build_start = time.perf_counter()
+            retriever = BM25Retriever.from_documents(chunks, k=5)
+            build_time = time.perf_counter() - build_start
+            print(  # noqa: T201
+                f"langchain: build={build_time:7.2f}s  load={'-':>10}   "
+                f"  {percentiles_ms(retriever.invoke, queries[:50])}",
+            )
@@ -0,0 +1,45 @@
+"""Benchmark scalar cargo travel time calls against the vectorised batch tool."""
+
+import random
+import time
+
+from src.tools import calculate_cargo_travel_time, calculate_cargo_travel_times
+
+N_PAIRS = 10_000
+
+
+def random_coords(n: int) -> list[tuple[float, float]]:
+    """Return ``n`` random (latitude, longitude) points."""
+    return [(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(n)]  # noqa: S311
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    origins, destinations = random_coords(N_PAIRS), random_coords(N_PAIRS)
+
+    start = time.perf_counter()
+    scalar_times = [
+        calculate_cargo_travel_time(origin, destination)
+        for origin, destination in zip(origins, destinations, strict=True)
+    ]
+    scalar_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_times = calculate_cargo_travel_times(origins, destinations)["travel_times"]
+    batch_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calculate_cargo_travel_times(origins[:100], destinations, matrix=True)
+    matrix_duration = time.perf_counter() - start
+
+    # Only the first travel times are listed, the others being summarized
+    max_error = max(
+        abs(a - b)
+        for a, b in zip(scalar_times[: len(batch_times)], batch_times, strict=True)
+    )
+    print(f"scalar calls: {scalar_duration * 1000:9.1f} ms")  # noqa: T201
+    print(  # noqa: T201
+        f"  batch call: {batch_duration * 1000:9.1f} ms"
+        f"  (x{scalar_duration / batch_duration:.0f}, max error {max_error:.2f} h)",
+    )
+    print(f"100x{N_PAIRS} matrix: {matrix_duration * 1000:9.1f} ms")  # noqa: T201
@@ -0,0 +1,113 @@
+"""
+Benchmark the chat payload of a scripted 20-step agent run.
+
+Compares the previous handler, which yielded the whole history after every agent
+event, with ``stream_chat_messages``. Reports the number of updates, the bytes
+serialised by the server, the bytes sent after Gradio's streaming diff and the
+time to first token.
+"""
+
+import dataclasses
+import json
+import time
+from collections.abc import Callable, Generator
+
+import gradio as gr
+import smolagents
+from gradio.utils import diff
+from smolagents.monitoring import Timing
+
+from src.chat import stream_chat_messages
+
+N_STEPS = 20
+PLANNING_INTERVAL = 5
+TOKENS_PER_STEP = 60
+TOKEN_LATENCY = 0.001
+TOOL_RESPONSE_CHARS = 8000
+
+
+class ScriptedAgent:
+    """Agent replaying a fixed run, streaming its model output token by token."""
+
+    def run(self, task: str, *, stream: bool) -> Generator:  # noqa: ARG002
+        """Yield the events of the scripted run."""
+        for step_number in range(1, N_STEPS + 1):
+            if (step_number - 1) % PLANNING_INTERVAL == 0:
+                yield from self._stream_tokens("plan")
+                yield smolagents.PlanningStep(
+                    model_input_messages=[],
+                    model_output_message=smolagents.ChatMessage(role="assistant"),
+                    plan="1. Search.\n2. Compute.\n" * 10,
+                    timing=Timing(start_time=time.time()),
+                )
+            model_output = "code " * TOKENS_PER_STEP
+            yield from self._stream_tokens("code")
+            yield smolagents.ActionStep(
+                step_number=step_number,
+                timing=Timing(start_time=time.time()),
+                model_output=model_output,
+                tool_calls=[
+                    smolagents.ToolCall(
+                        name="python_interpreter",
+                        arguments=model_output,
+                        id=str(step_number),
+                    ),
+                ],
+                observations="abstract " * (TOOL_RESPONSE_CHARS // 9),
+            )
+        yield smolagents.FinalAnswerStep(output="42")
+
+    def _stream_tokens(self, token: str) -> Generator:
+        for _ in range(TOKENS_PER_STEP):
+            time.sleep(TOKEN_LATENCY)
+            yield smolagents.ChatMessageStreamDelta(content=f"{token} ")
+
+
+def legacy_chat_messages(agent: ScriptedAgent, task: str) -> Generator:
+    """Yield the whole history after every event, as the handler used to."""
+    messages = []
+    for step in agent.run(task, stream=True):
+        if isinstance(step, (smolagents.ActionStep, smolagents.PlanningStep)):
+            for message in step.to_messages():
+                role = "user" if message.role == "user" else "assistant"
+                messages.extend(
+                    gr.ChatMessage(role=role, content=content["text"])
+                    for content in message.content
+                    if content["type"] == "text"
+                )
+        if isinstance(step, smolagents.FinalAnswerStep):
+            messages.append(gr.ChatMessage(role="assistant", content=str(step.output)))
+        yield messages
+
+
+def measure(handler: Callable[[ScriptedAgent, str], Generator]) -> dict:
+    """Consume a handler like Gradio does and measure what it serialises and sends."""
+    start = time.perf_counter()
+    first_token_time = None
+    n_updates = serialised_bytes = sent_bytes = 0
+    previous = []
+    for messages in handler(ScriptedAgent(), "task"):
+        payload = [dataclasses.asdict(message) for message in messages]
+        if first_token_time is None and payload:
+            first_token_time = time.perf_counter() - start
+        n_updates += 1
+        serialised_bytes += len(json.dumps(payload))
+        sent_bytes += len(json.dumps(diff(previous, payload)))
+        previous = payload
+    return {
+        "updates": n_updates,
+        "serialised_kb": serialised_bytes / 1000,
+        "sent_kb": sent_bytes / 1000,
+        "ttft_ms": first_token_time * 1000,
+        "total_s": time.perf_counter() - start,
+    }
+
+
+if __name__ == "__main__":
+    for label, handler in [
+        ("legacy", legacy_chat_messages),
+        ("stream", stream_chat_messages),
+    ]:
+        results = measure(handler)
+        summary = "  ".join(f"{key}={value:,.1f}" for key, value in results.items())
+        print(f"{label:>6}: {summary}")  # noqa: T201
@@ -0,0 +1,194 @@
+"""
+Local stand-in for an OpenAI-compatible chat completion server.
+
+Every request is answered with a reply derived from the hash of its messages, so
+that replies are deterministic, streamed or not, unless a reply function is
+given. The latency before the first
+token is drawn from an injectable distribution, and requests can be made to fail
+or to be rate limited at given rates.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from smolagents import LiteLLMModel
+
+TOKEN_LATENCY = 0.002
+TOKENS_PER_REPLY = 50
+
+
+def fixed_latency(seconds: float) -> Callable[[np.random.Generator], float]:
+    """Return a latency distribution always drawing ``seconds``."""
+    return lambda _: seconds
+
+
+def tail_latency(
+    seconds: float,
+    tail_seconds: float,
+    tail_probability: float,
+) -> Callable[[np.random.Generator], float]:
+    """Return a latency distribution with a slow tail, as seen on loaded servers."""
+    return lambda rng: tail_seconds if rng.random() < tail_probability else seconds
+
+
+def reply_tokens(messages: list) -> list[str]:
+    """Return the tokens of the deterministic reply to messages."""
+    digest = hashlib.sha256(json.dumps(messages).encode()).hexdigest()
+    return [f"{digest[i % len(digest)]}{i} " for i in range(TOKENS_PER_REPLY)]
+
+
+DEFAULT_LATENCY = fixed_latency(0.1)
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Chat completion endpoint of a ``FakeLLMServer``."""
+
+    server: "FakeLLMServer"
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Answer a chat completion request, streamed or not."""
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(
+                self.server.max_in_flight,
+                self.server.in_flight,
+            )
+            draw = self.server.rng.random()
+            latency = self.server.latency(self.server.rng)
+        try:
+            time.sleep(latency)
+            if draw < self.server.error_rate:
+                self._send_json({"error": {"message": "Internal error"}}, 500)
+            elif draw < self.server.error_rate + self.server.rate_limit_rate:
+                self._send_json({"error": {"message": "Rate limit reached"}}, 429)
+            elif body.get("stream"):
+                self._stream(body)
+            else:
+                self._complete(body)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def _complete(self, body: dict) -> None:
+        tokens = self.server.reply(body["messages"])
+        time.sleep(TOKEN_LATENCY * len(tokens))
+        self._send_json(
+            {
+                "id": "fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(tokens)},
+                        "finish_reason": "stop",
+                    },
+                ],
+                "usage": self._usage(body, tokens),
+            },
+        )
+
+    def _stream(self, body: dict) -> None:
+        tokens = self.server.reply(body["messages"])
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for token in tokens:
+            self._send_event({"choices": [{"index": 0, "delta": {"content": token}}]})
+            time.sleep(TOKEN_LATENCY)
+        self._send_event(
+            {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+        )
+        self._send_event({"choices": [], "usage": self._usage(body, tokens)})
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    @staticmethod
+    def _usage(body: dict, tokens: list[str]) -> dict[str, int]:
+        prompt_tokens = len(json.dumps(body["messages"])) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+
+    def _send_json(self, data: dict, status: int = 200) -> None:
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_event(self, data: dict) -> None:
+        chunk = {
+            "id": "fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "fake",
+            **data,
+        }
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.flush()
+
+    def log_message(self, *args) -> None:  # noqa: ANN002
+        """Silence the request logs."""
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """Fake chat completion server, served from a thread while used as a context."""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(
+        self,
+        latency: Callable[[np.random.Generator], float] = DEFAULT_LATENCY,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: int = 0,
+        reply: Callable[[list], list[str]] = reply_tokens,
+    ) -> None:
+        """Bind a free local port, replying with the tokens returned by ``reply``."""
+        super().__init__(("127.0.0.1", 0), FakeLLMHandler)
+        self.latency = latency
+        self.reply = reply
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __enter__(self) -> "FakeLLMServer":
+        """Serve requests from a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:  # noqa: ANN002
+        """Stop serving requests."""
+        self.shutdown()
+        self.server_close()
+
+    def model(self, **kwargs) -> LiteLLMModel:  # noqa: ANN003
+        """Return a model client of this server, configured as the app's models."""
+        return fake_model(self.server_port, **kwargs)
+
+
+def fake_model(port: int, **kwargs) -> LiteLLMModel:  # noqa: ANN003
+    """Return a model client of the fake server listening on ``port``."""
+    return LiteLLMModel(
+        model_id="openai/fake-model",
+        api_base=f"http://127.0.0.1:{port}/v1",
+        api_key="fake",
+        max_tokens=8096,
+        **kwargs,
+    )
@@ -0,0 +1,139 @@
+"""
+Benchmark recall@k and latency of BM25, dense and hybrid retrieval.
+
+Queries are drawn from the words of a chunk, half of them being replaced by their
+nearest neighbour in the embedding space of the model, so that they only partly
+match the chunk lexically. The chunk a query was drawn from is its relevant result.
+"""
+
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.bm25 import BM25Index, document_id
+from src.dense import DenseIndex
+from src.embeddings import EMBEDDING_MODEL, EmbeddingCache, StaticEmbeddingModel
+from src.hybrid import HybridRetriever
+
+N_CHUNKS = 20_000
+CHUNK_LENGTH = 40
+N_QUERIES = 500
+QUERY_LENGTH = 4
+K = 10
+
+
+def get_words(model: StaticEmbeddingModel) -> list[str]:
+    """Return the whole alphanumeric words of the model vocabulary."""
+    vocabulary = model.tokenizer.get_vocab()
+    return sorted(
+        (word for word in vocabulary if word.isalnum() and len(word) >= 3),  # noqa: PLR2004
+        key=vocabulary.get,
+    )
+
+
+def make_queries(
+    model: StaticEmbeddingModel,
+    words: list[str],
+    chunks: list[list[str]],
+    rng: np.random.Generator,
+) -> list[tuple[str, int]]:
+    """Draw queries from random chunks, with half of their words paraphrased."""
+    word_vectors = model.embed(words)
+    queries = []
+    for chunk_number in rng.choice(len(chunks), N_QUERIES, replace=False):
+        query_words = list(
+            rng.choice(chunks[chunk_number], QUERY_LENGTH, replace=False),
+        )
+        for position in rng.choice(QUERY_LENGTH, QUERY_LENGTH // 2, replace=False):
+            similarities = word_vectors @ model.embed([query_words[position]])[0]
+            similarities[words.index(query_words[position])] = -np.inf
+            query_words[position] = words[int(np.argmax(similarities))]
+        queries.append((" ".join(query_words), int(chunk_number)))
+    return queries
+
+
+def evaluate(
+    search: Callable[[str], list[str]],
+    queries: list[tuple[str, int]],
+    ids: list[str],
+) -> str:
+    """Format the recall@K and the p50/p99 latency of a search function."""
+    durations, hits = [], 0
+    for query, chunk_number in queries:
+        start = time.perf_counter()
+        results = search(query)
+        durations.append(time.perf_counter() - start)
+        hits += ids[chunk_number] in results
+    quantiles = statistics.quantiles(durations, n=100)
+    return (
+        f"recall@{K}={hits / len(queries):.3f}"
+        f"  p50={quantiles[49] * 1000:6.2f} ms  p99={quantiles[98] * 1000:6.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    n_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else N_CHUNKS
+    rng = np.random.default_rng(0)
+    model = StaticEmbeddingModel.load(EMBEDDING_MODEL)
+    words = get_words(model)
+    chunks = [list(rng.choice(words, CHUNK_LENGTH)) for _ in range(n_chunks)]
+    documents = [Document(page_content=" ".join(chunk)) for chunk in chunks]
+    ids = [document_id(document) for document in documents]
+    queries = make_queries(model, words, chunks, rng)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lexical = BM25Index(Path(tmp_dir) / "bm25")
+        lexical.add(documents)
+        cache = EmbeddingCache(Path(tmp_dir) / "embeddings.sqlite", model)
+        dense = DenseIndex(Path(tmp_dir) / "dense", model.dimension)
+        start = time.perf_counter()
+        HybridRetriever(lexical, dense, cache).sync()
+        print(f"embed and index: {time.perf_counter() - start:.2f}s")  # noqa: T201
+        start = time.perf_counter()
+        HybridRetriever(
+            lexical,
+            DenseIndex(Path(tmp_dir) / "dense_again", model.dimension),
+            cache,
+        ).sync()
+        print(  # noqa: T201
+            f"re-index: {time.perf_counter() - start:.2f}s"
+            f" ({cache.hits} embedding cache hits, {cache.misses} misses)",
+        )
+        exact_vectors = cache.embed([document.page_content for document in documents])
+
+        def search_bm25(query: str) -> list[str]:
+            """Return the ids of the BM25 top-K."""
+            return [doc_id for doc_id, _ in lexical.search_ids(query, K)]
+
+        def search_exact(query: str) -> list[str]:
+            """Return the ids of the exact dense top-K."""
+            scores = exact_vectors @ model.embed([query])[0]
+            return [ids[i] for i in np.argpartition(scores, -K)[-K:]]
+
+        def search_dense(query: str) -> list[str]:
+            """Return the ids of the approximate dense top-K."""
+            return [doc_id for doc_id, _ in dense.search(model.embed([query])[0], K)]
+
+        print(f"{'bm25':>16}: {evaluate(search_bm25, queries, ids)}")  # noqa: T201
+        print(f"{'dense exact':>16}: {evaluate(search_exact, queries, ids)}")  # noqa: T201
+        for n_probe in (4, 16, 64):
+            dense.n_probe = n_probe
+            label = f"dense n_probe={n_probe}"
+            print(f"{label:>16}: {evaluate(search_dense, queries, ids)}")  # noqa: T201
+        dense.n_probe = 16
+        for fusion in ("rrf", "weighted"):
+            hybrid = HybridRetriever(lexical, dense, cache, fusion=fusion)
+            results = evaluate(
+                lambda query, hybrid=hybrid: [
+                    doc_id for doc_id, _ in hybrid.search_ids(query, K)
+                ],
+                queries,
+                ids,
+            )
+            print(f"{'hybrid ' + fusion:>16}: {results}")  # noqa: T201
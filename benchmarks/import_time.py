@@ -0,0 +1,114 @@
+"""
+Benchmark the time it takes to import the app and the agents module.
+
+Besides the wall time of each import, ``python -X importtime`` reports the
+cumulative import time of every module imported by the app. The app's own
+modules and the top-level packages slower than ``MIN_TRACKED_SECONDS`` are
+compared with the baseline saved by ``--update-baseline`` in
+``IMPORT_TIME_BASELINE``: a module slower than its baseline by more than
+``REGRESSION_TOLERANCE`` and ``MIN_REGRESSION_SECONDS``, or a new slow one, is
+reported as a regression, and the benchmark exits with an error.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+MODULES = ["src.agents", "app"]
+N_RUNS = 3
+IMPORT_TIME_BASELINE = Path(
+    os.getenv("IMPORT_TIME_BASELINE", ".cache/import_time_baseline.json"),
+)
+MIN_TRACKED_SECONDS = 0.02
+REGRESSION_TOLERANCE = 0.2
+MIN_REGRESSION_SECONDS = 0.02
+
+
+def time_import(module: str) -> float:
+    """Time importing ``module`` in a fresh interpreter."""
+    start = time.perf_counter()
+    subprocess.run(  # noqa: S603
+        [sys.executable, "-c", f"import {module}"],
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def module_import_times(module: str) -> dict[str, float]:
+    """Return the cumulative import time of each module imported by ``module``."""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def tracked_times(module: str) -> dict[str, float]:
+    """Return the best of ``N_RUNS`` import times of the tracked modules."""
+    runs = [module_import_times(module) for _ in range(N_RUNS)]
+    best = {name: min(run.get(name, 0.0) for run in runs) for name in runs[0]}
+    return {
+        name: seconds
+        for name, seconds in best.items()
+        if name in MODULES
+        or name.startswith("src.")
+        or ("." not in name and seconds >= MIN_TRACKED_SECONDS)
+    }
+
+
+def regressions(times: dict[str, float], baseline: dict[str, float]) -> list[str]:
+    """Return the modules imported more slowly than in the baseline."""
+    found = []
+    for name, seconds in times.items():
+        before = baseline.get(name)
+        if before is None:
+            if seconds >= MIN_TRACKED_SECONDS and not name.startswith("src."):
+                found.append(f"{name}: newly imported, {seconds:.3f}s")
+        elif (
+            seconds > before * (1 + REGRESSION_TOLERANCE)
+            and seconds - before > MIN_REGRESSION_SECONDS
+        ):
+            found.append(f"{name}: {before:.3f}s -> {seconds:.3f}s")
+    return found
+
+
+if __name__ == "__main__":
+    for module in MODULES:
+        durations = [time_import(module) for _ in range(N_RUNS)]
+        print(  # noqa: T201
+            f"{module:>12}: median={statistics.median(durations):6.2f}s"
+            f"  min={min(durations):6.2f}s",
+        )
+
+    times = tracked_times("app")
+    baseline = (
+        json.loads(IMPORT_TIME_BASELINE.read_text())
+        if IMPORT_TIME_BASELINE.exists()
+        else {}
+    )
+    print("\ncumulative import times, against the baseline:")  # noqa: T201
+    for name, seconds in sorted(times.items(), key=lambda item: -item[1]):
+        before = f"{baseline[name]:.3f}s" if name in baseline else "-"
+        print(f"{name:>28}: {seconds:.3f}s  (baseline {before})")  # noqa: T201
+
+    if "--update-baseline" in sys.argv:
+        IMPORT_TIME_BASELINE.parent.mkdir(parents=True, exist_ok=True)
+        IMPORT_TIME_BASELINE.write_text(json.dumps(times, indent=2, sort_keys=True))
+        print(f"\nBaseline saved to {IMPORT_TIME_BASELINE}")  # noqa: T201
+    elif not baseline:
+        print("\nNo baseline, save one with --update-baseline")  # noqa: T201
+    elif found := regressions(times, baseline):
+        print("\nImport time regressions:\n" + "\n".join(found))  # noqa: T201
+        sys.exit(1)
@@ -0,0 +1,97 @@
+"""Benchmark the throughput of the document ingestion pipeline."""
+
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.bm25 import BM25Index
+from src.documents import get_text_splitter
+from src.ingestion import DirectoryIngestor, iter_file_documents, iter_source_files
+
+CORPUS_MB = 50
+FILE_KB = 100
+# One file in ten is a copy of another one, its chunks are duplicates
+DUPLICATE_RATIO = 0.1
+VOCABULARY_SIZE = 20_000
+
+
+def write_corpus(directory: Path, corpus_mb: int, rng: np.random.Generator) -> None:
+    """Write Markdown and JSONL files of Zipf-distributed words."""
+    probabilities = 1 / np.arange(1, VOCABULARY_SIZE + 1) ** 1.1
+    probabilities /= probabilities.sum()
+    n_files = corpus_mb * 1000 // FILE_KB
+    for file_number in range(n_files):
+        if file_number and rng.random() < DUPLICATE_RATIO:
+            original = rng.choice(list(directory.iterdir()))
+            (directory / f"copy_{file_number}{original.suffix}").write_bytes(
+                original.read_bytes(),
+            )
+            continue
+        words = rng.choice(VOCABULARY_SIZE, size=FILE_KB * 1000 // 7, p=probabilities)
+        paragraphs = [
+            " ".join(f"w{word}" for word in paragraph_words) + "."
+            for paragraph_words in np.array_split(words, len(words) // 80)
+        ]
+        if file_number % 2:
+            (directory / f"file_{file_number}.md").write_text("\n\n".join(paragraphs))
+        else:
+            (directory / f"file_{file_number}.jsonl").write_text(
+                "\n".join(json.dumps({"text": text}) for text in paragraphs),
+            )
+
+
+def in_memory_ingest(directory: Path, index: BM25Index) -> int:
+    """Ingest a directory as get_documents does, all documents split at once."""
+    documents = [
+        document
+        for path in iter_source_files(directory)
+        for document in iter_file_documents(path, path.name)
+    ]
+    chunks = get_text_splitter().split_documents(documents)
+    index.add(
+        Document(page_content=chunk.page_content, metadata=chunk.metadata)
+        for chunk in chunks
+    )
+    return len(chunks)
+
+
+def peak_memory_mb() -> float:
+    """Return the peak resident memory of this process, in MB (on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+if __name__ == "__main__":
+    corpus_mb = int(sys.argv[1]) if len(sys.argv) > 1 else CORPUS_MB
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = Path(tmp_dir) / "corpus"
+        corpus_dir.mkdir()
+        write_corpus(corpus_dir, corpus_mb, np.random.default_rng(0))
+        corpus_bytes = sum(path.stat().st_size for path in corpus_dir.iterdir())
+        print(  # noqa: T201
+            f"corpus: {len(list(corpus_dir.iterdir()))} files,"
+            f" {corpus_bytes / 1e6:.1f} MB, {os.cpu_count()} CPUs",
+        )
+
+        index = BM25Index(Path(tmp_dir) / "pipeline_index")
+        report = DirectoryIngestor(index).ingest(corpus_dir)
+        print(f"pipeline:  {report}")  # noqa: T201
+        print(f"           peak memory {peak_memory_mb():.0f} MB")  # noqa: T201
+        report = DirectoryIngestor(index).ingest(corpus_dir)
+        print(f"rerun:     {report}")  # noqa: T201
+
+        start = time.perf_counter()
+        n_chunks = in_memory_ingest(corpus_dir, BM25Index(Path(tmp_dir) / "index"))
+        seconds = time.perf_counter() - start
+        print(  # noqa: T201
+            f"in memory: {n_chunks} chunks in {seconds:.2f}s:"
+            f" {corpus_bytes / 1e6 / seconds:.2f} MB/s,"
+            f" {n_chunks / seconds:.0f} chunks/s,"
+            f" peak memory {peak_memory_mb():.0f} MB",
+        )
@@ -0,0 +1,106 @@
+"""
+Benchmark the response cache of the models, offline.
+
+A local stand-in for an OpenAI-compatible chat completion server answers every
+request with a deterministic reply, after 100 ms and 2 ms per token. The same
+trace of repeated requests is sent through ``LiteLLMModel`` without and with
+``CachedModel``, then again with a cold in-memory tier to hit the disk. Streamed
+responses are recorded and replayed, and the replies are checked to be those of
+the server.
+"""
+
+import logging
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from smolagents import ChatMessage, Model
+
+from benchmarks.fake_llm_server import FakeLLMServer
+from src.llm_cache import CachedModel, ResponseCache
+
+N_PROMPTS = 20
+N_REQUESTS = 200
+
+
+def make_trace(rng: np.random.Generator) -> list[list[ChatMessage]]:
+    """Draw requests among a few prompts, the first ones being the most frequent."""
+    probabilities = 1 / np.arange(1, N_PROMPTS + 1)
+    probabilities /= probabilities.sum()
+    return [
+        [
+            ChatMessage(role="system", content="You are a party planner."),
+            ChatMessage(role="user", content=f"Plan party number {prompt}."),
+        ]
+        for prompt in rng.choice(N_PROMPTS, N_REQUESTS, p=probabilities)
+    ]
+
+
+def run_trace(model: Model, trace: list[list[ChatMessage]]) -> tuple[str, list[str]]:
+    """Send the requests of a trace, return a latency summary and the replies."""
+    durations, replies = [], []
+    for messages in trace:
+        start = time.perf_counter()
+        replies.append(model.generate(messages, stop_sequences=["<end>"]).content)
+        durations.append(time.perf_counter() - start)
+    quantiles = statistics.quantiles(durations, n=100)
+    return (
+        f"total={sum(durations):6.2f}s  p50={quantiles[49] * 1000:7.2f} ms"
+        f"  p99={quantiles[98] * 1000:7.2f} ms",
+        replies,
+    )
+
+
+def stream(model: Model, messages: list[ChatMessage]) -> tuple[float, str]:
+    """Stream a response, return its time to first token and its content."""
+    start = time.perf_counter()
+    time_to_first_token, content = None, ""
+    for delta in model.generate_stream(messages):
+        if delta.content:
+            time_to_first_token = time_to_first_token or time.perf_counter() - start
+            content += delta.content
+    return time_to_first_token, content
+
+
+if __name__ == "__main__":
+    for name in ("LiteLLM", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    with FakeLLMServer() as server, tempfile.TemporaryDirectory() as tmp_dir:
+        model = server.model()
+        trace = make_trace(np.random.default_rng(0))
+        model.generate(trace[0])  # warm up the client
+
+        cache_path = Path(tmp_dir) / "llm_responses.sqlite"
+        server.requests = 0
+        summary, expected = run_trace(model, trace)
+        print(f"{'uncached':>12}: {summary}  requests={server.requests}")  # noqa: T201
+
+        cache = ResponseCache(cache_path)
+        server.requests = 0
+        summary, replies = run_trace(CachedModel(model, cache), trace)
+        print(f"{'cached':>12}: {summary}  requests={server.requests}")  # noqa: T201
+        print(f"{'':>12}  {cache.stats}, same replies: {replies == expected}")  # noqa: T201
+
+        cache = ResponseCache(cache_path)
+        server.requests = 0
+        summary, replies = run_trace(CachedModel(model, cache), trace)
+        print(f"{'restarted':>12}: {summary}  requests={server.requests}")  # noqa: T201
+        print(f"{'':>12}  {cache.stats}, same replies: {replies == expected}")  # noqa: T201
+
+        cached_model = CachedModel(model, ResponseCache(Path(tmp_dir) / "stream"))
+        prompts = list({str(messages): messages for messages in trace}.values())
+        for label in ("stream miss", "stream hit"):
+            results = [stream(cached_model, messages) for messages in prompts]
+            replies = [content for _, content in results]
+            print(  # noqa: T201
+                f"{label:>12}: mean time to first token="
+                f"{statistics.mean(ttft for ttft, _ in results) * 1000:7.2f} ms,"
+                f" same replies: {replies == [stream(model, m)[1] for m in prompts]}",
+            )
+        print(f"{'':>12}  {cached_model.cache.stats}")  # noqa: T201
+
+        cache = ResponseCache(Path(tmp_dir) / "small", max_bytes=4_000)
+        run_trace(CachedModel(model, cache), trace)
+        print(f"{'4 kB cap':>12}: {cache.stats}")  # noqa: T201
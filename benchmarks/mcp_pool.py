@@ -0,0 +1,52 @@
+"""Benchmark cold per-request MCP server spawn against the pooled path."""
+
+import statistics
+import time
+
+from smolagents import ToolCollection
+
+from src.mcp import MCPServerPool, get_pubmed_server_parameters, process_mcp_tools
+
+N_REQUESTS = 5
+
+
+def time_cold_spawn() -> list[float]:
+    """Time getting the MCP tools by spawning a server per request."""
+    durations = []
+    for _ in range(N_REQUESTS):
+        start = time.perf_counter()
+        with ToolCollection.from_mcp(
+            get_pubmed_server_parameters(),
+            trust_remote_code=True,
+        ) as tool_collection:
+            process_mcp_tools(tool_collection)
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+def time_pooled() -> list[float]:
+    """Time getting the MCP tools from a long-lived pool."""
+    pool = MCPServerPool(get_pubmed_server_parameters())
+    durations = []
+    try:
+        for _ in range(N_REQUESTS):
+            start = time.perf_counter()
+            pool.get_tools()
+            durations.append(time.perf_counter() - start)
+    finally:
+        pool.close()
+    return durations
+
+
+def report(label: str, durations: list[float]) -> None:
+    """Print the latency summary of a benchmark."""
+    print(  # noqa: T201
+        f"{label:>10}: first={durations[0] * 1000:9.1f} ms"
+        f"  median={statistics.median(durations) * 1000:9.1f} ms"
+        f"  total={sum(durations) * 1000:9.1f} ms",
+    )
+
+
+if __name__ == "__main__":
+    report("cold", time_cold_spawn())
+    report("pooled", time_pooled())
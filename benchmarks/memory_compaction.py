@@ -0,0 +1,110 @@
+"""
+Measure the prompt tokens saved per step by the memory compaction.
+
+A ``CodeAgent`` with the manager's ``max_steps=20`` and ``planning_interval=5`` is
+driven by a scripted model fetching long PubMed-like abstracts, some of them twice,
+and reading back a shortened one through its handle. The input tokens of each
+model call are compared with and without the ``compact_memory`` step callback.
+"""
+
+import itertools
+import logging
+import re
+
+from smolagents import ChatMessage, CodeAgent, Model, tool
+from smolagents.monitoring import TokenUsage
+
+from src.compaction import compact_memory
+from src.router import estimate_tokens
+from src.tools import read_output
+
+N_STEPS = 20
+N_ABSTRACTS = 12
+ABSTRACT_CHARS = 6000
+HANDLE_PATTERN = re.compile(r"read_output\('(out-[0-9a-f]+)'")
+
+
+@tool
+def fetch_abstract(pmid: int) -> str:
+    """
+    Fetch the abstract of a PubMed article.
+
+    Args:
+        pmid: The PubMed identifier of the article.
+
+    """
+    words = itertools.cycle(
+        f"article {pmid} reports that cohort outcomes improved with treatment".split(),
+    )
+    text = " ".join(itertools.islice(words, ABSTRACT_CHARS // 6))
+    return f"PMID {pmid}. {text}"[:ABSTRACT_CHARS]
+
+
+class ScriptedModel(Model):
+    """Model fetching abstracts, reading one back, then answering."""
+
+    def __init__(self) -> None:
+        """Record the input tokens of each call."""
+        super().__init__(model_id="scripted")
+        self.input_tokens: list[int] = []
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        stop_sequences: list[str] | None = None,
+        **kwargs,  # noqa: ANN003, ARG002
+    ) -> ChatMessage:
+        """Return the next step of the script."""
+        step = sum(message.role == "tool-call" for message in messages) + 1
+        handles = HANDLE_PATTERN.findall(str([message.content for message in messages]))
+        if stop_sequences and "<end_plan>" in stop_sequences:
+            content = "1. Fetch the abstracts.\n2. Summarise them.\n<end_plan>"
+        elif step >= N_STEPS:
+            content = "Thought: done.\n<code>\nfinal_answer('summary')\n</code>"
+        elif step == N_STEPS - 1 and handles:
+            content = (
+                "Thought: I need the rest of an early abstract.\n<code>\n"
+                f"print(read_output('{handles[0]}', start=400, length=300))\n</code>"
+            )
+        else:
+            content = (
+                f"Thought: Let me read the next abstract.\n<code>\n"
+                f"print(fetch_abstract(pmid={step % N_ABSTRACTS}))\n</code>"
+            )
+        self.input_tokens.append(estimate_tokens(messages))
+        return ChatMessage(
+            role="assistant",
+            content=content,
+            token_usage=TokenUsage(
+                input_tokens=self.input_tokens[-1],
+                output_tokens=len(content) // 4,
+            ),
+        )
+
+
+def run(*, compacted: bool) -> list[int]:
+    """Run the scripted agent, return the input tokens of its model calls."""
+    model = ScriptedModel()
+    agent = CodeAgent(
+        tools=[fetch_abstract, read_output],
+        model=model,
+        step_callbacks=[compact_memory] if compacted else [],
+        planning_interval=5,
+        max_steps=N_STEPS,
+        verbosity_level=0,
+    )
+    agent.run("Summarise the abstracts of the cohort studies.")
+    return model.input_tokens
+
+
+if __name__ == "__main__":
+    logging.getLogger("smolagents").setLevel(logging.ERROR)
+    baseline = run(compacted=False)
+    compacted = run(compacted=True)
+    print("call  baseline  compacted  saved")  # noqa: T201
+    for call, (before, after) in enumerate(zip(baseline, compacted, strict=True), 1):
+        print(f"{call:>4}  {before:>8,}  {after:>9,}  {1 - after / before:5.1%}")  # noqa: T201
+    print(  # noqa: T201
+        f"total {sum(baseline):>8,}  {sum(compacted):>9,}"
+        f"  {1 - sum(compacted) / sum(baseline):5.1%}",
+    )
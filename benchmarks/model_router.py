@@ -0,0 +1,104 @@
+"""
+Benchmark the tail latency, fallback and limits of the model router.
+
+Two local stand-in chat completion servers answer in 50 ms, except for 3% of the
+requests which take 1 s. Concurrent clients send the same requests to one server
+directly, then through ``RoutedModel`` without and with hedging. The router is
+then run against a primary server failing or rate limiting 20% of the requests,
+the backends not retrying by themselves, and with concurrency and token-rate
+limits.
+"""
+
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from smolagents import ChatMessage, Model
+
+from benchmarks.fake_llm_server import FakeLLMServer, tail_latency
+from src.router import Backend, RoutedModel
+
+N_REQUESTS = 400
+N_CLIENTS = 8
+LATENCY = tail_latency(0.05, 1.0, 0.03)
+
+
+def send_requests(model: Model, n_requests: int = N_REQUESTS) -> str:
+    """Send requests from concurrent clients, return a latency summary."""
+
+    def send(request_number: int) -> float:
+        start = time.perf_counter()
+        model.generate([ChatMessage(role="user", content=f"Task {request_number}")])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(N_CLIENTS) as executor:
+        durations = list(executor.map(send, range(n_requests)))
+    seconds = time.perf_counter() - start
+    quantiles = statistics.quantiles(durations, n=100)
+    return (
+        f"p50={quantiles[49] * 1000:7.1f} ms  p95={quantiles[94] * 1000:7.1f} ms"
+        f"  p99={quantiles[98] * 1000:7.1f} ms  {n_requests / seconds:6.1f} requests/s"
+    )
+
+
+if __name__ == "__main__":
+    for name in ("LiteLLM", "httpx", "openai", "src.logger"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    with (
+        FakeLLMServer(LATENCY, seed=1) as primary,
+        FakeLLMServer(LATENCY, seed=2) as secondary,
+    ):
+        print(f"{'direct':>16}: {send_requests(primary.model())}")  # noqa: T201
+        for label, hedge_budget in (("no hedging", 0.0), ("hedging", 0.1)):
+            router = RoutedModel(
+                [
+                    Backend(
+                        "primary",
+                        primary.model(max_retries=0),
+                        max_concurrency=N_CLIENTS,
+                    ),
+                    Backend(
+                        "secondary",
+                        secondary.model(max_retries=0),
+                        max_concurrency=N_CLIENTS,
+                    ),
+                ],
+                hedge_budget=hedge_budget,
+            )
+            print(f"{label:>16}: {send_requests(router)}  {router.stats}")  # noqa: T201
+
+    with (
+        FakeLLMServer(error_rate=0.1, rate_limit_rate=0.1) as primary,
+        FakeLLMServer() as secondary,
+    ):
+        router = RoutedModel(
+            [
+                Backend("primary", primary.model(max_retries=0)),
+                Backend("secondary", secondary.model(max_retries=0)),
+            ],
+        )
+        print(f"{'failing primary':>16}: {send_requests(router, 100)}")  # noqa: T201
+        print(f"{'':>16}  {router.stats}")  # noqa: T201
+        for backend in router.backends:
+            print(f"{backend.name:>16}  {backend.stats}")  # noqa: T201
+
+    with FakeLLMServer() as server:
+        router = RoutedModel([Backend("limited", server.model(), max_concurrency=2)])
+        print(  # noqa: T201
+            f"{'2 concurrent':>16}: {send_requests(router, 100)}"
+            f"  max in flight={server.max_in_flight}",
+        )
+        router = RoutedModel(
+            [
+                Backend(
+                    "limited",
+                    server.model(),
+                    max_concurrency=N_CLIENTS,
+                    tokens_per_minute=12_000,
+                ),
+            ],
+        )
+        send_requests(router, 300)  # spend the burst of the first minute
+        print(f"{'12k tokens/min':>16}: {send_requests(router, 50)}")  # noqa: T201
@@ -0,0 +1,56 @@
+"""Benchmark nearest-location queries on the memory-mapped location index."""
+
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.locations import LocationIndex
+
+N_LOCATIONS = 100_000
+N_QUERIES = 1000
+
+
+def percentiles_ms(durations: list[float]) -> str:
+    """Format the p50 and p99 of durations in milliseconds."""
+    quantiles = statistics.quantiles(durations, n=100)
+    return f"p50={quantiles[49] * 1000:.3f} ms  p99={quantiles[98] * 1000:.3f} ms"
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        locations_path = Path(tmp_dir) / "locations.csv"
+        pd.DataFrame(
+            {
+                "name": [f"location {i}" for i in range(N_LOCATIONS)],
+                "latitude": np.degrees(np.arcsin(rng.uniform(-1, 1, N_LOCATIONS))),
+                "longitude": rng.uniform(-180, 180, N_LOCATIONS),
+            },
+        ).to_csv(locations_path, index=False)
+
+        start = time.perf_counter()
+        LocationIndex.load(locations_path)
+        print(f"build: {time.perf_counter() - start:.2f}s")  # noqa: T201
+        start = time.perf_counter()
+        index = LocationIndex.load(locations_path)
+        print(f"load: {(time.perf_counter() - start) * 1000:.2f} ms")  # noqa: T201
+
+        queries = zip(
+            np.degrees(np.arcsin(rng.uniform(-1, 1, N_QUERIES))),
+            rng.uniform(-180, 180, N_QUERIES),
+            strict=True,
+        )
+        knn_durations, within_durations = [], []
+        for latitude, longitude in queries:
+            start = time.perf_counter()
+            index.nearest(latitude, longitude, 10)
+            knn_durations.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            index.within(latitude, longitude, 500)
+            within_durations.append(time.perf_counter() - start)
+        print(f"10 nearest: {percentiles_ms(knn_durations)}")  # noqa: T201
+        print(f"within 500 km: {percentiles_ms(within_durations)}")  # noqa: T201
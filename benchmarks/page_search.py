@@ -0,0 +1,115 @@
+"""
+Compare the in-page search with the XPath search it replaced, in a headless Chrome.
+
+Large fixture pages are served by a local HTTP server. Each page is searched for a
+word found on many of its paragraphs, for a rare phrase split by inline elements,
+and for a quoted phrase, which the XPath search could not express. The first
+search of a page includes the injection of the script and the indexing of the page.
+"""
+
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+
+from src.driver import initialize_driver
+from src.page_search import search_page
+
+PAGE_SIZES = (1_000, 10_000, 50_000)
+N_REPEATS = 5
+QUERIES = ("cohort", "follow-up of study 777", "the 'placebo' arm")
+
+
+def make_page(n_paragraphs: int) -> bytes:
+    """Return a page of paragraphs with links, bold text and hidden elements."""
+    paragraphs = "".join(
+        f"<p>Finding {i}: the <b>cohort</b> outcomes improved, see"
+        f" <a href='#{i}'>the follow-up</a> of study {i}."
+        + (" Patients of the 'placebo' arm did not." if i % 100 == 0 else "")
+        + "<span style='display: none'>hidden cohort</span></p>"
+        for i in range(n_paragraphs)
+    )
+    return (
+        f"<html><head><title>{n_paragraphs} paragraphs</title></head><body>"
+        f"<main>{paragraphs}</main></body></html>"
+    ).encode()
+
+
+PAGES = {f"/{size}": make_page(size) for size in PAGE_SIZES}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serve the fixture pages."""
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Answer a page request."""
+        body = PAGES[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:  # noqa: ANN002
+        """Do not log the requests."""
+
+
+def legacy_search(driver: webdriver.Chrome, text: str, nth_result: int = 1) -> int:
+    """Search as search_item_ctrl_f used to, return the number of matches."""
+    elements = driver.find_elements(By.XPATH, f"//*[contains(text(), '{text}')]")
+    if nth_result <= len(elements):
+        driver.execute_script(
+            "arguments[0].scrollIntoView(true);",
+            elements[nth_result - 1],
+        )
+    return len(elements)
+
+
+def measure(driver: webdriver.Chrome, url: str, query: str) -> str:
+    """Time both searches of a query on a freshly loaded page."""
+    driver.get(url)
+    start = time.perf_counter()
+    result = search_page(driver, query)
+    first_time = time.perf_counter() - start
+    times = []
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        search_page(driver, query)
+        times.append(time.perf_counter() - start)
+    line = (
+        f"  {query!r:>26}: search {first_time * 1000:7.1f} ms first,"
+        f" {statistics.median(times) * 1000:6.1f} ms next,"
+        f" {result['total']:>6} matches"
+    )
+
+    legacy_times = []
+    try:
+        for _ in range(N_REPEATS):
+            start = time.perf_counter()
+            legacy_matches = legacy_search(driver, query)
+            legacy_times.append(time.perf_counter() - start)
+    except Exception as error:  # noqa: BLE001
+        return f"{line}; XPath failed: {type(error).__name__}"
+    return (
+        f"{line}; XPath {statistics.median(legacy_times) * 1000:7.1f} ms,"
+        f" {legacy_matches:>6} matches"
+    )
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    driver = initialize_driver(headless=True)
+    try:
+        for size in PAGE_SIZES:
+            megabytes = len(PAGES[f"/{size}"]) / 1e6
+            print(f"{size:,} paragraphs ({megabytes:.1f} MB)")  # noqa: T201
+            for query in QUERIES:
+                url = f"http://127.0.0.1:{server.server_port}/{size}"
+                print(measure(driver, url, query))  # noqa: T201
+    finally:
+        driver.quit()
+        server.shutdown()
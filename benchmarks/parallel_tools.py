@@ -0,0 +1,116 @@
+"""
+Benchmark the parallel execution of the independent tool calls of a step.
+
+A scripted ``CodeAgent`` step asks a managed agent for a report, and looks up the
+travel times of several cities with a side-effect-free tool, both taking
+``TOOL_LATENCY`` seconds. The step runs with a sequential executor, then with
+``ParallelExecutor`` at increasing parallelism: its latency falls from the sum of
+the calls towards the longest one, and its output stays identical.
+"""
+
+import logging
+import time
+
+from smolagents import ChatMessage, CodeAgent, Model, tool
+from smolagents.monitoring import TokenUsage
+
+from src.agents import _fresh_copy
+from src.parallel import ParallelExecutor
+
+TOOL_LATENCY = 0.2
+CITIES = ["Paris", "Tokyo", "Lima", "Oslo", "Cairo", "Perth", "Quito"]
+STEP_CODE = f"""
+report = helper(task="Write a report on Gotham")
+times = [travel_time(origin=city) for city in {CITIES!r}]
+for city, hours in zip({CITIES!r}, times):
+    print(city, hours)
+print(report.splitlines()[-1])
+final_answer(sum(times))
+"""
+
+
+class ScriptedModel(Model):
+    """Model answering with the benchmarked step, or the managed agent's report."""
+
+    def __init__(self, code: str) -> None:
+        """Answer with ``code``."""
+        super().__init__(model_id="scripted")
+        self.code = code
+
+    def generate(
+        self,
+        messages: list[ChatMessage],  # noqa: ARG002
+        stop_sequences: list[str] | None = None,  # noqa: ARG002
+        **kwargs,  # noqa: ANN003, ARG002
+    ) -> ChatMessage:
+        """Return the scripted code."""
+        return ChatMessage(
+            role="assistant",
+            content=f"<code>\n{self.code}\n</code>",
+            token_usage=TokenUsage(input_tokens=0, output_tokens=0),
+        )
+
+
+@tool
+def travel_time(origin: str) -> float:
+    """
+    Return the travel time from a city to Gotham, slowly.
+
+    Args:
+        origin: The city.
+
+    """
+    time.sleep(TOOL_LATENCY)
+    return float(len(origin))
+
+
+travel_time.side_effect_free = True
+
+
+@tool
+def slow_report() -> str:
+    """Write a report, slowly."""
+    time.sleep(TOOL_LATENCY)
+    return "Gotham is dark."
+
+
+def get_agent(max_parallelism: int) -> CodeAgent:
+    """Return the scripted agent, its executor running calls in parallel if > 1."""
+    helper = CodeAgent(
+        tools=[slow_report],
+        model=ScriptedModel("final_answer(slow_report())"),
+        name="helper",
+        description="A managed agent writing reports.",
+        verbosity_level=0,
+    )
+    agent = CodeAgent(
+        tools=[travel_time],
+        model=ScriptedModel(STEP_CODE),
+        managed_agents=[helper],
+        max_steps=1,
+        verbosity_level=0,
+    )
+    if max_parallelism > 1:
+        agent.python_executor = ParallelExecutor(
+            agent.python_executor,
+            copy_agent=_fresh_copy,
+            max_parallelism=max_parallelism,
+        )
+    return agent
+
+
+if __name__ == "__main__":
+    logging.getLogger("src.logger").setLevel(logging.WARNING)
+    reference = None
+    for max_parallelism in (1, 2, 4, 8):
+        agent = get_agent(max_parallelism)
+        start = time.perf_counter()
+        answer = agent.run("Sum the travel times")
+        seconds = time.perf_counter() - start
+        output = (answer, agent.memory.steps[-1].observations)
+        reference = reference or output
+        print(  # noqa: T201
+            f"parallelism={max_parallelism}: {seconds:5.2f}s"
+            f"  same output={output == reference}",
+        )
+    print(f"sum of the calls: {(len(CITIES) + 1) * TOOL_LATENCY:.2f}s")  # noqa: T201
@@ -0,0 +1,73 @@
+"""Benchmark the per-step cost of handling browser screenshots."""
+
+import statistics
+import time
+import tracemalloc
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+from smolagents.agents import ActionStep
+from smolagents.monitoring import Timing
+from smolagents.utils import encode_image_base64
+
+from src.screenshots import ScreenshotStore
+
+N_STEPS = 20
+
+
+def make_screenshot(step_number: int) -> bytes:
+    """Draw a text-heavy 1000x1350 page, changing with the step number."""
+    image = Image.new("RGB", (1000, 1350), "white")
+    draw = ImageDraw.Draw(image)
+    for line in range(80):
+        draw.text((20, 15 * line), f"Step {step_number} line {line} " * 6, "black")
+    draw.rectangle((30 * step_number, 1250, 30 * step_number + 300, 1340), "steelblue")
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def legacy_add(steps: list[ActionStep], memory_step: ActionStep, png: bytes) -> None:
+    """Handle a screenshot as save_screenshot used to."""
+    for previous_memory_step in steps:
+        if previous_memory_step.step_number <= memory_step.step_number - 2:
+            previous_memory_step.observations_images = None
+    memory_step.observations_images = [Image.open(BytesIO(png)).copy()]
+
+
+def run(label: str, screenshots: list[bytes]) -> None:
+    """Handle a run of screenshots and print its cost."""
+    store = ScreenshotStore()
+    steps = []
+    durations = []
+    sent_bytes = 0
+    tracemalloc.start()
+    for step_number, png in enumerate(screenshots, start=1):
+        memory_step = ActionStep(step_number=step_number, timing=Timing(time.time()))
+        steps.append(memory_step)
+        start = time.perf_counter()
+        if label == "legacy":
+            legacy_add(steps, memory_step, png)
+        else:
+            store.add(memory_step, png)
+        durations.append(time.perf_counter() - start)
+        # What the model receives at this step
+        sent_bytes += sum(
+            len(encode_image_base64(image))
+            for step in steps
+            for image in step.observations_images or []
+        )
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(  # noqa: T201
+        f"{label:>6}: capture={statistics.mean(durations) * 1000:7.2f} ms/step"
+        f"  peak memory={peak_memory / 1e6:7.1f} MB"
+        f"  image bytes sent={sent_bytes / N_STEPS / 1e3:8.1f} kB/step",
+    )
+
+
+if __name__ == "__main__":
+    # Every other step leaves the page unchanged
+    screenshots = [make_screenshot(step // 2) for step in range(N_STEPS)]
+    run("legacy", screenshots)
+    run("store", screenshots)
@@ -0,0 +1,145 @@
+"""
+Load test the agent server with 1, 10 and 50 concurrent users.
+
+Each user runs ``RUNS_PER_USER`` tasks one after the other on a ``CodeAgent``
+driven by a fake model answering in ``MODEL_LATENCY`` seconds, through
+``AgentServer`` and the app's chat streaming. Runs refused because the queue is
+full are retried after ``RETRY_DELAY`` seconds. Throughput, run latency from
+submission to final answer and refusals are reported, then the cancellation of
+abandoned runs is checked.
+"""
+
+import functools
+import logging
+import statistics
+import threading
+import time
+from collections.abc import Iterator
+
+import gradio as gr
+from smolagents import ChatMessage, CodeAgent, Model
+from smolagents.monitoring import TokenUsage
+
+from src.chat import stream_chat_messages
+from src.serving import AgentServer, QueueFullError, QueuePosition
+
+WORKERS = 8
+QUEUE_SIZE = 24
+RUNS_PER_USER = 4
+N_STEPS = 3
+MODEL_LATENCY = 0.1
+RETRY_DELAY = 0.5
+
+
+class FakeModel(Model):
+    """Model answering with ``N_STEPS`` code steps, then the final answer."""
+
+    def __init__(self) -> None:
+        """Create the model."""
+        super().__init__(model_id="fake")
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        stop_sequences: list[str] | None = None,  # noqa: ARG002
+        **kwargs,  # noqa: ANN003, ARG002
+    ) -> ChatMessage:
+        """Return the next step, after ``MODEL_LATENCY`` seconds."""
+        time.sleep(MODEL_LATENCY)
+        step = sum(message.role == "tool-call" for message in messages) + 1
+        code = "final_answer('done')" if step >= N_STEPS else f"print({step})"
+        return ChatMessage(
+            role="assistant",
+            content=f"<code>\n{code}\n</code>",
+            token_usage=TokenUsage(input_tokens=0, output_tokens=0),
+        )
+
+
+def run_agent(task: str) -> Iterator[list[gr.ChatMessage]]:
+    """Run a fake agent, as the app's job."""
+    agent = CodeAgent(tools=[], model=FakeModel(), verbosity_level=0)
+    yield from stream_chat_messages(agent, task)
+
+
+def simulate_user(
+    server: AgentServer,
+    user: str,
+    latencies: list[float],
+    refusals: list[int],
+) -> None:
+    """Run tasks one after the other, retrying the ones refused."""
+    for run_number in range(RUNS_PER_USER):
+        while True:
+            try:
+                run = server.submit(
+                    user,
+                    functools.partial(run_agent, f"Task {run_number}"),
+                )
+                break
+            except QueueFullError:
+                refusals.append(1)
+                time.sleep(RETRY_DELAY)
+        for _ in run.updates():
+            pass
+        latencies.append(run.finished_at - run.submitted_at)
+
+
+def load_test(n_users: int) -> str:
+    """Simulate concurrent users, return a summary of their runs."""
+    server = AgentServer(
+        workers=WORKERS,
+        queue_size=QUEUE_SIZE,
+        runs_per_minute=RUNS_PER_USER,
+    )
+    latencies: list[float] = []
+    refusals: list[int] = []
+    users = [
+        threading.Thread(
+            target=simulate_user,
+            args=(server, f"user-{i}", latencies, refusals),
+        )
+        for i in range(n_users)
+    ]
+    start = time.perf_counter()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    seconds = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    p50, p99 = (quantiles[49], quantiles[98]) if quantiles else (latencies[0],) * 2
+    return (
+        f"{n_users:>3} users: {len(latencies) / seconds:5.2f} runs/s"
+        f"  p50={p50:5.2f}s  p99={p99:5.2f}s  refused={len(refusals)}"
+    )
+
+
+def check_cancellation() -> str:
+    """Abandon runs once they started, return whether their workers were freed."""
+    server = AgentServer(workers=1, queue_size=4, abandon_timeout=0.2)
+    first = server.submit("alice", lambda: run_agent("Task"))
+    second = server.submit("bob", lambda: run_agent("Task"))
+    positions = []
+    for update in second.updates():
+        if isinstance(update, QueuePosition):
+            positions.append(update.position)
+            continue
+        break  # closes the updates, cancelling the run
+    # alice never reads the updates of her run, which is abandoned
+    time.sleep(N_STEPS * MODEL_LATENCY * 2)
+    return (
+        f"queue positions seen by bob: {positions}"
+        f", alice's run: {first.status}, bob's run: {second.status}"
+    )
+
+
+if __name__ == "__main__":
+    for name in ("src.logger", "smolagents"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    print(  # noqa: T201
+        f"{WORKERS} workers, queue of {QUEUE_SIZE}, {RUNS_PER_USER} runs per user"
+        f" of {N_STEPS} model calls of {MODEL_LATENCY}s",
+    )
+    for n_users in (1, 10, 50):
+        print(load_test(n_users))  # noqa: T201
+    print(check_cancellation())  # noqa: T201
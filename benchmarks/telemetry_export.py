@@ -0,0 +1,72 @@
+"""
+Benchmark the span export cost seen by agent steps.
+
+A local stand-in OTLP HTTP server answers every export after ``EXPORT_LATENCY``
+seconds. With the synchronous processor this latency is added to every step, with
+the batching processor used by ``setup_langfuse`` it is not.
+"""
+
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+
+from src.logger import CountingBatchSpanProcessor
+
+EXPORT_LATENCY = 0.05
+N_STEPS = 20
+SPANS_PER_STEP = 5
+
+
+class SlowOTLPHandler(BaseHTTPRequestHandler):
+    """OTLP HTTP endpoint accepting every export after a fixed latency."""
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Swallow the exported spans."""
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(EXPORT_LATENCY)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args) -> None:  # noqa: ANN002
+        """Silence the request logs."""
+
+
+def time_steps(span_processor: SpanProcessor) -> list[float]:
+    """Time fake agent steps each emitting a few spans."""
+    trace_provider = TracerProvider()
+    trace_provider.add_span_processor(span_processor)
+    tracer = trace_provider.get_tracer(__name__)
+    durations = []
+    for step in range(N_STEPS):
+        start = time.perf_counter()
+        with tracer.start_as_current_span(f"step {step}"):
+            for call in range(SPANS_PER_STEP - 1):
+                with tracer.start_as_current_span(f"call {call}"):
+                    pass
+        durations.append(time.perf_counter() - start)
+    trace_provider.shutdown()
+    return durations
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowOTLPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}/v1/traces"
+
+    for label, span_processor in [
+        ("simple", SimpleSpanProcessor(OTLPSpanExporter(endpoint=endpoint))),
+        ("batch", CountingBatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint))),
+    ]:
+        durations = time_steps(span_processor)
+        print(  # noqa: T201
+            f"{label:>6}: mean step latency={statistics.mean(durations) * 1000:8.2f} ms"
+            f"  max={max(durations) * 1000:8.2f} ms",
+        )
+    server.shutdown()
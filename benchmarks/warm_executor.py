@@ -0,0 +1,140 @@
+"""
+Measure the latency of the first code step of a run, with and without warm workers.
+
+Without the pool, the first step of a run imports geopandas, plotly and pandas
+in the server process, measured in a fresh interpreter for each run. With the
+pool, the runs lease workers forked from a fork server which imported them
+once, warmed up in the background and recycled every few runs. A runaway
+snippet is then stopped by the CPU time limit while the server keeps answering.
+"""
+
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from smolagents.default_tools import FinalAnswerTool
+from smolagents.local_python_executor import InterpreterError, LocalPythonExecutor
+
+from src.sandbox import PooledExecutor, WarmExecutorPool
+
+N_RUNS = 8
+IMPORTS = ["geopandas", "plotly", "plotly.express", "shapely", "pandas", "numpy"]
+FIRST_STEP = """
+import geopandas as gpd
+import pandas as pd
+import plotly.express as px
+import shapely
+
+ports = gpd.GeoDataFrame(
+    {"name": ["Rotterdam", "Shanghai", "Santos"]},
+    geometry=shapely.points([(4.4, 51.9), (121.5, 31.2), (-46.3, -23.9)]),
+)
+figure = px.scatter_geo(lat=ports.geometry.y, lon=ports.geometry.x)
+print(pd.Series(ports["name"]).str.len().sum())
+"""
+SECOND_STEP = "print(len(ports))"
+RUNAWAY_STEP = "while True:\n    pass"
+
+
+def cold_first_step() -> float:
+    """Time the first step run by a local executor, in this fresh interpreter."""
+    executor = LocalPythonExecutor(IMPORTS)
+    executor.send_tools({"final_answer": FinalAnswerTool()})
+    start = time.perf_counter()
+    executor(FIRST_STEP)
+    return time.perf_counter() - start
+
+
+def wait_idle(pool: WarmExecutorPool) -> float:
+    """Wait until the pool has all its idle workers, return the time it took."""
+    start = time.perf_counter()
+    while pool._idle.qsize() < pool.size:  # noqa: SLF001
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+
+def warm_run(pool: WarmExecutorPool) -> tuple[float, float]:
+    """Time the first and second steps of a run in a worker of the pool."""
+    # The runs are spaced by model calls, during which recycled workers restart
+    wait_idle(pool)
+    executor = PooledExecutor(IMPORTS, pool=pool)
+    executor.send_tools({"final_answer": FinalAnswerTool()})
+    start = time.perf_counter()
+    executor(FIRST_STEP)
+    first_step = time.perf_counter() - start
+    start = time.perf_counter()
+    executor(SECOND_STEP)
+    second_step = time.perf_counter() - start
+    executor.cleanup()
+    return first_step, second_step
+
+
+def runaway_step(pool: WarmExecutorPool) -> str:
+    """Run a runaway step, and measure how late the server answers meanwhile."""
+    executor = PooledExecutor(IMPORTS, pool=pool)
+    executor.send_tools({"final_answer": FinalAnswerTool()})
+    lateness = []
+    stopped = threading.Event()
+
+    def tick() -> None:
+        while not stopped.is_set():
+            start = time.perf_counter()
+            time.sleep(0.01)
+            lateness.append(time.perf_counter() - start - 0.01)
+
+    threading.Thread(target=tick, daemon=True).start()
+    start = time.perf_counter()
+    try:
+        executor(RUNAWAY_STEP)
+    except InterpreterError as error:
+        message = str(error)
+    stopped.set()
+    executor.cleanup()
+    return (
+        f"runaway step: stopped after {time.perf_counter() - start:.2f}s"
+        f" ({message!r}), server timer late by at most"
+        f" {max(lateness) * 1000:.1f} ms"
+    )
+
+
+def summary(label: str, durations: list[float]) -> str:
+    """Return the median and maximum of durations, in milliseconds."""
+    return (
+        f"{label:>30}: median={statistics.median(durations) * 1000:8.1f} ms"
+        f"  max={max(durations) * 1000:8.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    if "--cold" in sys.argv:
+        print(cold_first_step())  # noqa: T201
+        sys.exit()
+
+    cold = [
+        float(
+            subprocess.run(  # noqa: S603
+                [sys.executable, "-m", "benchmarks.warm_executor", "--cold"],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout,
+        )
+        for _ in range(N_RUNS)
+    ]
+
+    pool = WarmExecutorPool(size=2, max_tasks=3, cpu_seconds=2)
+    pool.start()
+    warmup = wait_idle(pool)
+    warm = [warm_run(pool) for _ in range(N_RUNS)]
+
+    print(  # noqa: T201
+        f"{N_RUNS} runs, workers recycled every {pool.max_tasks} runs,"
+        f" pool warmed up in {warmup:.2f}s at startup",
+    )
+    print(summary("cold first step", cold))  # noqa: T201
+    print(summary("warm first step", [first for first, _ in warm]))  # noqa: T201
+    print(summary("warm second step", [second for _, second in warm]))  # noqa: T201
+    print(runaway_step(pool))  # noqa: T201
+    pool.close()
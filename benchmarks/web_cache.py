@@ -0,0 +1,197 @@
+"""
+Measure the web cache and the page extraction against a local fixture server.
+
+The fixture server serves pages padded with navigation, banners and scripts,
+validated by ``ETag``, by ``Last-Modified`` or fresh for a minute, and answers
+conditional requests with ``304 Not Modified``. It also answers searches in the
+Serper format. Users visit pages and run searches drawn from a skewed
+distribution, through the cached tools, then again after a restart of the
+process, simulated with a new cache on the same database. The cache hit ratio,
+bytes downloaded and saved, and the text returned are compared with the stock
+``VisitWebpageTool``.
+"""
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from markdownify import markdownify
+from smolagents import VisitWebpageTool
+
+from src.web import (
+    CachedGoogleSearchTool,
+    CachedVisitWebpageTool,
+    WebCache,
+    extract_text,
+)
+
+N_PAGES = 20
+N_QUERIES = 6
+N_USERS = 5
+VISITS_PER_USER = 30
+SEARCHES_PER_USER = 10
+LAST_MODIFIED = formatdate(time.time() - 86400, usegmt=True)
+BOILERPLATE = (
+    "<header><a href='/'>Home</a> <a href='/about'>About</a></header>"
+    "<nav>{links}</nav>"
+    "<div class='cookie-banner'>We use cookies to improve your experience."
+    " <button>Accept</button></div>"
+    "<script>{script}</script><style>body {{ font-family: sans-serif; }}</style>"
+)
+
+
+def make_page(number: int) -> bytes:
+    """Return a 40 KB article page wrapped in navigation, banners and scripts."""
+    links = "".join(f"<li><a href='/page/{i}'>Page {i}</a></li>" for i in range(200))
+    script = "var tracking = {};" * 400
+    paragraphs = "".join(
+        f"<p>Finding {i} of study {number}: the cohort outcomes improved with the"
+        f" treatment, see <a href='/page/{(number + i) % N_PAGES}'>the follow-up"
+        "</a>.</p>"
+        for i in range(40)
+    )
+    return (
+        f"<html><head><title>Study {number}</title></head><body>"
+        f"{BOILERPLATE.format(links=links, script=script)}"
+        f"<main><h1>Study {number}</h1>{paragraphs}</main>"
+        "<aside class='related'>Related studies</aside>"
+        "<footer>Copyright, contact and legal notices.</footer></body></html>"
+    ).encode()
+
+
+PAGES = [make_page(number) for number in range(N_PAGES)]
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serve the pages with validators and the searches."""
+
+    served_bytes = 0
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Answer a page request, conditionally, or a search."""
+        url = urlparse(self.path)
+        if url.path == "/search":
+            query = parse_qs(url.query)["q"][0]
+            body = json.dumps(
+                {
+                    "organic": [
+                        {
+                            "title": f"{query} result {i}",
+                            "link": f"http://fixture/page/{i}",
+                            "snippet": f"About {query}.",
+                        }
+                        for i in range(10)
+                    ],
+                },
+            ).encode()
+            self.reply(200, {"Content-Type": "application/json"}, body)
+            return
+        number = int(url.path.rsplit("/", 1)[-1])
+        body = PAGES[number]
+        etag = f'"{hashlib.md5(body).hexdigest()}"'  # noqa: S324
+        # Pages are validated by ETag, by Last-Modified, or fresh for a minute
+        headers = [
+            {"ETag": etag},
+            {"Last-Modified": LAST_MODIFIED},
+            {"ETag": etag, "Cache-Control": "max-age=60"},
+        ][number % 3]
+        if (
+            self.headers.get("If-None-Match") == headers.get("ETag")
+            or self.headers.get("If-Modified-Since") == headers.get("Last-Modified")
+        ) and ("If-None-Match" in self.headers or "If-Modified-Since" in self.headers):
+            self.reply(304, headers, b"")
+            return
+        self.reply(200, {"Content-Type": "text/html", **headers}, body)
+
+    def reply(self, status: int, headers: dict[str, str], body: bytes) -> None:
+        """Send a response."""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        FixtureHandler.served_bytes += len(body)
+
+    def log_message(self, *args) -> None:  # noqa: ANN002
+        """Do not log the requests."""
+
+
+def simulate_users(cache: WebCache, base_url: str, seed: int) -> tuple[int, float]:
+    """Visit pages and search as the users do, return the characters returned."""
+    visit = CachedVisitWebpageTool(cache=cache)
+    search = CachedGoogleSearchTool("serper", cache=cache)
+    search.base_url = f"{base_url}/search"
+    rng = random.Random(seed)  # noqa: S311
+    returned_chars = 0
+    start = time.perf_counter()
+    for _ in range(N_USERS):
+        for _ in range(VISITS_PER_USER):
+            number = min(int(rng.paretovariate(1.2)) - 1, N_PAGES - 1)
+            returned_chars += len(visit(f"{base_url}/page/{number}"))
+        for _ in range(SEARCHES_PER_USER):
+            search(f"query {min(int(rng.paretovariate(1.2)) - 1, N_QUERIES - 1)}")
+    return returned_chars, time.perf_counter() - start
+
+
+def measure_extraction() -> str:
+    """Compare the extraction with the markdown conversion of the stock tool."""
+    start = time.perf_counter()
+    markdown = [markdownify(page.decode()) for page in PAGES]
+    markdown_time = (time.perf_counter() - start) / N_PAGES
+    start = time.perf_counter()
+    texts = [extract_text(page, "http://fixture/") for page in PAGES]
+    extraction_time = (time.perf_counter() - start) / N_PAGES
+    return (
+        f"extraction: {sum(map(len, texts)) // N_PAGES:,} characters in"
+        f" {extraction_time * 1000:.1f} ms per page, against"
+        f" {sum(map(len, markdown)) // N_PAGES:,} in {markdown_time * 1000:.1f} ms"
+        " for the markdown conversion"
+    )
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SERPER_API_KEY", "fixture")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    stock = VisitWebpageTool()
+    rng = random.Random(0)  # noqa: S311
+    stock_chars = 0
+    start = time.perf_counter()
+    for _ in range(N_USERS * VISITS_PER_USER):
+        number = min(int(rng.paretovariate(1.2)) - 1, N_PAGES - 1)
+        stock_chars += len(stock(f"{base_url}/page/{number}"))
+    stock_time = time.perf_counter() - start
+    print(  # noqa: T201
+        f"{N_USERS} users, {VISITS_PER_USER} visits of {N_PAGES} pages and"
+        f" {SEARCHES_PER_USER} searches of {N_QUERIES} queries each",
+    )
+    print(  # noqa: T201
+        f"stock tool: {FixtureHandler.served_bytes:,} bytes downloaded,"
+        f" {stock_chars // (N_USERS * VISITS_PER_USER):,} characters per visit,"
+        f" {stock_time:.2f}s",
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "web_pages.sqlite"
+        for label, seed in (("cold start", 0), ("after restart", 1)):
+            FixtureHandler.served_bytes = 0
+            cache = WebCache(path)
+            returned_chars, seconds = simulate_users(cache, base_url, seed)
+            print(  # noqa: T201
+                f"{label}: {cache.stats}; {FixtureHandler.served_bytes:,} bytes"
+                f" served, {returned_chars // (N_USERS * VISITS_PER_USER):,}"
+                f" characters per visit, {seconds:.2f}s",
+            )
+    print(measure_extraction())  # noqa: T201
+    server.shutdown()
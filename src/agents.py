@@ -1,15 +1,38 @@
 """Agents module."""
 
-from smolagents import (
-    CodeAgent,
-    DuckDuckGoSearchTool,
-    GoogleSearchTool,
-    Model,
-    VisitWebpageTool,
-)
+import copy
+import os
+import threading
+import time
+from collections.abc import Callable, Generator
 
-from src.browser_tools import close_popups, go_back, save_screenshot, search_item_ctrl_f
-from src.tools import calculate_cargo_travel_time
+from smolagents import CodeAgent, Model, MultiStepAgent, Tool
+from smolagents.memory import AgentMemory, CallbackRegistry
+from smolagents.monitoring import Monitor
+
+from src.async_bridge import AsyncToolsExecutor
+from src.driver import browser_driver
+from src.logger import logger
+from src.models import get_model
+from src.parallel import TOOL_MAX_PARALLELISM, ParallelExecutor
+from src.registry import agents, step_callbacks, tools
+from src.sandbox import PooledExecutor, code_worker_pool
+
+MANAGER_AUTHORIZED_IMPORTS = [
+    "geopandas",
+    "plotly",
+    "plotly.graph_objects",
+    "plotly.express",
+    "plotly.express.colors",
+    "plotly.express.colors.sequential",
+    "plotly.express.graph_objects",
+    "matplotlib",
+    "matplotlib.pyplot",
+    "shapely",
+    "json",
+    "pandas",
+    "numpy",
+]
 
 
 def get_web_agent(model: Model) -> CodeAgent:
@@ -17,25 +40,155 @@ def get_web_agent(model: Model) -> CodeAgent:
     return CodeAgent(
         model=model,
         tools=[
-            GoogleSearchTool("serper"),
-            VisitWebpageTool(),
-            calculate_cargo_travel_time,
+            tools.create("web_search", "serper"),
+            tools.create("visit_webpage"),
+            tools.create("calculate_cargo_travel_time"),
+            tools.create("read_output"),
         ],
         name="web_agent",
         description="A web agent that can search the web and visit webpages.",
+        step_callbacks=[step_callbacks.get("compact_memory")],
         max_steps=10,
         verbosity_level=0,
         add_base_tools=False,
     )
 
 
+class BrowserAgent(CodeAgent):
+    """Code agent holding the browser for the duration of each of its runs."""
+
+    def _run_stream(self, *args, **kwargs) -> Generator:  # noqa: ANN002, ANN003
+        """Run the agent's steps, in a browser session released when they end."""
+        with browser_driver.session():
+            yield from super()._run_stream(*args, **kwargs)
+
+
 def get_browser_agent(model: Model) -> CodeAgent:
     """Initialize the CodeAgent with the specified model."""
-    return CodeAgent(
-        tools=[DuckDuckGoSearchTool(), go_back, close_popups, search_item_ctrl_f],
+    return BrowserAgent(
+        tools=[
+            tools.create("duckduckgo_search"),
+            tools.create("go_back"),
+            tools.create("close_popups"),
+            tools.create("search_item_ctrl_f"),
+            tools.create("read_output"),
+        ],
         model=model,
         additional_authorized_imports=["helium"],
-        step_callbacks=[save_screenshot],
+        step_callbacks=[
+            step_callbacks.get("save_screenshot"),
+            step_callbacks.get("compact_memory"),
+        ],
         max_steps=20,
         verbosity_level=2,
     )
+
+
+def get_manager_agent(model: Model, mcp_tools: list[Tool]) -> CodeAgent:
+    """Return the top-level agent served by the app, managing a web agent."""
+    manager_tools = [
+        tools.create("calculate_cargo_travel_time"),
+        tools.create("calculate_cargo_travel_times"),
+        tools.create("read_output"),
+        *mcp_tools,
+    ]
+    if locations_path := os.getenv("LOCATIONS_PATH"):
+        manager_tools.append(tools.create("nearest_locations", locations_path))
+    return CodeAgent(
+        tools=manager_tools,
+        model=model,
+        managed_agents=[agents.create("web", model)],
+        add_base_tools=False,
+        additional_authorized_imports=MANAGER_AUTHORIZED_IMPORTS,
+        planning_interval=5,
+        step_callbacks=[step_callbacks.get("compact_memory")],
+        verbosity_level=2,
+        max_steps=20,
+        stream_outputs=True,
+    )
+
+
+def _freeze_system_prompt(agent: MultiStepAgent) -> None:
+    """Render the system prompt once instead of at every run."""
+    system_prompt = agent.system_prompt
+    agent.initialize_system_prompt = lambda: system_prompt
+    for managed_agent in agent.managed_agents.values():
+        _freeze_system_prompt(managed_agent)
+
+
+def _fresh_copy(agent: MultiStepAgent) -> MultiStepAgent:
+    """Copy an agent, sharing its model and tools but not its per-run state."""
+    clone = copy.copy(agent)
+    clone.managed_agents = {
+        name: _fresh_copy(managed_agent)
+        for name, managed_agent in agent.managed_agents.items()
+    }
+    clone.task = None
+    clone.step_number = 0
+    clone.state = {}
+    clone.memory = AgentMemory(clone.system_prompt)
+    clone.monitor = Monitor(clone.model, clone.logger)
+    clone.step_callbacks = CallbackRegistry()
+    for step_cls, callbacks in agent.step_callbacks._callbacks.items():  # noqa: SLF001
+        for callback in callbacks:
+            clone.step_callbacks.register(
+                step_cls,
+                clone.monitor.update_metrics
+                if callback == agent.monitor.update_metrics
+                else callback,
+            )
+    if isinstance(clone, CodeAgent):
+        # The code of the agents importing heavy modules runs in warm workers
+        clone.python_executor = (
+            PooledExecutor(
+                clone.additional_authorized_imports,
+                clone.max_print_outputs_length,
+            )
+            if code_worker_pool.warms(clone.additional_authorized_imports)
+            else clone.create_python_executor()
+        )
+        if TOOL_MAX_PARALLELISM > 1:
+            clone.python_executor = ParallelExecutor(
+                clone.python_executor,
+                copy_agent=_fresh_copy,
+            )
+        clone.python_executor = AsyncToolsExecutor(clone.python_executor)
+    return clone
+
+
+class AgentFactory:
+    """
+    Build an agent graph once and hand out cheap copies of it with fresh memory.
+
+    The model clients, tool instances and rendered system prompts are built on the
+    first call and shared by every agent handed out afterwards.
+    """
+
+    def __init__(self, build_agent: Callable[[], MultiStepAgent]) -> None:
+        """Store the function building the agent graph, it is called lazily."""
+        self.build_agent = build_agent
+        self._template: MultiStepAgent | None = None
+        self._lock = threading.Lock()
+
+    def new_agent(self) -> MultiStepAgent:
+        """Return an agent with its own memory, state and code executor."""
+        with self._lock:
+            if self._template is None:
+                start = time.perf_counter()
+                self._template = self.build_agent()
+                _freeze_system_prompt(self._template)
+                logger.info(
+                    f"Built agent graph in {time.perf_counter() - start:.2f}s",
+                )
+        return _fresh_copy(self._template)
+
+
+def get_manager_factory() -> AgentFactory:
+    """Return the factory of the manager agent, with its PubMed MCP tools."""
+    return AgentFactory(
+        lambda: agents.create(
+            "manager",
+            get_model(os.getenv("AGENT_MODEL", "mistral")),
+            tools.create("pubmed"),
+        ),
+    )
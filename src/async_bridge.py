@@ -0,0 +1,218 @@
+"""
+Asynchronous runs of the synchronous smolagents agents, bridged with greenlets.
+
+``iterate_async`` runs a synchronous generator, such as an agent run, in a
+greenlet on the running event loop and yields its items asynchronously. When the
+code of the greenlet waits for I/O through ``await_sync`` (model requests, MCP
+calls) the greenlet is suspended and the event loop awaits the I/O, free to run
+other sessions meanwhile, as SQLAlchemy does for its asyncio support. Blocking
+calls that cannot be awaited run in the default executor of the loop with
+``call_blocking``. Outside of a bridged greenlet, all of these block as usual, so
+the same agents serve both the threaded and the asynchronous run paths.
+"""
+
+import asyncio
+import concurrent.futures
+import dataclasses
+import functools
+import inspect
+from collections.abc import AsyncGenerator, Awaitable, Callable, Generator, Iterator
+from types import SimpleNamespace
+from typing import Any
+
+import greenlet
+from huggingface_hub import AsyncInferenceClient
+from smolagents import InferenceClientModel, LiteLLMModel, Model, MultiStepAgent
+from smolagents.local_python_executor import PythonExecutor
+
+
+class BridgeGreenlet(greenlet.greenlet):
+    """Greenlet running synchronous code for ``iterate_async``."""
+
+
+@dataclasses.dataclass
+class Await:
+    """Awaitable sent by a bridged greenlet to the event loop."""
+
+    awaitable: Awaitable
+
+
+@dataclasses.dataclass
+class Item:
+    """Item yielded by the generator of a bridged greenlet."""
+
+    item: Any
+
+
+def in_bridge() -> bool:
+    """Return whether the current code runs in a bridged greenlet."""
+    return isinstance(greenlet.getcurrent(), BridgeGreenlet)
+
+
+def await_sync(awaitable: Awaitable) -> Any:  # noqa: ANN401
+    """Await ``awaitable`` on the event loop from a bridged greenlet."""
+    if not in_bridge():
+        msg = "await_sync can only be called from code run by iterate_async"
+        raise RuntimeError(msg)
+    return greenlet.getcurrent().parent.switch(Await(awaitable))
+
+
+def wait_future(future: concurrent.futures.Future) -> Any:  # noqa: ANN401
+    """Return the result of a future, awaited if in a bridged greenlet."""
+    if in_bridge():
+        return await_sync(asyncio.wrap_future(future))
+    return future.result()
+
+
+def call_blocking(function: Callable, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+    """Call a blocking function, in a thread if in a bridged greenlet."""
+    if in_bridge():
+        return await_sync(asyncio.to_thread(function, *args, **kwargs))
+    return function(*args, **kwargs)
+
+
+async def iterate_async(
+    function: Callable[..., Iterator],
+    *args,  # noqa: ANN002
+    **kwargs,  # noqa: ANN003
+) -> AsyncGenerator:
+    """
+    Yield the items of ``function(*args, **kwargs)``, run in a bridged greenlet.
+
+    Closing the asynchronous generator closes the synchronous one.
+    """
+
+    def run() -> None:
+        iterator = function(*args, **kwargs)
+        try:
+            for item in iterator:
+                bridge.parent.switch(Item(item))
+        finally:
+            if isinstance(iterator, Generator):
+                iterator.close()
+
+    bridge = BridgeGreenlet(run)
+    message = bridge.switch()
+    try:
+        while not bridge.dead:
+            if isinstance(message, Await):
+                try:
+                    result = await message.awaitable
+                except Exception as error:  # noqa: BLE001
+                    message = bridge.throw(error)
+                else:
+                    message = bridge.switch(result)
+            else:
+                yield message.item
+                message = bridge.switch()
+    finally:
+        if not bridge.dead:
+            # Unwinds the greenlet with GreenletExit, closing the generator
+            bridge.throw()
+
+
+class AsyncModelClient:
+    """
+    Model API client whose completions are awaited in bridged greenlets.
+
+    It replaces the ``client`` of a ``LiteLLMModel``, the ``litellm`` module, or of
+    an ``InferenceClientModel``, whose other attributes it returns. Completions
+    are sent with ``async_completion``, which takes the same arguments.
+    """
+
+    def __init__(
+        self,
+        client: Any,  # noqa: ANN401
+        async_completion: Callable[..., Awaitable],
+    ) -> None:
+        """Wrap ``client``."""
+        self.client = client
+        self.async_completion = async_completion
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        """Return the attributes of the client."""
+        return getattr(self.client, name)
+
+    def completion(self, **kwargs) -> Any:  # noqa: ANN003, ANN401
+        """Return a LiteLLM completion, or an iterator over its chunks."""
+        return self._complete(self.client.completion, kwargs)
+
+    def chat_completion(self, **kwargs) -> Any:  # noqa: ANN003, ANN401
+        """Return a Hugging Face chat completion, or an iterator over its chunks."""
+        return self._complete(self.client.chat_completion, kwargs)
+
+    @property
+    def chat(self) -> SimpleNamespace:
+        """Hugging Face client's OpenAI-like ``chat.completions.create`` method."""
+        return SimpleNamespace(
+            completions=SimpleNamespace(create=self.chat_completion),
+        )
+
+    def _complete(self, completion: Callable, kwargs: dict[str, Any]) -> Any:  # noqa: ANN401
+        if not in_bridge():
+            return completion(**kwargs)
+        response = await_sync(self.async_completion(**kwargs))
+        if kwargs.get("stream"):
+            return self._iterate(response)
+        return response
+
+    @staticmethod
+    def _iterate(stream: Any) -> Iterator:  # noqa: ANN401
+        chunks = aiter(stream)
+        while (chunk := await_sync(anext(chunks, None))) is not None:
+            yield chunk
+
+
+def async_client(model: Model) -> Model:
+    """Have the requests of a LiteLLM or Hugging Face model awaited when bridged."""
+    if isinstance(model, LiteLLMModel):
+        model.client = AsyncModelClient(model.client, model.client.acompletion)
+    elif isinstance(model, InferenceClientModel):
+        model.client = AsyncModelClient(
+            model.client,
+            AsyncInferenceClient(**model.client_kwargs).chat_completion,
+        )
+    return model
+
+
+class AsyncToolsExecutor:
+    """
+    Python executor calling the blocking tools in threads when run asynchronously.
+
+    Managed agents and tools that await their I/O themselves, flagged with an
+    ``async_aware`` attribute, are called in the greenlet of the run.
+    """
+
+    def __init__(self, executor: PythonExecutor) -> None:
+        """Wrap ``executor``."""
+        self.executor = executor
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        """Return the attributes of the executor."""
+        return getattr(self.executor, name)
+
+    def __call__(self, code_action: str) -> Any:  # noqa: ANN401
+        """Run code."""
+        return self.executor(code_action)
+
+    def send_tools(self, tools: dict[str, Any]) -> None:
+        """Send the tools to the executor, the blocking ones called in threads."""
+        self.executor.send_tools(
+            {
+                name: tool if self.is_async_aware(tool) else self.offloaded(tool)
+                for name, tool in tools.items()
+            },
+        )
+
+    @staticmethod
+    def is_async_aware(tool: Any) -> bool:  # noqa: ANN401
+        """Return whether a tool does not block the event loop."""
+        tool = inspect.unwrap(tool)
+        return isinstance(tool, MultiStepAgent) or getattr(tool, "async_aware", False)
+
+    @staticmethod
+    def offloaded(tool: Any) -> Callable:  # noqa: ANN401
+        """Return a function calling ``tool`` in a thread when run asynchronously."""
+        return functools.wraps(tool)(
+            lambda *args, **kwargs: call_blocking(tool, *args, **kwargs),
+        )
@@ -0,0 +1,365 @@
+"""
+Headless batch runs of the manager agent over the tasks of a JSONL file.
+
+Run ``python -m src.batch tasks.jsonl results.jsonl --workers 8``. Each line of the
+tasks file is a JSON object with a ``task`` and an optional ``id``, the line number
+by default. Results are written as they complete, to a JSONL file, or to a directory
+of Parquet files when the output path ends with ``.parquet``. Tasks already done in
+the output are skipped, so an interrupted batch is resumed by running it again.
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any
+
+import smolagents
+from smolagents import MultiStepAgent
+from smolagents.monitoring import LogLevel
+
+from src.agents import AgentFactory, get_manager_factory
+from src.logger import disable_live_display_refresh, logger, setup_langfuse
+from src.sandbox import CODE_WORKERS, code_worker_pool
+from src.serving import DONE, FAILED
+
+# Number of tasks run at once
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+# Rows per Parquet file, the rows of a file not written yet are run again on resume
+BATCH_PARQUET_ROWS = int(os.getenv("BATCH_PARQUET_ROWS", "100"))
+# Seconds between two progress reports
+BATCH_LOG_INTERVAL = float(os.getenv("BATCH_LOG_INTERVAL", "30"))
+
+
+@dataclasses.dataclass
+class BatchReport:
+    """Counters of a batch run."""
+
+    done: int = 0
+    failed: int = 0
+    skipped: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        """Summarize the run and its throughput."""
+        minutes = max(self.seconds, 1e-9) / 60
+        return (
+            f"{self.done} tasks done, {self.failed} failed, {self.skipped} already"
+            f" done; {self.input_tokens:,} input and {self.output_tokens:,} output"
+            f" tokens in {self.seconds:.1f}s:"
+            f" {(self.done + self.failed) / minutes:.1f} tasks/minute"
+        )
+
+
+def iter_tasks(path: str | Path) -> Iterator[tuple[str, str]]:
+    """Yield the id and task of each line of a JSONL file."""
+    with Path(path).open(encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                record = json.loads(line)
+                yield str(record.get("id", line_number)), record["task"]
+
+
+def iter_token_counts(agent: MultiStepAgent) -> Iterator[tuple[int, int]]:
+    """Yield the input and output tokens of an agent and of its managed agents."""
+    token_usage = agent.monitor.get_total_token_counts()
+    yield token_usage.input_tokens, token_usage.output_tokens
+    for managed_agent in agent.managed_agents.values():
+        yield from iter_token_counts(managed_agent)
+
+
+def silence(agent: MultiStepAgent) -> None:
+    """Stop an agent and its managed agents from logging their steps."""
+    agent.logger.level = LogLevel.OFF
+    for managed_agent in agent.managed_agents.values():
+        silence(managed_agent)
+
+
+def run_task(
+    factory: AgentFactory,
+    task_id: str,
+    task: str,
+    *,
+    verbose: bool = False,
+) -> dict[str, Any]:
+    """Run a task on a fresh agent and return its result and metrics."""
+    agent = factory.new_agent()
+    if not verbose:
+        silence(agent)
+    started_at = time.time()
+    start = time.perf_counter()
+    output = error = None
+    try:
+        output = agent.run(task)
+        status = DONE
+    except Exception as exception:  # noqa: BLE001
+        status = FAILED
+        error = f"{type(exception).__name__}: {exception}"
+    finally:
+        # Give the worker running the code of the agent back to the pool
+        agent.cleanup()
+    duration = time.perf_counter() - start
+
+    steps = [
+        step
+        for step in agent.memory.steps
+        if isinstance(step, (smolagents.ActionStep, smolagents.PlanningStep))
+    ]
+    input_tokens, output_tokens = map(sum, zip(*iter_token_counts(agent), strict=True))
+    return {
+        "id": task_id,
+        "task": task,
+        "status": status,
+        "output": None if output is None else str(output),
+        "error": error,
+        "started_at": started_at,
+        "duration": duration,
+        "steps": len(steps),
+        "step_durations": [step.timing.duration or 0.0 for step in steps],
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+    }
+
+
+class JsonlResultWriter:
+    """Append the results to a JSONL file, one flushed line per task."""
+
+    def __init__(self, path: str | Path) -> None:
+        """Open the file for appending."""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("a", encoding="utf-8")
+
+    def completed_ids(self) -> set[str]:
+        """Return the ids of the tasks done in the file."""
+        statuses = {}
+        with self.path.open(encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line cut short by an interruption
+                    continue
+                statuses[record["id"]] = record["status"]
+        return {task_id for task_id, status in statuses.items() if status == DONE}
+
+    def write(self, record: dict[str, Any]) -> None:
+        """Append a result."""
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        """Close the file."""
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """Write the results to a directory of Parquet files of ``rows`` results each."""
+
+    def __init__(self, path: str | Path, rows: int = BATCH_PARQUET_ROWS) -> None:
+        """Create the directory, new files are numbered after the existing ones."""
+        try:
+            import pyarrow as pa  # noqa: PLC0415
+            import pyarrow.parquet as pq  # noqa: PLC0415
+        except ImportError as error:
+            msg = "Writing Parquet results requires pyarrow, run `uv add pyarrow`."
+            raise ImportError(msg) from error
+        self.pa = pa
+        self.pq = pq
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.rows = rows
+        self.schema = pa.schema(
+            [
+                ("id", pa.string()),
+                ("task", pa.string()),
+                ("status", pa.string()),
+                ("output", pa.string()),
+                ("error", pa.string()),
+                ("started_at", pa.float64()),
+                ("duration", pa.float64()),
+                ("steps", pa.int64()),
+                ("step_durations", pa.list_(pa.float64())),
+                ("input_tokens", pa.int64()),
+                ("output_tokens", pa.int64()),
+            ],
+        )
+        self._buffer: list[dict[str, Any]] = []
+        self._parts = len(self._part_paths())
+
+    def completed_ids(self) -> set[str]:
+        """Return the ids of the tasks done in the written files."""
+        statuses = {}
+        for part_path in self._part_paths():
+            table = self.pq.read_table(part_path, columns=["id", "status"])
+            statuses.update(zip(*table.to_pydict().values(), strict=True))
+        return {task_id for task_id, status in statuses.items() if status == DONE}
+
+    def write(self, record: dict[str, Any]) -> None:
+        """Buffer a result, writing a file once ``rows`` results are buffered."""
+        self._buffer.append(record)
+        if len(self._buffer) >= self.rows:
+            self._flush()
+
+    def close(self) -> None:
+        """Write the buffered results."""
+        self._flush()
+
+    def _part_paths(self) -> list[Path]:
+        """Return the written files, in order."""
+        return sorted(self.path.glob("part-*.parquet"))
+
+    def _flush(self) -> None:
+        """Write the buffered results to a new file, atomically."""
+        if not self._buffer:
+            return
+        table = self.pa.Table.from_pylist(self._buffer, schema=self.schema)
+        part_path = self.path / f"part-{self._parts:05d}.parquet"
+        tmp_path = part_path.with_suffix(".tmp")
+        self.pq.write_table(table, tmp_path)
+        tmp_path.replace(part_path)
+        self._parts += 1
+        self._buffer = []
+
+
+def open_writer(path: str | Path) -> JsonlResultWriter | ParquetResultWriter:
+    """Return the writer of the results, Parquet for a ``.parquet`` path."""
+    if Path(path).suffix == ".parquet":
+        return ParquetResultWriter(path)
+    return JsonlResultWriter(path)
+
+
+class BatchRunner:
+    """
+    Run tasks on copies of an agent, in a pool of worker threads.
+
+    The agents share the model clients, tools and MCP sessions of the factory's
+    agent graph. At most twice as many tasks as workers are read ahead, so a batch
+    of any size is streamed. Results are written in the order tasks complete.
+    """
+
+    def __init__(
+        self,
+        factory: AgentFactory,
+        writer: JsonlResultWriter | ParquetResultWriter,
+        workers: int = BATCH_WORKERS,
+        *,
+        verbose: bool = False,
+    ) -> None:
+        """Run the tasks on agents of ``factory`` and write their results."""
+        self.factory = factory
+        self.writer = writer
+        self.workers = workers
+        self.verbose = verbose
+        self.report = BatchReport()
+
+    def run(self, tasks: Iterable[tuple[str, str]]) -> BatchReport:
+        """Run the tasks, given as ids and texts, and return the report."""
+        start = time.perf_counter()
+        self._last_log = start
+        pending: set[Future] = set()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="batch") as executor:
+            try:
+                for task_id, task in tasks:
+                    if len(pending) >= 2 * self.workers:
+                        pending = self._record(pending, start)
+                    pending.add(
+                        executor.submit(
+                            run_task,
+                            self.factory,
+                            task_id,
+                            task,
+                            verbose=self.verbose,
+                        ),
+                    )
+                while pending:
+                    pending = self._record(pending, start)
+            except KeyboardInterrupt:
+                logger.warning(
+                    "Interrupted, finishing the running tasks. Interrupt again to"
+                    " stop now, the tasks not written are run again on resume.",
+                )
+                for future in pending:
+                    future.cancel()
+                pending = {future for future in pending if not future.cancelled()}
+                while pending:
+                    pending = self._record(pending, start)
+                raise
+            finally:
+                self.report.seconds = time.perf_counter() - start
+        return self.report
+
+    def _record(self, pending: set[Future], start: float) -> set[Future]:
+        """Write the results of the first completed tasks, return the others."""
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            record = future.result()
+            self.writer.write(record)
+            if record["status"] == DONE:
+                self.report.done += 1
+            else:
+                self.report.failed += 1
+                logger.warning("Task %s failed: %s", record["id"], record["error"])
+            self.report.input_tokens += record["input_tokens"]
+            self.report.output_tokens += record["output_tokens"]
+        now = time.perf_counter()
+        if now - self._last_log >= BATCH_LOG_INTERVAL:
+            self._last_log = now
+            self.report.seconds = now - start
+            logger.info("Batch progress: %s", self.report)
+        return pending
+
+
+def main() -> None:
+    """Run the batch described by the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("tasks", help="JSONL file of tasks")
+    parser.add_argument("output", help="JSONL file or .parquet directory of results")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="log the steps of the agents",
+    )
+    arguments = parser.parse_args()
+
+    setup_langfuse()
+    disable_live_display_refresh()
+    if CODE_WORKERS:
+        code_worker_pool.start()
+    writer = open_writer(arguments.output)
+    try:
+        completed = writer.completed_ids()
+        skipped = 0
+
+        def remaining_tasks() -> Iterator[tuple[str, str]]:
+            nonlocal skipped
+            for task_id, task in iter_tasks(arguments.tasks):
+                if task_id in completed:
+                    skipped += 1
+                else:
+                    yield task_id, task
+
+        runner = BatchRunner(
+            get_manager_factory(),
+            writer,
+            arguments.workers,
+            verbose=arguments.verbose,
+        )
+        try:
+            runner.run(remaining_tasks())
+        finally:
+            runner.report.skipped = skipped
+            logger.info("Batch finished: %s", runner.report)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,549 @@
+"""On-disk BM25 index for the retriever tools."""
+
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import re
+import shutil
+import threading
+import weakref
+from array import array
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import numpy as np
+from langchain.docstore.document import Document
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_SEGMENTS = 8
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a text into lowercase word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def content_hash(text: str) -> str:
+    """Return the hash of a text, used as the id of documents without one."""
+    return hashlib.sha1(text.encode()).hexdigest()  # noqa: S324
+
+
+def document_id(document: Document) -> str:
+    """Return the id of a document, defaulting to the hash of its content."""
+    return document.id or content_hash(document.page_content)
+
+
+class Segment:
+    """
+    Immutable part of the index, memory-mapped from its directory.
+
+    Postings are stored term by term in two flat arrays of document numbers and term
+    frequencies, the postings of term ``i`` being between ``term_offsets[i]`` and
+    ``term_offsets[i + 1]``. Terms are sorted, so they are looked up by binary search.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Memory-map the segment stored in ``path``."""
+        self.path = path
+        self.terms = np.load(path / "terms.npy", mmap_mode="r")
+        self.term_offsets = np.load(path / "term_offsets.npy", mmap_mode="r")
+        # Maximum term frequency and minimum document length of the postings of
+        # each term, bounding the score the term can give to a document
+        self.term_max_tfs = np.load(path / "term_max_tfs.npy", mmap_mode="r")
+        self.term_min_lengths = np.load(path / "term_min_lengths.npy", mmap_mode="r")
+        self.postings_docs = np.load(path / "postings_docs.npy", mmap_mode="r")
+        self.postings_tfs = np.load(path / "postings_tfs.npy", mmap_mode="r")
+        self.doc_lengths = np.load(path / "doc_lengths.npy", mmap_mode="r")
+        self.doc_offsets = np.load(path / "doc_offsets.npy", mmap_mode="r")
+        self.doc_ids = np.load(path / "doc_ids.npy", mmap_mode="r")
+        # Kept open so that documents stay readable once a merge deleted the segment
+        self._documents_file = (path / "documents.jsonl").open("rb")
+        self._documents_lock = threading.Lock()
+        weakref.finalize(self, self._documents_file.close)
+
+    def __len__(self) -> int:
+        """Return the number of documents of the segment, including deleted ones."""
+        return len(self.doc_ids)
+
+    @classmethod
+    def write(cls, path: Path, documents: list[Document]) -> "Segment":
+        """Write the segment of ``documents`` to ``path``."""
+        term_ids: dict[str, int] = {}
+        postings_terms, postings_docs, postings_tfs = (
+            array("i"),
+            array("i"),
+            array("i"),
+        )
+        doc_lengths = array("i")
+        for doc_number, document in enumerate(documents):
+            tokens = tokenize(document.page_content)
+            doc_lengths.append(len(tokens))
+            for token, count in Counter(tokens).items():
+                postings_terms.append(term_ids.setdefault(token, len(term_ids)))
+                postings_docs.append(doc_number)
+                postings_tfs.append(count)
+
+        terms = np.array(list(term_ids), dtype=str)
+        term_order = np.argsort(terms)
+        term_ranks = np.empty_like(term_order)
+        term_ranks[term_order] = np.arange(len(term_order))
+        return cls._write(
+            path,
+            terms[term_order],
+            term_ranks[np.frombuffer(postings_terms, dtype=np.int32)],
+            np.frombuffer(postings_docs, dtype=np.int32),
+            np.frombuffer(postings_tfs, dtype=np.int32),
+            np.frombuffer(doc_lengths, dtype=np.int32),
+            np.array([document_id(document) for document in documents], dtype=str),
+            (
+                json.dumps(
+                    {"text": document.page_content, "metadata": document.metadata},
+                ).encode()
+                + b"\n"
+                for document in documents
+            ),
+        )
+
+    @classmethod
+    def merge(
+        cls,
+        path: Path,
+        segments: list["Segment"],
+        deleted_masks: list[np.ndarray | None],
+    ) -> "Segment":
+        """
+        Write the live documents of ``segments`` to a single segment in ``path``.
+
+        Postings are merged as arrays, documents are not tokenized again. The terms
+        of deleted documents only are dropped.
+        """
+        terms, term_ranks = np.unique(
+            np.concatenate([segment.terms for segment in segments]),
+            return_inverse=True,
+        )
+        postings_terms, postings_docs, postings_tfs = [], [], []
+        doc_lengths, doc_ids, lives = [], [], []
+        n_terms, n_documents = 0, 0
+        for segment, deleted_mask in zip(segments, deleted_masks, strict=True):
+            live = (
+                np.ones(len(segment), dtype=bool)
+                if deleted_mask is None
+                else ~deleted_mask
+            )
+            new_doc_numbers = n_documents + np.cumsum(live, dtype=np.int32) - 1
+            segment_term_ranks = term_ranks[n_terms : n_terms + len(segment.terms)]
+            live_postings = live[segment.postings_docs]
+            postings_terms.append(
+                np.repeat(
+                    segment_term_ranks.astype(np.int32),
+                    np.diff(segment.term_offsets),
+                )[live_postings],
+            )
+            postings_docs.append(new_doc_numbers[segment.postings_docs[live_postings]])
+            postings_tfs.append(segment.postings_tfs[live_postings])
+            doc_lengths.append(segment.doc_lengths[live])
+            doc_ids.append(segment.doc_ids[live])
+            lives.append(live)
+            n_terms += len(segment.terms)
+            n_documents += int(live.sum())
+
+        def lines() -> Iterator[bytes]:
+            for segment, live in zip(segments, lives, strict=True):
+                with (segment.path / "documents.jsonl").open("rb") as documents_file:
+                    yield from itertools.compress(documents_file, live)
+
+        merged_terms = np.concatenate(postings_terms)
+        live_terms = np.bincount(merged_terms, minlength=len(terms)) > 0
+        live_term_ranks = (np.cumsum(live_terms) - 1).astype(np.int32)
+        return cls._write(
+            path,
+            terms[live_terms],
+            live_term_ranks[merged_terms],
+            np.concatenate(postings_docs),
+            np.concatenate(postings_tfs),
+            np.concatenate(doc_lengths),
+            np.concatenate(doc_ids),
+            lines(),
+        )
+
+    @classmethod
+    def _write(  # noqa: PLR0913
+        cls,
+        path: Path,
+        terms: np.ndarray,
+        postings_terms: np.ndarray,
+        postings_docs: np.ndarray,
+        postings_tfs: np.ndarray,
+        doc_lengths: np.ndarray,
+        doc_ids: np.ndarray,
+        lines: Iterable[bytes],
+    ) -> "Segment":
+        """Write a segment from its sorted terms, postings and documents."""
+        # A stable sort keeps the postings of each term sorted by document
+        postings_order = np.argsort(postings_terms, kind="stable")
+        postings_terms = postings_terms[postings_order]
+        postings_docs = postings_docs[postings_order]
+        postings_tfs = postings_tfs[postings_order]
+        term_offsets = np.searchsorted(postings_terms, np.arange(len(terms) + 1))
+        starts = term_offsets[:-1]
+
+        path.mkdir(parents=True)
+        np.save(path / "terms.npy", terms)
+        np.save(path / "term_offsets.npy", term_offsets)
+        np.save(
+            path / "term_max_tfs.npy",
+            np.maximum.reduceat(postings_tfs, starts) if len(terms) else starts,
+        )
+        np.save(
+            path / "term_min_lengths.npy",
+            np.minimum.reduceat(doc_lengths[postings_docs], starts)
+            if len(terms)
+            else starts,
+        )
+        np.save(path / "postings_docs.npy", postings_docs)
+        np.save(path / "postings_tfs.npy", postings_tfs)
+        np.save(path / "doc_lengths.npy", doc_lengths)
+        np.save(path / "doc_ids.npy", doc_ids)
+
+        doc_offsets = array("q", [0])
+        with (path / "documents.jsonl").open("wb") as documents_file:
+            for line in lines:
+                documents_file.write(line)
+                doc_offsets.append(doc_offsets[-1] + len(line))
+        np.save(path / "doc_offsets.npy", np.frombuffer(doc_offsets, dtype=np.int64))
+        return cls(path)
+
+    def term_index(self, term: str) -> int | None:
+        """Return the index of ``term`` in the segment, or None if absent."""
+        index = int(np.searchsorted(self.terms, term))
+        if index < len(self.terms) and self.terms[index] == term:
+            return index
+        return None
+
+    def postings(self, term_index: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the document numbers and term frequencies of a term."""
+        start, stop = self.term_offsets[term_index], self.term_offsets[term_index + 1]
+        return self.postings_docs[start:stop], self.postings_tfs[start:stop]
+
+    def document(self, doc_number: int) -> Document:
+        """Read a document from the segment's document store."""
+        start, stop = self.doc_offsets[doc_number], self.doc_offsets[doc_number + 1]
+        with self._documents_lock:
+            self._documents_file.seek(start)
+            data = json.loads(self._documents_file.read(stop - start))
+        return Document(
+            id=str(self.doc_ids[doc_number]),
+            page_content=data["text"],
+            metadata=data["metadata"],
+        )
+
+
+class BM25Index:
+    """
+    Persistent BM25 index supporting incremental adds and deletes.
+
+    Added documents are written as new immutable segments, and deleted documents are
+    only masked until their segment is merged: once there are more than
+    ``MAX_SEGMENTS`` segments, the smallest ones are merged together. As in Lucene,
+    the collection statistics still count masked documents.
+
+    Queries return the top-k documents with MaxScore early termination: terms are
+    scored from the rarest to the most common, and once the most common terms can no
+    longer lift an unseen document into the top-k, they only update the scores of the
+    documents already seen.
+    """
+
+    def __init__(self, path: str | Path, k1: float = 1.5, b: float = 0.75) -> None:
+        """Open the index stored in ``path``, creating it if needed."""
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        manifest_path = self.path / "manifest.json"
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text())
+        else:
+            manifest = {"segments": [], "deleted": {}, "next_segment": 0}
+        self._next_segment = manifest["next_segment"]
+        self._segments = [Segment(self.path / name) for name in manifest["segments"]]
+        # Numbers of the deleted documents of each segment, by segment name
+        self._deleted: dict[str, set[int]] = {
+            name: set(docs) for name, docs in manifest["deleted"].items()
+        }
+        # Segment name and document number of each live document, by id
+        self._locations: dict[str, tuple[str, int]] | None = None
+        self._update_statistics()
+
+    def __len__(self) -> int:
+        """Return the number of documents in the index."""
+        return self._n_documents - sum(len(docs) for docs in self._deleted.values())
+
+    def add(self, documents: Iterable[Document]) -> None:
+        """Add documents to the index, replacing the documents with the same id."""
+        # Only the last document of a given id is kept
+        documents = list({document_id(doc): doc for doc in documents}.values())
+        if not documents:
+            return
+        with self._lock:
+            ids = [document_id(document) for document in documents]
+            self._delete(ids)
+            segment = Segment.write(
+                self.path / f"segment_{self._next_segment:06d}",
+                documents,
+            )
+            self._next_segment += 1
+            self._segments = [*self._segments, segment]
+            self._get_locations().update(
+                (doc_id, (segment.path.name, doc)) for doc, doc_id in enumerate(ids)
+            )
+            if len(self._segments) > MAX_SEGMENTS:
+                # Merge the smallest segments only, so that a document is rewritten
+                # a logarithmic number of times as the index grows
+                self._merge(
+                    sorted(self._segments, key=len)[: MAX_SEGMENTS // 2 + 1],
+                )
+            self._commit()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        """Delete documents by id."""
+        with self._lock:
+            self._delete(ids)
+            self._commit()
+
+    def merge(self) -> None:
+        """Merge all segments into one, purging deleted documents."""
+        with self._lock:
+            if self._segments:
+                self._merge(self._segments)
+            self._commit()
+
+    def search(self, query: str, k: int = 5) -> list[Document]:
+        """Return the ``k`` documents best matching ``query``."""
+        segments, top_k = self._top_k(query, k)
+        return [
+            segments[segment_number].document(doc) for _, segment_number, doc in top_k
+        ]
+
+    def search_ids(self, query: str, k: int = 5) -> list[tuple[str, float]]:
+        """Return the ids and scores of the ``k`` documents best matching ``query``."""
+        segments, top_k = self._top_k(query, k)
+        return [
+            (str(segments[segment_number].doc_ids[doc]), score)
+            for score, segment_number, doc in top_k
+        ]
+
+    def get(self, doc_id: str) -> Document | None:
+        """Return a document by id, None if it is not in the index."""
+        segments = {segment.path.name: segment for segment in self._segments}
+        location = self._get_locations().get(doc_id)
+        if location is None:
+            return None
+        segment_name, doc = location
+        return segments[segment_name].document(doc)
+
+    def ids(self) -> list[str]:
+        """Return the ids of the documents of the index."""
+        return list(self._get_locations())
+
+    def _top_k(
+        self,
+        query: str,
+        k: int,
+    ) -> tuple[list[Segment], list[tuple[float, int, int]]]:
+        """Return the segments searched and the (score, segment, doc) of the top-k."""
+        segments, deleted_masks = self._segments, self._deleted_masks
+        query_terms = set(tokenize(query))
+        top_k: list[tuple[float, int, int]] = []  # min-heap of (score, segment, doc)
+        for segment_number, segment in enumerate(segments):
+            threshold = top_k[0][0] if len(top_k) == k else 0.0
+            docs, scores = self._search_segment(
+                segment,
+                query_terms,
+                k,
+                threshold,
+                deleted_masks[segment_number],
+            )
+            for doc, score in zip(docs.tolist(), scores.tolist(), strict=True):
+                item = (score, segment_number, doc)
+                if len(top_k) < k:
+                    heapq.heappush(top_k, item)
+                elif item > top_k[0]:
+                    heapq.heapreplace(top_k, item)
+        return segments, sorted(top_k, reverse=True)
+
+    def _search_segment(
+        self,
+        segment: Segment,
+        query_terms: set[str],
+        k: int,
+        threshold: float,
+        deleted_mask: np.ndarray | None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the documents of a segment that may enter the top-k, with scores."""
+        terms = []
+        for term in query_terms:
+            term_index = segment.term_index(term)
+            if term_index is not None:
+                idf = self._idf(term)
+                upper_bound = idf * self._term_frequency_weight(
+                    segment.term_max_tfs[term_index],
+                    segment.term_min_lengths[term_index],
+                )
+                terms.append((upper_bound, idf, term_index))
+        terms.sort(reverse=True)
+        # remaining_bounds[i] bounds the score terms i and after can add
+        remaining_bounds = np.cumsum([bound for bound, _, _ in terms][::-1])[::-1]
+
+        candidates = np.empty(0, dtype=np.int32)
+        scores = np.empty(0, dtype=np.float64)
+        for i, (_, idf, term_index) in enumerate(terms):
+            docs, tfs = segment.postings(term_index)
+            if remaining_bounds[i] > threshold:
+                # Unseen documents may still enter the top-k: score all postings
+                if deleted_mask is not None:
+                    live = ~deleted_mask[docs]
+                    docs, tfs = docs[live], tfs[live]
+                term_scores = idf * self._term_frequency_weight(
+                    tfs,
+                    segment.doc_lengths[docs],
+                )
+                candidates, inverse = np.unique(
+                    np.concatenate([candidates, docs]),
+                    return_inverse=True,
+                )
+                scores = np.bincount(
+                    inverse,
+                    weights=np.concatenate([scores, term_scores]),
+                    minlength=len(candidates),
+                )
+            elif len(candidates) and len(docs):
+                # Only documents already seen can enter the top-k: look them up
+                positions = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                found = docs[positions] == candidates
+                scores[found] += idf * self._term_frequency_weight(
+                    tfs[positions[found]],
+                    segment.doc_lengths[candidates[found]],
+                )
+            if len(candidates) >= k:
+                threshold = max(threshold, np.partition(scores, -k)[-k])
+            if i + 1 < len(terms) and len(candidates) > k:
+                # Drop the documents that cannot reach the top-k anymore
+                alive = scores + remaining_bounds[i + 1] >= threshold
+                candidates, scores = candidates[alive], scores[alive]
+
+        if len(candidates) > k:
+            best = np.argpartition(scores, -k)[-k:]
+            candidates, scores = candidates[best], scores[best]
+        return candidates, scores
+
+    def _term_frequency_weight(
+        self,
+        tfs: np.ndarray,
+        doc_lengths: np.ndarray,
+    ) -> np.ndarray:
+        """Return the BM25 term frequency weight, to be multiplied by the idf."""
+        tfs = np.asarray(tfs, dtype=np.float64)
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths / self._average_length)
+        return tfs * (self.k1 + 1) / (tfs + norms)
+
+    def _idf(self, term: str) -> float:
+        """Return the BM25 inverse document frequency of a term."""
+        frequency = 0
+        for segment in self._segments:
+            term_index = segment.term_index(term)
+            if term_index is not None:
+                frequency += int(
+                    segment.term_offsets[term_index + 1]
+                    - segment.term_offsets[term_index],
+                )
+        return math.log(
+            1 + (self._n_documents - frequency + 0.5) / (frequency + 0.5),
+        )
+
+    def _get_locations(self) -> dict[str, tuple[str, int]]:
+        """Return the location of each live document by id, loaded on first use."""
+        if self._locations is None:
+            self._locations = {
+                str(doc_id): (segment.path.name, doc)
+                for segment in self._segments
+                for doc, doc_id in enumerate(segment.doc_ids)
+                if doc not in self._deleted.get(segment.path.name, ())
+            }
+        return self._locations
+
+    def _delete(self, ids: Iterable[str]) -> None:
+        """Mark the live documents with the given ids as deleted."""
+        locations = self._get_locations()
+        for doc_id in ids:
+            if doc_id in locations:
+                segment_name, doc = locations.pop(doc_id)
+                self._deleted.setdefault(segment_name, set()).add(doc)
+
+    def _deleted_mask(self, segment: Segment) -> np.ndarray | None:
+        """Return which documents of a segment are deleted, None if none is."""
+        deleted = self._deleted.get(segment.path.name)
+        if not deleted:
+            return None
+        mask = np.zeros(len(segment), dtype=bool)
+        mask[list(deleted)] = True
+        return mask
+
+    def _merge(self, segments: list[Segment]) -> None:
+        """Rewrite the live documents of ``segments`` into a single segment."""
+        merged_names = {segment.path.name for segment in segments}
+        segments = [
+            segment for segment in self._segments if segment.path.name in merged_names
+        ]
+        deleted_masks = [self._deleted_mask(segment) for segment in segments]
+        merged = None
+        if any(mask is None or not mask.all() for mask in deleted_masks):
+            merged_path = self.path / f"segment_{self._next_segment:06d}"
+            try:
+                merged = Segment.merge(merged_path, segments, deleted_masks)
+            except BaseException:
+                # The merged segments are kept, as if the merge never started
+                shutil.rmtree(merged_path, ignore_errors=True)
+                raise
+            self._next_segment += 1
+        self._segments = [
+            segment
+            for segment in self._segments
+            if segment.path.name not in merged_names
+        ] + ([merged] if merged is not None else [])
+        if merged is not None and self._locations is not None:
+            self._locations.update(
+                (str(doc_id), (merged.path.name, doc))
+                for doc, doc_id in enumerate(merged.doc_ids)
+            )
+        for name in merged_names:
+            self._deleted.pop(name, None)
+        self._commit()
+        for segment in segments:
+            shutil.rmtree(segment.path)
+
+    def _commit(self) -> None:
+        """Atomically write the manifest and refresh the collection statistics."""
+        manifest = {
+            "segments": [segment.path.name for segment in self._segments],
+            "deleted": {
+                name: sorted(docs) for name, docs in self._deleted.items() if docs
+            },
+            "next_segment": self._next_segment,
+        }
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path / "manifest.json.tmp"
+        tmp_path.write_text(json.dumps(manifest))
+        tmp_path.replace(self.path / "manifest.json")
+        self._update_statistics()
+
+    def _update_statistics(self) -> None:
+        """Compute the collection statistics used for scoring and the deleted masks."""
+        self._deleted_masks = [
+            self._deleted_mask(segment) for segment in self._segments
+        ]
+        self._n_documents = sum(len(segment) for segment in self._segments)
+        total_length = sum(int(segment.doc_lengths.sum()) for segment in self._segments)
+        self._average_length = total_length / max(self._n_documents, 1) or 1.0
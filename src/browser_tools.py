@@ -1,42 +1,76 @@
 """Browser tools."""
 
-from io import BytesIO
-from time import sleep
+import os
+from time import perf_counter, sleep
+from weakref import WeakKeyDictionary
 
-import helium
-from PIL import Image
 from selenium import webdriver
-from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from smolagents import CodeAgent, tool
 from smolagents.agents import ActionStep
 
-from src.driver import driver
+from src.driver import get_driver
+from src.page_search import search_page
+from src.screenshots import ScreenshotStore
+
+PAGE_SETTLE_MAX_WAIT = float(os.getenv("PAGE_SETTLE_MAX_WAIT", "1.0"))
+PAGE_SETTLE_POLL_INTERVAL = 0.05
+
+# Screenshots kept in the memory of each browser agent
+screenshot_stores: WeakKeyDictionary[CodeAgent, ScreenshotStore] = WeakKeyDictionary()
+
+# Load state, number of fetched resources, number of elements and number of running
+# finite animations (infinite ones, like spinners, would never settle)
+PAGE_STATE_SCRIPT = """
+return [
+    document.readyState,
+    performance.getEntriesByType("resource").length,
+    document.getElementsByTagName("*").length,
+    document.getAnimations().filter(
+        (a) => a.playState === "running"
+            && a.effect.getComputedTiming().endTime !== Infinity
+    ).length,
+];
+"""
+
+
+def wait_for_page_settle(
+    driver: webdriver.Chrome,
+    max_wait: float = PAGE_SETTLE_MAX_WAIT,
+) -> float:
+    """
+    Wait until the page is quiescent and return the time waited, in seconds.
+
+    The page is settled once it is loaded, has no running animation, and neither its
+    number of elements nor its number of fetched resources changed between two polls.
+    """
+    start = perf_counter()
+    previous_state = None
+    while perf_counter() - start < max_wait:
+        state = driver.execute_script(PAGE_STATE_SCRIPT)
+        if state[0] == "complete" and state[3] == 0 and state == previous_state:
+            break
+        previous_state = state
+        sleep(PAGE_SETTLE_POLL_INTERVAL)
+    return perf_counter() - start
 
 
 def save_screenshot(memory_step: ActionStep, agent: CodeAgent) -> None:
     """Save a screenshot of the current page."""
-    sleep(1.0)  # Let JavaScript animations happen before taking the screenshot
-    driver = helium.get_driver()
-    current_step = memory_step.step_number
-    if driver is not None:
-        for previous_memory_step in (
-            agent.memory.steps
-        ):  # Remove previous screenshots from logs for lean processing
-            if (
-                isinstance(previous_memory_step, ActionStep)
-                and previous_memory_step.step_number <= current_step - 2
-            ):
-                previous_memory_step.observations_images = None
-        png_bytes = driver.get_screenshot_as_png()
-        image = Image.open(BytesIO(png_bytes))
-        print(f"Captured a browser screenshot: {image.size} pixels")  # noqa: T201
-        memory_step.observations_images = [
-            image.copy()  # noqa: COM812
-        ]  # Create a copy to ensure it persists, important!
+    driver = get_driver()
+    # Let JavaScript animations happen before taking the screenshot
+    settle_time = wait_for_page_settle(driver)
+    store = screenshot_stores.setdefault(agent, ScreenshotStore())
+    if store.add(memory_step, driver.get_screenshot_as_png()):
+        print(f"Captured a browser screenshot at step {memory_step.step_number}")  # noqa: T201
+        url_info = ""
+    else:
+        url_info = "Screenshot unchanged since the previous one.\n"
 
     # Update observations with current URL
-    url_info = f"Current url: {driver.current_url}"
+    url_info += (
+        f"Current url: {driver.current_url} (page settled in {settle_time:.2f}s)"
+    )
     memory_step.observations = (
         url_info
         if memory_step.observations is None
@@ -45,30 +79,55 @@ def save_screenshot(memory_step: ActionStep, agent: CodeAgent) -> None:
 
 
 @tool
-def search_item_ctrl_f(text: str, nth_result: int = 1) -> str:
+def search_item_ctrl_f(
+    text: str,
+    nth_result: int = 1,
+    case_sensitive: bool = False,  # noqa: FBT001, FBT002
+    fuzzy: bool = False,  # noqa: FBT001, FBT002
+) -> str:
     """
     Search for text on the current page via Ctrl + F and jumps to the nth occurrence.
 
+    Returns the number of matches and the text around the nth match and the next ones,
+    the match being «quoted». When there is no exact match, approximate matches are
+    returned instead.
+
     Args:
         text: The text to search for
         nth_result: Which occurrence to jump to (default: 1).
+        case_sensitive: Whether the case of the text must match (default: False).
+        fuzzy: Whether to also return approximate matches, such as misspellings, after
+            the exact ones (default: False).
 
     """
-    elements = driver.find_elements(By.XPATH, f"//*[contains(text(), '{text}')]")
-    if nth_result > len(elements):
-        msg = f"Match n°{nth_result} not found (only {len(elements)} matches found)"
+    result = search_page(
+        get_driver(),
+        text,
+        nth_result=nth_result,
+        case_sensitive=case_sensitive,
+        fuzzy=fuzzy,
+    )
+    total = result["total"]
+    if nth_result > total:
+        msg = f"Match n°{nth_result} not found (only {total} matches found)"
         raise Exception(msg)  # noqa: TRY002
-    result = f"Found {len(elements)} matches for '{text}'."
-    elem = elements[nth_result - 1]
-    driver.execute_script("arguments[0].scrollIntoView(true);", elem)
-    result += f"Focused on element {nth_result} of {len(elements)}"
-    return result
+    approximate = result["approximate"]
+    found = f"Found {total} matches for '{text}'"
+    if approximate:
+        found += f" ({approximate} approximate)"
+    lines = [f"{found}. Focused on element {nth_result} of {total}."]
+    lines.extend(
+        f"{snippet['rank']}{' (approximate)' if snippet['distance'] else ''}:"
+        f" {snippet['text']}"
+        for snippet in result["snippets"]
+    )
+    return "\n".join(lines)
 
 
 @tool
 def go_back() -> None:
     """Goes back to previous page."""
-    driver.back()
+    get_driver().back()
 
 
 @tool
@@ -78,7 +137,7 @@ def close_popups() -> str:
 
     Use this to dismiss pop-up windows! This does not work on cookie consent banners.
     """
-    webdriver.ActionChains(driver).send_keys(Keys.ESCAPE).perform()
+    webdriver.ActionChains(get_driver()).send_keys(Keys.ESCAPE).perform()
 
 
 helium_instructions = """
@@ -0,0 +1,80 @@
+"""Conversion of agent runs to Gradio chat messages."""
+
+from collections.abc import Generator
+
+import gradio as gr
+import smolagents
+
+MAX_TOOL_RESPONSE_CHARS = 2000
+
+MESSAGE_TITLES = {
+    smolagents.MessageRole.TOOL_CALL: "🛠️ Tool call",
+    smolagents.MessageRole.TOOL_RESPONSE: "➡️ Tool response",
+    smolagents.MessageRole.SYSTEM: "️⚙️ System",
+}
+
+
+def truncate(text: str, max_chars: int = MAX_TOOL_RESPONSE_CHARS) -> str:
+    """Cut a text to ``max_chars`` characters, noting how much was left out."""
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}\n\n[... {len(text) - max_chars:,} characters truncated]"
+
+
+def step_to_chat_messages(
+    memory_step: smolagents.ActionStep | smolagents.PlanningStep,
+) -> list[gr.ChatMessage]:
+    """Convert an agent step to chat messages, truncating large tool responses."""
+    chat_messages = []
+    for message in memory_step.to_messages():
+        role = "user" if message.role == "user" else "assistant"
+        metadata = {}
+        if message.role in MESSAGE_TITLES:
+            metadata = {"title": MESSAGE_TITLES[message.role]}
+        for content in message.content:
+            if content["type"] == "text":
+                text = content["text"]
+                if message.role == smolagents.MessageRole.TOOL_RESPONSE:
+                    text = truncate(text)
+                chat_messages.append(
+                    gr.ChatMessage(role=role, content=text, metadata=metadata),
+                )
+    return chat_messages
+
+
+def stream_chat_messages(
+    agent: smolagents.MultiStepAgent,
+    task: str,
+) -> Generator[list[gr.ChatMessage]]:
+    """
+    Run the agent and yield the chat history each time it changes.
+
+    The history only grows at its end: model tokens are streamed into a pending
+    message, which the step's messages replace once the step is done. Gradio thus
+    only sends the new tokens and messages to the browser.
+    """
+    messages: list[gr.ChatMessage] = []
+    streamed_message: gr.ChatMessage | None = None
+    for event in agent.run(task, stream=True):
+        if isinstance(event, smolagents.ChatMessageStreamDelta):
+            if not event.content:
+                continue
+            if streamed_message is None:
+                streamed_message = gr.ChatMessage(role="assistant", content="")
+                messages.append(streamed_message)
+            streamed_message.content += event.content
+        elif isinstance(event, (smolagents.ActionStep, smolagents.PlanningStep)):
+            if streamed_message is not None:
+                messages.pop()
+                streamed_message = None
+            messages.extend(step_to_chat_messages(event))
+        elif isinstance(event, smolagents.FinalAnswerStep):
+            messages.append(
+                gr.ChatMessage(
+                    role="assistant",
+                    content=f"**Final answer:**\n{event.output}",
+                ),
+            )
+        else:
+            continue
+        yield messages
@@ -0,0 +1,158 @@
+"""Compaction of the memory of long agent runs."""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from smolagents import MultiStepAgent
+from smolagents.agents import ActionStep
+
+from src.router import estimate_tokens
+
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "16000"))
+MEMORY_KEEP_STEPS = int(os.getenv("MEMORY_KEEP_STEPS", "2"))
+OUTPUT_HANDLE_MIN_CHARS = int(os.getenv("OUTPUT_HANDLE_MIN_CHARS", "2000"))
+OUTPUT_EXCERPT_CHARS = int(os.getenv("OUTPUT_EXCERPT_CHARS", "400"))
+OUTPUT_STORE_MAX_MB = float(os.getenv("OUTPUT_STORE_MAX_MB", "64"))
+
+
+class OutputStore:
+    """
+    Full text of the tool outputs shortened in memory, behind content handles.
+
+    Identical outputs share a handle. The least recently used outputs are evicted
+    past ``max_mb`` of text.
+    """
+
+    def __init__(self, max_mb: float = OUTPUT_STORE_MAX_MB) -> None:
+        """Create an empty store."""
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._outputs: OrderedDict[str, str] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, output: str) -> str:
+        """Store an output and return its handle."""
+        handle = "out-" + hashlib.sha1(output.encode()).hexdigest()[:12]  # noqa: S324
+        with self._lock:
+            if handle in self._outputs:
+                self._outputs.move_to_end(handle)
+                return handle
+            self._outputs[handle] = output
+            self._size += len(output)
+            while self._size > self.max_bytes and len(self._outputs) > 1:
+                _, evicted = self._outputs.popitem(last=False)
+                self._size -= len(evicted)
+        return handle
+
+    def get(self, handle: str) -> str | None:
+        """Return the output of a handle, None if unknown or evicted."""
+        with self._lock:
+            output = self._outputs.get(handle)
+            if output is not None:
+                self._outputs.move_to_end(handle)
+            return output
+
+
+output_store = OutputStore()
+
+
+class MemoryCompactor:
+    """
+    Keep the memory of an agent under a token budget, as a step callback.
+
+    At each step, a long observation identical to the one of an earlier step is
+    replaced by a reference to that step. Then, while the messages sent to the model
+    exceed ``token_budget``, the oldest steps outside of the last ``keep_steps`` are
+    compacted: their long observations are cut to an excerpt, the rest stored in
+    ``store`` behind a handle that the ``read_output`` tool reads, and the code
+    repeated in their model output and tool call is kept in the tool call only.
+    Compacted steps are left as is afterwards, so the prompt prefix only changes
+    where compaction progresses.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = MEMORY_TOKEN_BUDGET,
+        keep_steps: int = MEMORY_KEEP_STEPS,
+        handle_min_chars: int = OUTPUT_HANDLE_MIN_CHARS,
+        excerpt_chars: int = OUTPUT_EXCERPT_CHARS,
+        store: OutputStore = output_store,
+    ) -> None:
+        """Configure the budget and the outputs shortened."""
+        self.token_budget = token_budget
+        self.keep_steps = keep_steps
+        self.handle_min_chars = handle_min_chars
+        self.excerpt_chars = excerpt_chars
+        self.store = store
+
+    def __call__(self, memory_step: ActionStep, agent: MultiStepAgent) -> None:
+        """Deduplicate the observation of the step, then compact the memory."""
+        # The step is added to the memory after its callbacks
+        previous_steps = [
+            step
+            for step in agent.memory.steps
+            if isinstance(step, ActionStep) and step is not memory_step
+        ]
+        self.deduplicate(memory_step, previous_steps)
+        tokens = estimate_tokens(agent.write_memory_to_messages()) + estimate_tokens(
+            memory_step.to_messages(),
+        )
+        n_old_steps = max(len(previous_steps) - max(self.keep_steps - 1, 0), 0)
+        for step in previous_steps[:n_old_steps]:
+            if tokens <= self.token_budget:
+                break
+            tokens -= estimate_tokens(step.to_messages())
+            self.compact(step)
+            tokens += estimate_tokens(step.to_messages())
+
+    def deduplicate(
+        self,
+        memory_step: ActionStep,
+        previous_steps: list[ActionStep],
+    ) -> None:
+        """Replace a long observation already made at an earlier step."""
+        observations = memory_step.observations
+        if observations is None or len(observations) < self.handle_min_chars:
+            return
+        handle = self.store.put(observations)
+        for step in previous_steps:
+            if step.observations == observations or (
+                step.observations and f"'{handle}'" in step.observations
+            ):
+                memory_step.observations = (
+                    f"Same output as at step {step.step_number}, "
+                    f"read_output('{handle}') returns it."
+                )
+                return
+
+    def compact(self, step: ActionStep) -> None:
+        """Shorten the observation of a step and drop its repeated code."""
+        observations = step.observations
+        if observations is not None and len(observations) >= self.handle_min_chars:
+            handle = self.store.put(observations)
+            step.observations = (
+                f"{observations[: self.excerpt_chars]}\n"
+                f"[{len(observations) - self.excerpt_chars} more characters removed"
+                f" from memory, read_output('{handle}', start={self.excerpt_chars})"
+                " returns them]"
+            )
+        if (
+            step.code_action
+            and step.tool_calls
+            and isinstance(step.model_output, str)
+            and step.code_action in step.model_output
+        ):
+            step.model_output = step.model_output.replace(
+                step.code_action,
+                "# Code in the tool call below",
+            )
+
+
+memory_compactor = MemoryCompactor()
+
+
+def compact_memory(memory_step: ActionStep, agent: MultiStepAgent) -> None:
+    """Keep the memory of the agent under the token budget."""
+    memory_compactor(memory_step, agent)
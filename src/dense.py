@@ -0,0 +1,381 @@
+"""On-disk approximate nearest-neighbour index of text embeddings."""
+
+import json
+import math
+import shutil
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+
+# The tail of vectors not yet clustered is merged into the lists once it holds more
+# than this fraction of the clustered vectors
+TAIL_RATIO = 0.1
+MIN_TAIL_SIZE = 10_000
+# Lists are only trained again once the index grew by this factor
+RETRAIN_GROWTH = 4
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+BLOCK_SIZE = 65_536
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale vectors to unit norm, leaving null vectors unchanged."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Quantize vectors to int8 codes, with one float32 scale per vector."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1, initial=0.0) / 127
+    codes = np.round(vectors / np.where(scales > 0, scales, 1.0)[:, None])
+    return codes.astype(np.int8), scales.astype(np.float32)
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Return the index of the centroid closest to each vector, by blocks.
+
+    The closest centroid of a vector does not depend on its norm, so quantization
+    codes can be assigned without their scales.
+    """
+    return np.concatenate(
+        [
+            np.argmax(
+                vectors[start : start + BLOCK_SIZE].astype(np.float32) @ centroids.T,
+                axis=1,
+            )
+            for start in range(0, len(vectors), BLOCK_SIZE)
+        ]
+        or [np.empty(0, dtype=np.int64)],
+    )
+
+
+def train_centroids(
+    vectors: np.ndarray,
+    n_lists: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """Cluster a sample of vectors, or of their codes, with spherical k-means."""
+    sample_size = min(len(vectors), n_lists * KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    sample = normalize(sample.astype(np.float32))
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = assign_lists(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        non_empty = counts > 0
+        starts = (np.cumsum(counts) - counts)[non_empty]
+        # Empty lists keep their centroid
+        centroids[non_empty] = normalize(np.add.reduceat(sample[order], starts))
+    return centroids
+
+
+class ClusteredVectors:
+    """
+    Vectors grouped into lists of nearest centroid, memory-mapped from a directory.
+
+    Vectors are stored as int8 codes and float32 scales. The codes of list ``i`` are
+    contiguous, between ``list_offsets[i]`` and ``list_offsets[i + 1]``, so probing a
+    list reads a single slice.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Memory-map the lists stored in ``path``."""
+        self.path = path
+        self.codes = np.load(path / "codes.npy", mmap_mode="r")
+        self.scales = np.load(path / "scales.npy", mmap_mode="r")
+        self.ids = np.load(path / "ids.npy", mmap_mode="r")
+        self.centroids = np.load(path / "centroids.npy")
+        self.list_offsets = np.load(path / "list_offsets.npy")
+
+    def __len__(self) -> int:
+        """Return the number of vectors, including deleted ones."""
+        return len(self.ids)
+
+    @classmethod
+    def write(
+        cls,
+        path: Path,
+        ids: np.ndarray,
+        codes: np.ndarray,
+        scales: np.ndarray,
+        centroids: np.ndarray,
+    ) -> "ClusteredVectors":
+        """Write quantized vectors grouped by nearest centroid to ``path``."""
+        assignments = assign_lists(codes, centroids)
+        order = np.argsort(assignments, kind="stable")
+        path.mkdir(parents=True)
+        np.save(path / "codes.npy", codes[order])
+        np.save(path / "scales.npy", scales[order])
+        np.save(path / "ids.npy", ids[order])
+        np.save(path / "centroids.npy", centroids.astype(np.float32))
+        np.save(
+            path / "list_offsets.npy",
+            np.searchsorted(assignments[order], np.arange(len(centroids) + 1)),
+        )
+        return cls(path)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        n_probe: int,
+        deleted_mask: np.ndarray | None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the rows and scores of the top-k vectors of the closest lists."""
+        lists = np.arange(len(self.centroids))
+        if len(lists) > n_probe:
+            lists = np.argpartition(self.centroids @ query, -n_probe)[-n_probe:]
+        rows = np.concatenate(
+            [np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in lists],
+        )
+        codes = np.concatenate(
+            [
+                self.codes[self.list_offsets[i] : self.list_offsets[i + 1]]
+                for i in lists
+            ],
+        )
+        scores = (codes.astype(np.float32) @ query) * self.scales[rows]
+        if deleted_mask is not None:
+            scores[deleted_mask[rows]] = -np.inf
+        return top_k(rows, scores, k)
+
+
+def top_k(
+    rows: np.ndarray,
+    scores: np.ndarray,
+    k: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return the rows and scores of the ``k`` best finite scores, best first."""
+    if len(scores) > k:
+        best = np.argpartition(scores, -k)[-k:]
+        rows, scores = rows[best], scores[best]
+    order = np.argsort(-scores, kind="stable")
+    finite = np.isfinite(scores[order])
+    return rows[order][finite], scores[order][finite]
+
+
+class DenseIndex:
+    """
+    Persistent inverted-file (IVF) index of unit vectors, by id.
+
+    Most vectors are clustered into about ``sqrt(n)`` lists of nearest centroid,
+    quantized to int8 and memory-mapped; a query only scores the vectors of the
+    ``n_probe`` lists closest to it. New vectors are appended to a float16 tail,
+    scored exhaustively from memory, until it is merged into the lists.
+
+    Ids are expected to identify their content, like content hashes: adding an id
+    already in the index keeps its vector.
+    """
+
+    def __init__(self, path: str | Path, dimension: int, n_probe: int = 16) -> None:
+        """Open the index stored in ``path``, creating it if needed."""
+        self.path = Path(path)
+        self.dimension = dimension
+        self.n_probe = n_probe
+        self._lock = threading.Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.path / "manifest.json"
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text())
+        else:
+            manifest = {
+                "clustered": None,
+                "next_clustered": 0,
+                "trained_size": 0,
+                "tail_size": 0,
+                "deleted": [],
+            }
+        self._manifest = manifest
+        self._clustered = (
+            ClusteredVectors(self.path / manifest["clustered"])
+            if manifest["clustered"]
+            else None
+        )
+        self._deleted = set(manifest["deleted"])
+        # The tail files may hold rows appended after the last manifest was written
+        tail_size = manifest["tail_size"]
+        with (self.path / "tail_vectors.f16").open("ab") as tail_file:
+            tail_file.truncate(tail_size * self.dimension * 2)
+        tail_ids_path = self.path / "tail_ids.txt"
+        self._tail_ids = (
+            tail_ids_path.read_text().splitlines()[:tail_size]
+            if tail_ids_path.exists()
+            else []
+        )
+        tail_ids_path.write_text("".join(f"{tail_id}\n" for tail_id in self._tail_ids))
+        # Float32 copy of the tail searched by queries, with room to append to it
+        self._tail_buffer = np.array(self._tail_vectors(), dtype=np.float32)
+        self._tail_rows = {tail_id: row for row, tail_id in enumerate(self._tail_ids)}
+        self._all_ids = {
+            *(self._clustered.ids.tolist() if self._clustered else []),
+            *self._tail_ids,
+        }
+        self._update_view()
+
+    def __len__(self) -> int:
+        """Return the number of vectors in the index."""
+        return len(self._all_ids) - len(self._deleted)
+
+    def ids(self) -> set[str]:
+        """Return the ids of the vectors of the index."""
+        return self._all_ids - self._deleted
+
+    def add(self, ids: Iterable[str], vectors: np.ndarray) -> None:
+        """Add unit vectors by id, ids already in the index being kept as they are."""
+        with self._lock:
+            new_rows, new_ids = [], []
+            for row, vector_id in enumerate(ids):
+                if vector_id in self._deleted:
+                    self._deleted.discard(vector_id)
+                elif vector_id not in self._all_ids:
+                    new_rows.append(row)
+                    new_ids.append(vector_id)
+                    self._all_ids.add(vector_id)
+            if new_ids:
+                with (self.path / "tail_vectors.f16").open("ab") as tail_file:
+                    tail_file.write(vectors[new_rows].astype(np.float16).tobytes())
+                with (self.path / "tail_ids.txt").open("a") as tail_ids_file:
+                    tail_ids_file.writelines(f"{new_id}\n" for new_id in new_ids)
+                self._append_tail(new_ids, vectors[new_rows])
+            clustered_size = len(self._clustered) if self._clustered else 0
+            if len(self._tail_ids) > max(MIN_TAIL_SIZE, TAIL_RATIO * clustered_size):
+                self._merge_tail()
+            self._commit()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        """Delete vectors by id."""
+        with self._lock:
+            self._deleted.update(set(ids) & self._all_ids)
+            self._commit()
+
+    def search(self, query: np.ndarray, k: int = 5) -> list[tuple[str, float]]:
+        """Return the ids and cosine similarities of the ``k`` nearest vectors."""
+        clustered, tail_vectors, tail_ids, deleted_masks = self._view
+        query = query.astype(np.float32)
+        results = []
+        if clustered is not None:
+            rows, scores = clustered.search(query, k, self.n_probe, deleted_masks[0])
+            results += zip(clustered.ids[rows].tolist(), scores.tolist(), strict=True)
+        if len(tail_vectors):
+            scores = tail_vectors @ query
+            if deleted_masks[1] is not None:
+                scores[deleted_masks[1]] = -np.inf
+            rows, scores = top_k(np.arange(len(scores)), scores, k)
+            results += zip(
+                [tail_ids[row] for row in rows.tolist()],
+                scores.tolist(),
+                strict=True,
+            )
+        return sorted(results, key=lambda result: result[1], reverse=True)[:k]
+
+    def _merge_tail(self) -> None:
+        """Merge the tail into the lists, training them again if the index grew."""
+        old_clustered = self._clustered
+        ids = np.array(
+            [
+                *(old_clustered.ids if old_clustered else []),
+                *self._tail_ids,
+            ],
+            dtype=str,
+        )
+        codes, scales = quantize(self._tail_vectors())
+        if old_clustered is not None:
+            codes = np.concatenate([old_clustered.codes, codes])
+            scales = np.concatenate([old_clustered.scales, scales])
+        live = ~np.isin(ids, list(self._deleted))
+        ids, codes, scales = ids[live], codes[live], scales[live]
+        centroids = old_clustered.centroids if old_clustered else None
+        grown = len(ids) > RETRAIN_GROWTH * self._manifest["trained_size"]
+        if centroids is None or grown:
+            centroids = train_centroids(
+                codes,
+                max(1, math.isqrt(len(ids))),
+                np.random.default_rng(len(ids)),
+            )
+            self._manifest["trained_size"] = len(ids)
+        name = f"clustered_{self._manifest['next_clustered']:06d}"
+        self._manifest["next_clustered"] += 1
+        self._clustered = ClusteredVectors.write(
+            self.path / name,
+            ids,
+            codes,
+            scales,
+            centroids,
+        )
+        self._manifest["clustered"] = name
+        self._all_ids = set(ids.tolist())
+        self._deleted = set()
+        self._tail_ids = []
+        self._tail_buffer = np.empty((0, self.dimension), dtype=np.float32)
+        self._tail_rows = {}
+        self._commit()
+        (self.path / "tail_vectors.f16").open("wb").close()
+        (self.path / "tail_ids.txt").open("w").close()
+        if old_clustered is not None:
+            shutil.rmtree(old_clustered.path)
+
+    def _commit(self) -> None:
+        """Atomically write the manifest and refresh the view used by searches."""
+        self._manifest["tail_size"] = len(self._tail_ids)
+        self._manifest["deleted"] = sorted(self._deleted)
+        tmp_path = self.path / "manifest.json.tmp"
+        tmp_path.write_text(json.dumps(self._manifest))
+        tmp_path.replace(self.path / "manifest.json")
+        self._update_view()
+
+    def _tail_vectors(self) -> np.ndarray:
+        """Memory-map the vectors of the tail."""
+        if not self._tail_ids:
+            return np.empty((0, self.dimension), dtype=np.float16)
+        return np.memmap(
+            self.path / "tail_vectors.f16",
+            dtype=np.float16,
+            mode="r",
+            shape=(len(self._tail_ids), self.dimension),
+        )
+
+    def _append_tail(self, ids: list[str], vectors: np.ndarray) -> None:
+        """Append vectors to the tail searched by queries, as stored in float16."""
+        size = len(self._tail_ids)
+        if size + len(ids) > len(self._tail_buffer):
+            # Grown geometrically, so that each vector is copied a constant number
+            # of times on average
+            buffer = np.empty(
+                (max(2 * len(self._tail_buffer), size + len(ids)), self.dimension),
+                dtype=np.float32,
+            )
+            buffer[:size] = self._tail_buffer[:size]
+            self._tail_buffer = buffer
+        # Searches only read the rows before ``size``, which are never overwritten
+        self._tail_buffer[size : size + len(ids)] = vectors.astype(np.float16)
+        self._tail_rows.update((tail_id, size + row) for row, tail_id in enumerate(ids))
+        self._tail_ids.extend(ids)
+
+    def _update_view(self) -> None:
+        """Compute the deleted masks and swap the state searched by queries."""
+        tail_size = len(self._tail_ids)
+        clustered_mask = tail_mask = None
+        if self._deleted:
+            if self._clustered:
+                clustered_mask = np.isin(self._clustered.ids, list(self._deleted))
+            tail_mask = np.zeros(tail_size, dtype=bool)
+            tail_mask[
+                [
+                    self._tail_rows[deleted_id]
+                    for deleted_id in self._deleted
+                    if deleted_id in self._tail_rows
+                ]
+            ] = True
+        # Swapped at once, so that concurrent searches see a consistent state. The
+        # tail ids are only appended to, searches read those of their tail vectors.
+        self._view = (
+            self._clustered,
+            self._tail_buffer[:tail_size],
+            self._tail_ids,
+            (clustered_mask, tail_mask),
+        )
@@ -1,9 +1,23 @@
 """Documents for the party planning agent."""
 
+import functools
+
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 
+@functools.cache
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Return the splitter cutting documents into retrievable chunks."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=500,
+        chunk_overlap=50,
+        add_start_index=True,
+        strip_whitespace=True,
+        separators=["\n\n", "\n", ".", " ", ""],
+    )
+
+
 def get_documents() -> list[Document]:
     """Get the documents for the party planning agent."""
     # Simulate a knowledge base about party planning
@@ -50,11 +64,4 @@ def get_documents() -> list[Document]:
         for doc in party_ideas
     ]
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50,
-        add_start_index=True,
-        strip_whitespace=True,
-        separators=["\n\n", "\n", ".", " ", ""],
-    )
-    return text_splitter.split_documents(source_docs)
+    return get_text_splitter().split_documents(source_docs)
@@ -1,17 +1,108 @@
 """Driver."""
 
-import helium
-from selenium import webdriver
+import atexit
+import contextlib
+import os
+import threading
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
 
+# helium and selenium are only imported once a browser is needed
+if TYPE_CHECKING:
+    from selenium import webdriver
 
-def initialize_driver() -> webdriver.Chrome:
+# Seconds a browser agent waits for the browser before failing
+BROWSER_LEASE_TIMEOUT = float(os.getenv("BROWSER_LEASE_TIMEOUT", "300"))
+
+
+def initialize_driver(*, headless: bool = False) -> "webdriver.Chrome":
     """Initialize the Selenium WebDriver."""
+    import helium  # noqa: PLC0415
+    from selenium import webdriver  # noqa: PLC0415
+
     chrome_options = webdriver.ChromeOptions()
     chrome_options.add_argument("--force-device-scale-factor=1")
     chrome_options.add_argument("--window-size=1000,1350")
     chrome_options.add_argument("--disable-pdf-viewer")
     chrome_options.add_argument("--window-position=0,0")
-    return helium.start_chrome(headless=False, options=chrome_options)
+    return helium.start_chrome(headless=headless, options=chrome_options)
+
+
+class BrowserDriver:
+    """
+    Browser driver shared by the runs of the browser agent, started on first use.
+
+    The agent's code drives the browser with helium, whose driver is process-wide,
+    so a single browser agent runs at a time: a run holds the driver for its whole
+    duration in a ``session``, which waits up to ``timeout`` seconds for the
+    previous one to end. The browser tools, whatever the thread they run in, use
+    the driver of the current session.
+    """
+
+    def __init__(
+        self,
+        *,
+        headless: bool = False,
+        timeout: float = BROWSER_LEASE_TIMEOUT,
+    ) -> None:
+        """Prepare the driver, no browser is started until a session needs it."""
+        self.headless = headless
+        self.timeout = timeout
+        self._driver: webdriver.Chrome | None = None
+        self._lock = threading.Lock()
+        self._in_session = False
+
+    def get_driver(self) -> "webdriver.Chrome":
+        """Return the driver of the current session."""
+        if not self._in_session:
+            msg = (
+                "The browser is only available to browser agents, in a"
+                " browser_driver.session()."
+            )
+            raise RuntimeError(msg)
+        return self._driver
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator["webdriver.Chrome"]:
+        """
+        Hold the driver for the duration of a browser agent run.
+
+        The browser is started on entry, so that helium commands in the agent's
+        first step already have a browser to drive.
+        """
+        import helium  # noqa: PLC0415
+
+        if not self._lock.acquire(timeout=self.timeout):
+            msg = (
+                f"The browser was not free after {self.timeout:.0f}s: another agent"
+                " is using it, please retry later."
+            )
+            raise TimeoutError(msg)
+        try:
+            if self._driver is None:
+                self._driver = initialize_driver(headless=self.headless)
+            # Helium commands run by the agent's code use the global helium driver
+            helium.set_driver(self._driver)
+            self._in_session = True
+            yield self._driver
+        finally:
+            self._in_session = False
+            self._lock.release()
+
+    def close(self) -> None:
+        """Quit the browser."""
+        if self._driver is not None:
+            with contextlib.suppress(Exception):
+                self._driver.quit()
+            self._driver = None
+
+
+browser_driver = BrowserDriver(
+    headless=os.getenv("BROWSER_HEADLESS", "false").lower() == "true",
+)
+atexit.register(browser_driver.close)
 
 
-driver = initialize_driver()
+def get_driver() -> "webdriver.Chrome":
+    """Return the browser driver of the current browser agent run."""
+    return browser_driver.get_driver()
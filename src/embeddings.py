@@ -0,0 +1,194 @@
+"""Local CPU text embeddings, cached on disk by content hash."""
+
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+from huggingface_hub import snapshot_download
+from tokenizers import Tokenizer
+
+from src.bm25 import content_hash
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "minishlab/potion-base-8M")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".index/embeddings.sqlite")
+
+SAFETENSORS_DTYPES = {
+    "F64": np.float64,
+    "F32": np.float32,
+    "F16": np.float16,
+    "I64": np.int64,
+    "I32": np.int32,
+    "I8": np.int8,
+}
+
+
+def read_safetensors(path: Path) -> dict[str, np.ndarray]:
+    """Memory-map the tensors of a safetensors file."""
+    with path.open("rb") as file:
+        header_size = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_size))
+    header.pop("__metadata__", None)
+    return {
+        name: np.memmap(
+            path,
+            dtype=SAFETENSORS_DTYPES[tensor["dtype"]],
+            mode="r",
+            offset=8 + header_size + tensor["data_offsets"][0],
+            shape=tuple(tensor["shape"]),
+        )
+        for name, tensor in header.items()
+    }
+
+
+class StaticEmbeddingModel:
+    """
+    Static embedding model, in the Model2Vec format.
+
+    A text is embedded as the mean of the embeddings of its tokens, so that embedding
+    is a table lookup: it runs in microseconds on CPU, with no deep learning library.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        embeddings: np.ndarray,
+        tokenizer: Tokenizer,
+        *,
+        normalize: bool = True,
+        max_length: int = 512,
+    ) -> None:
+        """Wrap a token embedding matrix and its tokenizer."""
+        self.name = name
+        self.embeddings = embeddings
+        self.tokenizer = tokenizer
+        self.normalize = normalize
+        self.max_length = max_length
+
+    @classmethod
+    def load(cls, name_or_path: str = EMBEDDING_MODEL) -> "StaticEmbeddingModel":
+        """Load a model from a local directory or from the Hugging Face Hub."""
+        path = Path(name_or_path)
+        if not path.is_dir():
+            path = Path(
+                snapshot_download(
+                    name_or_path,
+                    allow_patterns=["config.json", "tokenizer.json", "*.safetensors"],
+                ),
+            )
+        config_path = path / "config.json"
+        config = json.loads(config_path.read_text()) if config_path.exists() else {}
+        return cls(
+            name_or_path,
+            read_safetensors(path / "model.safetensors")["embeddings"],
+            Tokenizer.from_file(str(path / "tokenizer.json")),
+            normalize=config.get("normalize", True),
+        )
+
+    @property
+    def dimension(self) -> int:
+        """Return the dimension of the embeddings."""
+        return self.embeddings.shape[1]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Return the float32 embeddings of texts, one row per text."""
+        token_ids = [
+            encoding.ids[: self.max_length]
+            for encoding in self.tokenizer.encode_batch(
+                list(texts),
+                add_special_tokens=False,
+            )
+        ]
+        lengths = np.array([len(ids) for ids in token_ids], dtype=np.int64)
+        vectors = np.zeros((len(token_ids), self.dimension), dtype=np.float32)
+        non_empty = lengths > 0
+        if non_empty.any():
+            flat_ids = np.fromiter(
+                itertools.chain.from_iterable(token_ids),
+                dtype=np.int64,
+                count=int(lengths.sum()),
+            )
+            starts = (np.cumsum(lengths) - lengths)[non_empty]
+            sums = np.add.reduceat(
+                self.embeddings[flat_ids].astype(np.float32),
+                starts,
+            )
+            vectors[non_empty] = sums / lengths[non_empty, None]
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms > 0, norms, 1.0)
+        return vectors
+
+
+class EmbeddingCache:
+    """
+    Embed texts with a model, caching the embeddings on disk by content hash.
+
+    The cache is a SQLite database of float16 vectors keyed by model and hash of
+    the text, so re-indexing a corpus only embeds its new chunks.
+    """
+
+    def __init__(self, path: str | Path, model: StaticEmbeddingModel) -> None:
+        """Open the cache database, creating it if needed."""
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash)"
+            ") WITHOUT ROWID",
+        )
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Return the float32 embeddings of texts, computing the missing ones."""
+        hashes = [content_hash(text) for text in texts]
+        with self._lock:
+            vectors = self._get(set(hashes))
+            missing = {
+                text_hash: text
+                for text_hash, text in zip(hashes, texts, strict=True)
+                if text_hash not in vectors
+            }
+            if missing:
+                new_vectors = self.model.embed(list(missing.values()))
+                new_vectors = new_vectors.astype(np.float16)
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    (
+                        (self.model.name, text_hash, vector.tobytes())
+                        for text_hash, vector in zip(missing, new_vectors, strict=True)
+                    ),
+                )
+                self._connection.commit()
+                vectors.update(zip(missing, new_vectors, strict=True))
+            self.hits += len(hashes) - len(missing)
+            self.misses += len(missing)
+        if not hashes:
+            return np.empty((0, self.model.dimension), dtype=np.float32)
+        return np.stack([vectors[text_hash] for text_hash in hashes]).astype(
+            np.float32,
+        )
+
+    def _get(self, hashes: set[str], batch_size: int = 500) -> dict[str, np.ndarray]:
+        """Return the cached vectors of the given hashes."""
+        hashes = list(hashes)
+        vectors = {}
+        for start in range(0, len(hashes), batch_size):
+            batch = hashes[start : start + batch_size]
+            rows = self._connection.execute(
+                "SELECT hash, vector FROM embeddings"  # noqa: S608
+                f" WHERE model = ? AND hash IN ({', '.join('?' * len(batch))})",
+                [self.model.name, *batch],
+            )
+            vectors.update(
+                (text_hash, np.frombuffer(vector, dtype=np.float16))
+                for text_hash, vector in rows
+            )
+        return vectors
@@ -0,0 +1,102 @@
+"""Hybrid retrieval fusing BM25 and dense embedding search."""
+
+from collections.abc import Sequence
+
+from langchain.docstore.document import Document
+
+from src.bm25 import BM25Index
+from src.dense import DenseIndex
+from src.embeddings import EmbeddingCache
+
+# Rank offset of reciprocal rank fusion, damping the weight of the first ranks
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[tuple[str, float]]],
+    weights: Sequence[float],
+) -> list[tuple[str, float]]:
+    """Fuse rankings of (id, score) by the weighted sum of 1 / (RRF_K + rank)."""
+    fused: dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights, strict=True):
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (RRF_K + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def weighted_score_fusion(
+    rankings: Sequence[Sequence[tuple[str, float]]],
+    weights: Sequence[float],
+) -> list[tuple[str, float]]:
+    """Fuse rankings of (id, score) by the weighted sum of min-max scaled scores."""
+    fused: dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights, strict=True):
+        if not ranking:
+            continue
+        scores = [score for _, score in ranking]
+        low, high = min(scores), max(scores)
+        for doc_id, score in ranking:
+            scaled = (score - low) / (high - low) if high > low else 1.0
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight * scaled
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+FUSIONS = {"rrf": reciprocal_rank_fusion, "weighted": weighted_score_fusion}
+
+
+class HybridRetriever:
+    """
+    Retrieve documents of a BM25 index by fusing its ranking with a dense one.
+
+    The dense index mirrors the documents of the BM25 index, embedded through the
+    embedding cache. Each side retrieves ``n_candidates`` documents, whose rankings
+    are fused by reciprocal rank fusion ("rrf") or by a weighted sum of their
+    scaled scores ("weighted").
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        lexical: BM25Index,
+        dense: DenseIndex,
+        embeddings: EmbeddingCache,
+        fusion: str = "rrf",
+        dense_weight: float = 0.5,
+        n_candidates: int = 50,
+    ) -> None:
+        """Combine a BM25 index with the dense index of the same documents."""
+        self.lexical = lexical
+        self.dense = dense
+        self.embeddings = embeddings
+        self.fuse = FUSIONS[fusion]
+        self.weights = (1 - dense_weight, dense_weight)
+        self.n_candidates = n_candidates
+
+    def sync(self, batch_size: int = 1000) -> int:
+        """Embed the new documents of the BM25 index, return how many were added."""
+        lexical_ids = set(self.lexical.ids())
+        dense_ids = self.dense.ids()
+        self.dense.delete(dense_ids - lexical_ids)
+        missing = sorted(lexical_ids - dense_ids)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start : start + batch_size]
+            texts = [self.lexical.get(doc_id).page_content for doc_id in batch]
+            self.dense.add(batch, self.embeddings.embed(texts))
+        return len(missing)
+
+    def search_ids(self, query: str, k: int = 5) -> list[tuple[str, float]]:
+        """Return the ids and fused scores of the ``k`` best documents."""
+        query_vector = self.embeddings.model.embed([query])[0]
+        return self.fuse(
+            [
+                self.lexical.search_ids(query, self.n_candidates),
+                self.dense.search(query_vector, self.n_candidates),
+            ],
+            self.weights,
+        )[:k]
+
+    def search(self, query: str, k: int = 5) -> list[Document]:
+        """Return the ``k`` documents best matching ``query``."""
+        documents = (
+            self.lexical.get(doc_id) for doc_id, _ in self.search_ids(query, k)
+        )
+        return [document for document in documents if document is not None]
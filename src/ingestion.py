@@ -0,0 +1,236 @@
+"""Streaming ingestion of document directories into the BM25 index."""
+
+import json
+import os
+import time
+from collections import Counter, deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from langchain.docstore.document import Document
+
+from src.bm25 import BM25Index, content_hash
+from src.documents import get_text_splitter
+from src.logger import logger
+
+SOURCE_SUFFIXES = (".txt", ".md", ".jsonl")
+STATE_FILE = "ingested_files.json"
+
+# Chunk of a file, as sent back by the splitting workers: id, text and metadata
+Chunk = tuple[str, str, dict[str, Any]]
+
+
+@dataclass
+class IngestionReport:
+    """Counters of an ingestion run."""
+
+    ingested_files: int = 0
+    skipped_files: int = 0
+    removed_files: int = 0
+    ingested_bytes: int = 0
+    chunks: int = 0
+    duplicate_chunks: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        """Summarize the run and its throughput."""
+        seconds = max(self.seconds, 1e-9)
+        return (
+            f"{self.ingested_files} files ingested, {self.skipped_files} unchanged,"
+            f" {self.removed_files} removed; {self.chunks} chunks"
+            f" ({self.duplicate_chunks} duplicates) in {self.seconds:.2f}s:"
+            f" {self.ingested_bytes / 1e6 / seconds:.2f} MB/s,"
+            f" {self.chunks / seconds:.0f} chunks/s"
+        )
+
+
+def iter_source_files(directory: Path) -> Iterator[Path]:
+    """Yield the text, Markdown and JSONL files of a directory tree, sorted."""
+    for path in sorted(directory.rglob("*")):
+        if path.suffix in SOURCE_SUFFIXES and path.is_file():
+            yield path
+
+
+def iter_file_documents(path: Path, source: str) -> Iterator[Document]:
+    """
+    Yield the documents of a file.
+
+    A text or Markdown file is one document. Each line of a JSONL file is a document
+    whose ``text`` key is the content, its other keys being its metadata.
+    """
+    if path.suffix != ".jsonl":
+        yield Document(
+            page_content=path.read_text(encoding="utf-8", errors="replace"),
+            metadata={"source": source},
+        )
+        return
+    with path.open(encoding="utf-8", errors="replace") as file:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                record = json.loads(line)
+                text = record.pop("text")
+                yield Document(
+                    page_content=text,
+                    metadata={**record, "source": source, "line": line_number},
+                )
+
+
+def split_file(path: Path, source: str) -> list[Chunk]:
+    """Split a file into chunks identified by the hash of their content."""
+    chunks = get_text_splitter().split_documents(iter_file_documents(path, source))
+    return [
+        (content_hash(chunk.page_content), chunk.page_content, chunk.metadata)
+        for chunk in chunks
+    ]
+
+
+def imap_bounded(
+    executor: Executor,
+    function: Callable[..., Any],
+    arguments: Iterable[tuple],
+    max_pending: int,
+) -> Iterator[Any]:
+    """Like ``executor.map``, with at most ``max_pending`` calls in flight."""
+    pending = deque()
+    for function_arguments in arguments:
+        pending.append(executor.submit(function, *function_arguments))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class DirectoryIngestor:
+    """
+    Add the chunks of the files of a directory to an index, skipping unchanged files.
+
+    Files are split in a process pool and their chunks streamed into the index by
+    batches, so that memory is bounded by a few files and one batch of chunks.
+    Chunks are identified by the hash of their content, a chunk found in several
+    files being indexed once. The size, modification time and chunks of each
+    ingested file are recorded next to the index: an unchanged file is not read
+    again, and the chunks of a changed or removed file that no other file contains
+    are deleted from the index.
+    """
+
+    def __init__(
+        self,
+        index: BM25Index,
+        max_workers: int | None = None,
+        batch_size: int = 10_000,
+    ) -> None:
+        """Configure the ingestion into ``index``."""
+        self.index = index
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.state_path = index.path / STATE_FILE
+
+    def ingest(self, directory: str | Path) -> IngestionReport:
+        """Ingest the new and changed files of a directory, forget the removed ones."""
+        start = time.perf_counter()
+        directory = Path(directory)
+        report = IngestionReport()
+        self._files: dict[str, dict[str, Any]] = (
+            json.loads(self.state_path.read_text()) if self.state_path.exists() else {}
+        )
+        # Number of ingested files containing each chunk of the index
+        self._references = Counter(
+            chunk_id
+            for file_state in self._files.values()
+            for chunk_id in file_state["chunks"]
+        )
+        self._batch: list[Document] = []
+        self._split_files: dict[str, dict[str, Any]] = {}
+
+        to_split = []
+        sources = set()
+        for path in iter_source_files(directory):
+            source = path.relative_to(directory).as_posix()
+            sources.add(source)
+            stat = path.stat()
+            file_state = self._files.get(source, {})
+            if (file_state.get("size"), file_state.get("mtime_ns")) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                report.skipped_files += 1
+            else:
+                to_split.append((path, source, stat))
+        # Files whose previous chunks are released at the next flush
+        self._released = list(self._files.keys() - sources)
+        report.removed_files = len(self._released)
+
+        try:
+            with ProcessPoolExecutor(self.max_workers) as executor:
+                chunk_lists = imap_bounded(
+                    executor,
+                    split_file,
+                    ((path, source) for path, source, _ in to_split),
+                    2 * self.max_workers,
+                )
+                for (_, source, stat), chunks in zip(
+                    to_split,
+                    chunk_lists,
+                    strict=True,
+                ):
+                    self._add_file(source, stat, chunks, report)
+                    if len(self._batch) >= self.batch_size:
+                        self._flush()
+                self._flush()
+        finally:
+            # Only the files whose chunks reached the index are recorded
+            tmp_path = self.state_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self._files))
+            tmp_path.replace(self.state_path)
+
+        report.seconds = time.perf_counter() - start
+        logger.info("Ingested %s: %s", directory, report)
+        return report
+
+    def _add_file(
+        self,
+        source: str,
+        stat: os.stat_result,
+        chunks: list[Chunk],
+        report: IngestionReport,
+    ) -> None:
+        """Queue the chunks of a file that are not indexed yet."""
+        for chunk_id, text, metadata in chunks:
+            if self._references[chunk_id]:
+                # Already indexed, from another file or a previous run
+                report.duplicate_chunks += 1
+            else:
+                self._batch.append(
+                    Document(id=chunk_id, page_content=text, metadata=metadata),
+                )
+            self._references[chunk_id] += 1
+        if source in self._files:
+            self._released.append(source)
+        self._split_files[source] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "chunks": [chunk_id for chunk_id, _, _ in chunks],
+        }
+        report.ingested_files += 1
+        report.ingested_bytes += stat.st_size
+        report.chunks += len(chunks)
+
+    def _flush(self) -> None:
+        """Apply the queued chunks and releases to the index."""
+        unreferenced = []
+        for source in self._released:
+            for chunk_id in self._files.pop(source)["chunks"]:
+                self._references[chunk_id] -= 1
+                if not self._references[chunk_id]:
+                    unreferenced.append(chunk_id)
+        self._released.clear()
+        self.index.delete(
+            chunk_id for chunk_id in unreferenced if not self._references[chunk_id]
+        )
+        self.index.add(self._batch)
+        self._batch.clear()
+        self._files.update(self._split_files)
+        self._split_files.clear()
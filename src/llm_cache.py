@@ -0,0 +1,442 @@
+"""Content-addressed cache of model responses, in memory and on disk."""
+
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Generator
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+from smolagents import ChatMessage, ChatMessageStreamDelta, Model, Tool
+from smolagents.models import (
+    ChatMessageToolCallFunction,
+    ChatMessageToolCallStreamDelta,
+    agglomerate_stream_deltas,
+    get_tool_json_schema,
+)
+from smolagents.monitoring import TokenUsage
+
+from src.logger import logger
+
+# Set LLM_CACHE_PATH, e.g. to .cache/llm_responses.sqlite, to enable the cache
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+
+
+def _json_default(value: Any) -> Any:  # noqa: ANN401
+    """Serialize the images and other objects found in messages for hashing."""
+    if isinstance(value, Image.Image):
+        digest = hashlib.sha256(value.tobytes()).hexdigest()
+        return {"image": digest, "mode": value.mode, "size": value.size}
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    return repr(value)
+
+
+def request_key(
+    model: Model,
+    messages: list[ChatMessage],
+    stop_sequences: list[str] | None = None,
+    response_format: dict[str, str] | None = None,
+    tools_to_call_from: list[Tool] | None = None,
+    **kwargs,  # noqa: ANN003
+) -> str:
+    """Return the hash of everything that determines the response to a request."""
+    request = {
+        "model_id": model.model_id,
+        "model_kwargs": model.kwargs,
+        "messages": [
+            {
+                "role": message.role,
+                "content": message.content,
+                "tool_calls": message.tool_calls,
+            }
+            for message in messages
+        ],
+        "stop_sequences": stop_sequences,
+        "response_format": response_format,
+        "tools": [get_tool_json_schema(tool) for tool in tools_to_call_from or []],
+        "kwargs": kwargs,
+    }
+    serialized = json.dumps(request, sort_keys=True, default=_json_default)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def message_to_dict(message: ChatMessage) -> dict[str, Any]:
+    """Return the JSON-serializable content of a response message."""
+    return {
+        "role": message.role,
+        "content": message.content,
+        "tool_calls": [
+            {
+                "id": tool_call.id,
+                "type": tool_call.type,
+                "function": {
+                    "name": tool_call.function.name,
+                    "arguments": tool_call.function.arguments,
+                },
+            }
+            for tool_call in message.tool_calls
+        ]
+        if message.tool_calls
+        else None,
+        "token_usage": dataclasses.asdict(message.token_usage)
+        if message.token_usage
+        else None,
+    }
+
+
+def delta_to_dict(delta: ChatMessageStreamDelta) -> dict[str, Any]:
+    """Return the JSON-serializable content of a stream delta."""
+    return {
+        "content": delta.content,
+        "tool_calls": [
+            {
+                "index": tool_call.index,
+                "id": tool_call.id,
+                "type": tool_call.type,
+                "function": {
+                    "name": tool_call.function.name,
+                    "arguments": tool_call.function.arguments,
+                }
+                if tool_call.function
+                else None,
+            }
+            for tool_call in delta.tool_calls
+        ]
+        if delta.tool_calls
+        else None,
+        "token_usage": dataclasses.asdict(delta.token_usage)
+        if delta.token_usage
+        else None,
+    }
+
+
+def delta_from_dict(data: dict[str, Any]) -> ChatMessageStreamDelta:
+    """Rebuild a stream delta, without its token usage: replaying it is free."""
+    return ChatMessageStreamDelta(
+        content=data["content"],
+        tool_calls=[
+            ChatMessageToolCallStreamDelta(
+                index=tool_call["index"],
+                id=tool_call["id"],
+                type=tool_call["type"],
+                function=ChatMessageToolCallFunction(**tool_call["function"])
+                if tool_call["function"]
+                else None,
+            )
+            for tool_call in data["tool_calls"]
+        ]
+        if data["tool_calls"]
+        else None,
+    )
+
+
+@dataclasses.dataclass
+class CacheStats:
+    """Counters of a response cache."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    saved_input_tokens: int = 0
+    saved_output_tokens: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        """Return the share of the requests answered from the cache."""
+        hits = self.memory_hits + self.disk_hits
+        return hits / max(hits + self.misses, 1)
+
+    def __str__(self) -> str:
+        """Summarize the hits, misses and saved tokens."""
+        return (
+            f"{self.memory_hits} memory hits, {self.disk_hits} disk hits,"
+            f" {self.misses} misses (hit ratio {self.hit_ratio:.1%}),"
+            f" {self.evictions} evictions; saved {self.saved_input_tokens} input"
+            f" and {self.saved_output_tokens} output tokens"
+        )
+
+
+class ResponseCache:
+    """
+    Two-tier cache of model responses, keyed by request hash.
+
+    The most recently used responses are kept in memory, all of them in a SQLite
+    database that persists across restarts. Entries expire ``ttl`` seconds
+    after being written, and the least recently used ones are evicted when the
+    database grows past ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        ttl: float = LLM_CACHE_TTL,
+        max_bytes: int = int(LLM_CACHE_MAX_MB * 1e6),
+        memory_entries: int = LLM_CACHE_MEMORY_ENTRIES,
+    ) -> None:
+        """Open the cache database, creating it if needed."""
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.stats = CacheStats()
+        self._memory: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, payload BLOB, size INTEGER,"
+            " created REAL, accessed REAL"
+            ") WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);",
+        )
+        self._connection.execute(
+            "DELETE FROM responses WHERE created < ?",
+            (time.time() - ttl,),
+        )
+        self._connection.commit()
+        (size,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses",
+        ).fetchone()
+        self._size = size
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Return the cached response of a request, or None."""
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                created, payload = self._memory[key]
+                if created >= now - self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats.memory_hits += 1
+                    return payload
+                del self._memory[key]
+            row = self._connection.execute(
+                "SELECT payload, created FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                (now, key),
+            )
+            self._connection.commit()
+            payload = json.loads(zlib.decompress(row[0]))
+            self._remember(key, row[1], payload)
+            self.stats.disk_hits += 1
+            return payload
+
+    def put(self, key: str, payload: dict[str, Any]) -> None:
+        """Cache the response of a request, evicting old entries if needed."""
+        now = time.time()
+        blob = zlib.compress(json.dumps(payload).encode())
+        with self._lock:
+            self._remember(key, now, payload)
+            previous = self._connection.execute(
+                "SELECT size FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._size += len(blob) - (previous[0] if previous else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def _remember(self, key: str, created: float, payload: dict[str, Any]) -> None:
+        """Put a response in the in-memory tier."""
+        self._memory[key] = (created, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        """Delete the least recently used responses down to 90% of the size cap."""
+        evicted = []
+        rows = self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed",
+        )
+        for key, size in rows:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        for (key,) in evicted:
+            self._memory.pop(key, None)
+        self.stats.evictions += len(evicted)
+
+
+class CachedModel(Model):
+    """
+    Model answering the requests it has already seen from a response cache.
+
+    Requests are identified by the hash of the model id and settings, the messages,
+    the stop sequences, the response format and the schema of the tools, so only
+    identical requests are answered from the cache. Streamed responses are
+    recorded delta by delta and replayed as such, and a response recorded by one
+    of ``generate`` and ``generate_stream`` answers the other. Cached responses
+    report no token usage, since replaying them is free.
+    """
+
+    def __init__(self, model: Model, cache: ResponseCache) -> None:
+        """Wrap ``model`` with ``cache``."""
+        super().__init__(
+            flatten_messages_as_text=model.flatten_messages_as_text,
+            tool_name_key=model.tool_name_key,
+            tool_arguments_key=model.tool_arguments_key,
+            model_id=model.model_id,
+            **model.kwargs,
+        )
+        self.model = model
+        self.cache = cache
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        """Expose the attributes of the wrapped model, like its client."""
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,  # noqa: ANN003
+    ) -> ChatMessage:
+        """Return the cached response to the request, or generate it."""
+        key = request_key(
+            self.model,
+            messages,
+            stop_sequences,
+            response_format,
+            tools_to_call_from,
+            **kwargs,
+        )
+        payload = self.cache.get(key)
+        if payload is None:
+            message = self.model.generate(
+                messages,
+                stop_sequences=stop_sequences,
+                response_format=response_format,
+                tools_to_call_from=tools_to_call_from,
+                **kwargs,
+            )
+            self.cache.put(key, {"message": message_to_dict(message)})
+            return message
+        if "deltas" in payload:
+            message = agglomerate_stream_deltas(
+                [delta_from_dict(delta) for delta in payload["deltas"]],
+            )
+        else:
+            message = ChatMessage.from_dict(dict(payload["message"]))
+        message.token_usage = TokenUsage(input_tokens=0, output_tokens=0)
+        self._count_saved_tokens(payload)
+        return message
+
+    def generate_stream(
+        self,
+        messages: list[ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Tool] | None = None,
+        **kwargs,  # noqa: ANN003
+    ) -> Generator[ChatMessageStreamDelta]:
+        """Replay the cached response to the request, or stream and record it."""
+        key = request_key(
+            self.model,
+            messages,
+            stop_sequences,
+            response_format,
+            tools_to_call_from,
+            **kwargs,
+        )
+        payload = self.cache.get(key)
+        if payload is None:
+            if not hasattr(self.model, "generate_stream"):
+                message = self.model.generate(
+                    messages,
+                    stop_sequences=stop_sequences,
+                    response_format=response_format,
+                    tools_to_call_from=tools_to_call_from,
+                    **kwargs,
+                )
+                self.cache.put(key, {"message": message_to_dict(message)})
+                delta = delta_from_dict(message_delta(message_to_dict(message)))
+                delta.token_usage = message.token_usage
+                yield delta
+                return
+            deltas = []
+            for delta in self.model.generate_stream(
+                messages,
+                stop_sequences=stop_sequences,
+                response_format=response_format,
+                tools_to_call_from=tools_to_call_from,
+                **kwargs,
+            ):
+                deltas.append(delta_to_dict(delta))
+                yield delta
+            # Only complete responses are cached, not interrupted streams
+            self.cache.put(key, {"deltas": deltas})
+            return
+        self._count_saved_tokens(payload)
+        if "deltas" in payload:
+            for delta in payload["deltas"]:
+                yield delta_from_dict(delta)
+        else:
+            yield delta_from_dict(message_delta(payload["message"]))
+
+    def _count_saved_tokens(self, payload: dict[str, Any]) -> None:
+        """Add the token usage of a cached response to the saved tokens."""
+        if "deltas" in payload:
+            usages = [delta["token_usage"] for delta in payload["deltas"]]
+        else:
+            usages = [payload["message"]["token_usage"]]
+        for usage in usages:
+            if usage:
+                self.cache.stats.saved_input_tokens += usage["input_tokens"]
+                self.cache.stats.saved_output_tokens += usage["output_tokens"]
+
+
+def message_delta(message: dict[str, Any]) -> dict[str, Any]:
+    """Return the single stream delta equivalent to a cached response message."""
+    return {
+        "content": message["content"],
+        "tool_calls": [
+            {**tool_call, "index": index}
+            for index, tool_call in enumerate(message["tool_calls"] or [])
+        ]
+        or None,
+        "token_usage": message["token_usage"],
+    }
+
+
+@functools.cache
+def get_response_cache() -> ResponseCache:
+    """Return the response cache shared by the models of the process."""
+    return ResponseCache(LLM_CACHE_PATH)
+
+
+def cache_responses(model: Model) -> Model:
+    """Wrap a model with the shared response cache, unless it is disabled."""
+    if not LLM_CACHE_PATH:
+        return model
+    logger.info("Caching the responses of %s in %s", model.model_id, LLM_CACHE_PATH)
+    return CachedModel(model, get_response_cache())
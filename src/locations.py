@@ -0,0 +1,122 @@
+"""Spatial index of named locations for the cargo tools."""
+
+import math
+from pathlib import Path
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def to_unit_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Convert latitudes and longitudes in degrees to unit vectors on the sphere."""
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)],
+        axis=-1,
+    )
+
+
+class LocationIndex:
+    """
+    Index of named locations, memory-mapped from files built once from a table.
+
+    Locations are stored as unit vectors sorted by their z coordinate, the sine of
+    their latitude. A query only computes distances to the locations of the latitude
+    band that can be within its search radius, found by binary search.
+    """
+
+    def __init__(self, vectors: np.ndarray, names: np.ndarray) -> None:
+        """Wrap unit vectors sorted by z and the names of their locations."""
+        self.vectors = vectors
+        self.names = names
+        self.z = vectors[:, 2]
+
+    @classmethod
+    def build(cls, locations_path: Path, index_dir: Path) -> None:
+        """
+        Build the index files from a CSV or Parquet table of locations.
+
+        The table must have ``name``, ``latitude`` and ``longitude`` columns.
+        """
+        import pandas as pd  # noqa: PLC0415
+
+        if locations_path.suffix == ".parquet":
+            locations = pd.read_parquet(locations_path)
+        else:
+            locations = pd.read_csv(locations_path)
+        vectors = to_unit_vectors(
+            locations["latitude"].to_numpy(dtype=float),
+            locations["longitude"].to_numpy(dtype=float),
+        )
+        order = np.argsort(vectors[:, 2], kind="stable")
+        index_dir.mkdir(parents=True, exist_ok=True)
+        np.save(index_dir / "vectors.npy", vectors[order])
+        np.save(index_dir / "names.npy", locations["name"].to_numpy(dtype=str)[order])
+
+    @classmethod
+    def load(cls, locations_path: str | Path) -> "LocationIndex":
+        """Memory-map the index of a table of locations, (re)building it if stale."""
+        locations_path = Path(locations_path)
+        index_dir = locations_path.with_suffix(".index")
+        if (
+            not index_dir.exists()
+            or index_dir.stat().st_mtime < locations_path.stat().st_mtime
+        ):
+            cls.build(locations_path, index_dir)
+        return cls(
+            np.load(index_dir / "vectors.npy", mmap_mode="r"),
+            np.load(index_dir / "names.npy", mmap_mode="r"),
+        )
+
+    def within(
+        self,
+        latitude: float,
+        longitude: float,
+        max_distance_km: float,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the indices and distances, sorted, of the locations within reach."""
+        query = to_unit_vectors(np.array(latitude), np.array(longitude))
+        angle = max_distance_km / EARTH_RADIUS_KM
+        if angle >= math.pi:
+            start, stop = 0, len(self.vectors)
+        else:
+            query_latitude = math.asin(query[2])
+            start = np.searchsorted(
+                self.z,
+                math.sin(max(query_latitude - angle, -math.pi / 2)),
+                side="left",
+            )
+            stop = np.searchsorted(
+                self.z,
+                math.sin(min(query_latitude + angle, math.pi / 2)),
+                side="right",
+            )
+        chords = np.linalg.norm(self.vectors[start:stop] - query, axis=1)
+        distances = EARTH_RADIUS_KM * 2 * np.arcsin(np.minimum(chords / 2, 1.0))
+        in_reach = np.flatnonzero(distances <= max_distance_km)
+        in_reach = in_reach[np.argsort(distances[in_reach], kind="stable")]
+        return in_reach + start, distances[in_reach]
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the indices and distances of the ``k`` nearest locations."""
+        if k < 1:
+            msg = f"k must be at least 1, got {k}."
+            raise ValueError(msg)
+        k = min(k, len(self.vectors))
+        # Radius of the spherical cap expected to hold twice k uniform locations
+        angle = math.acos(max(1 - 4 * k / max(len(self.vectors), 1), -1.0))
+        while True:
+            indices, distances = self.within(
+                latitude,
+                longitude,
+                angle * EARTH_RADIUS_KM,
+            )
+            if len(indices) >= k or angle >= math.pi:
+                return indices[:k], distances[:k]
+            angle = min(2 * angle, math.pi)
@@ -1,31 +1,140 @@
 """Logger for the app."""
 
+import atexit
 import base64
+import functools
 import logging
 import os
+from collections import deque
+from pathlib import Path
 
+import rich.live
+import smolagents.agents
 from openinference.instrumentation.smolagents import SmolagentsInstrumentor
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
 
+# Latest spans kept in memory when they are not exported
+TRACES_MAX_SPANS = int(os.getenv("TRACES_MAX_SPANS", "10000"))
 
-def setup_langfuse() -> None:
-    """Setups Langfuse."""
-    langfuse_auth = base64.b64encode(
-        f"{os.getenv('LANGFUSE_PUBLIC_KEY')}:{os.getenv('LANGFUSE_SECRET_KEY')}".encode(),
-    ).decode()
 
-    os.environ["OTEL_EXPORTER_OTLP_ENDPOINT"] = (
-        "https://cloud.langfuse.com/api/public/otel"  # EU data region
-    )
-    os.environ["OTEL_EXPORTER_OTLP_HEADERS"] = f"Authorization=Basic {langfuse_auth}"
+class CountingBatchSpanProcessor(BatchSpanProcessor):
+    """Batch span processor counting the spans dropped when its queue overflows."""
+
+    def __init__(self, *args, **kwargs) -> None:  # noqa: ANN002, ANN003
+        """Initialize the processor with a zeroed drop counter."""
+        super().__init__(*args, **kwargs)
+        self.dropped_spans = 0
+
+    def on_end(self, span: ReadableSpan) -> None:
+        """Queue the span, a span is dropped if the queue is full."""
+        # The queue moved to a private batch processor in opentelemetry-sdk 1.34
+        batch_processor = getattr(self, "_batch_processor", self)
+        queue = getattr(batch_processor, "_queue", getattr(self, "queue", None))
+        if (
+            queue is not None
+            and span.context.trace_flags.sampled
+            and len(queue) == queue.maxlen
+        ):
+            self.dropped_spans += 1
+        super().on_end(span)
+
+
+class BoundedInMemorySpanExporter(InMemorySpanExporter):
+    """In-memory span exporter keeping only the latest ``max_spans`` spans."""
+
+    def __init__(self, max_spans: int = TRACES_MAX_SPANS) -> None:
+        """Keep at most ``max_spans`` spans."""
+        super().__init__()
+        self._finished_spans = deque(maxlen=max_spans)
+
+
+class FileSpanExporter(ConsoleSpanExporter):
+    """Span exporter appending the spans to a JSON lines file."""
+
+    def __init__(self, path: str | Path) -> None:
+        """Open the file for appending."""
+        super().__init__(
+            out=Path(path).open("a"),  # noqa: SIM115
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+
+    def shutdown(self) -> None:
+        """Close the file."""
+        self.out.close()
+
 
+def get_span_exporter() -> SpanExporter:
+    """
+    Return the Langfuse span exporter, or a local sink if Langfuse is not configured.
+
+    Spans go to the ``TRACES_FILE`` JSON lines file when it is set. Otherwise, the
+    latest ``TRACES_MAX_SPANS`` are kept in memory, 0 to drop them all.
+    """
+    public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
+    secret_key = os.getenv("LANGFUSE_SECRET_KEY")
+    if public_key and secret_key:
+        langfuse_auth = base64.b64encode(f"{public_key}:{secret_key}".encode()).decode()
+        os.environ["OTEL_EXPORTER_OTLP_ENDPOINT"] = (
+            "https://cloud.langfuse.com/api/public/otel"  # EU data region
+        )
+        os.environ["OTEL_EXPORTER_OTLP_HEADERS"] = (
+            f"Authorization=Basic {langfuse_auth}"
+        )
+        return OTLPSpanExporter()
+
+    traces_file = os.getenv("TRACES_FILE")
+    if traces_file:
+        return FileSpanExporter(traces_file)
+    return BoundedInMemorySpanExporter()
+
+
+@functools.cache
+def setup_langfuse() -> CountingBatchSpanProcessor:
+    """
+    Setups Langfuse tracing, only once per process.
+
+    Spans are exported in background batches so that exports never block the agent.
+    The flush interval and queue size are set with the standard
+    ``OTEL_BSP_SCHEDULE_DELAY`` and ``OTEL_BSP_MAX_QUEUE_SIZE`` variables.
+    """
+    span_processor = CountingBatchSpanProcessor(get_span_exporter())
     trace_provider = TracerProvider()
-    trace_provider.add_span_processor(SimpleSpanProcessor(OTLPSpanExporter()))
+    trace_provider.add_span_processor(span_processor)
 
     SmolagentsInstrumentor().instrument(tracer_provider=trace_provider)
 
+    def shutdown() -> None:
+        trace_provider.shutdown()
+        if span_processor.dropped_spans:
+            logger.warning(
+                "Dropped %d spans, increase OTEL_BSP_MAX_QUEUE_SIZE.",
+                span_processor.dropped_spans,
+            )
+
+    atexit.register(shutdown)
+    return span_processor
+
+
+@functools.cache
+def disable_live_display_refresh() -> None:
+    """
+    Render streamed model outputs on the console without a refresh thread.
+
+    smolagents shows each streamed model output in a ``rich`` live display, whose
+    refresh thread would cost a thread per concurrent session. The outputs are
+    rendered once complete instead.
+    """
+    smolagents.agents.Live = functools.partial(rich.live.Live, auto_refresh=False)
+
 
 def get_logger() -> logging.Logger:
     """Get logger of the app."""
@@ -1,6 +1,21 @@
 """MCP tools utils."""
 
-from smolagents import Tool, ToolCollection
+import asyncio
+import atexit
+import contextlib
+import functools
+import itertools
+import os
+import threading
+from typing import Any
+
+from mcpadapt.smolagents_adapter import SmolAgentsAdapter
+from smolagents import MCPClient, Tool, ToolCollection
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.types import CallToolResult
+from src.async_bridge import wait_future
+from src.logger import logger
 
 
 def process_mcp_tools(tool_collection: ToolCollection) -> list[Tool]:
@@ -9,3 +24,168 @@ def process_mcp_tools(tool_collection: ToolCollection) -> list[Tool]:
     for tool in mcp_tools:
         tool.name = f"mcp_{tool.name}"
     return mcp_tools
+
+
+def get_pubmed_server_parameters() -> StdioServerParameters:
+    """Return the parameters used to spawn the PubMed MCP server."""
+    return StdioServerParameters(
+        command="uvx",
+        args=["--quiet", "pubmedmcp@0.1.3"],
+        env={"UV_PYTHON": "3.11", **os.environ},
+    )
+
+
+def call_mcp_tool(
+    loop: asyncio.AbstractEventLoop,
+    session: ClientSession,
+    name: str,
+    arguments: dict[str, Any] | None,
+) -> CallToolResult:
+    """Call a tool on the session of an MCP client, run by the client's loop."""
+    return wait_future(
+        asyncio.run_coroutine_threadsafe(session.call_tool(name, arguments), loop),
+    )
+
+
+def get_async_tools(client: MCPClient) -> list[Tool]:
+    """Return the tools of an MCP client, their calls awaited when bridged."""
+    adapter = client._adapter  # noqa: SLF001
+    return [
+        SmolAgentsAdapter().adapt(
+            functools.partial(call_mcp_tool, adapter.loop, session, mcp_tool.name),
+            mcp_tool,
+        )
+        for session, mcp_tools in zip(adapter.sessions, adapter.mcp_tools, strict=True)
+        for mcp_tool in mcp_tools
+    ]
+
+
+class PooledMCPTool(Tool):
+    """MCP tool whose calls are dispatched to one of the servers of a pool."""
+
+    skip_forward_signature_validation = True
+    # Calls are awaited by asynchronous runs instead of blocking their event loop
+    async_aware = True
+
+    def __init__(self, pool: "MCPServerPool", tool: Tool) -> None:
+        """Copy the schema of ``tool`` and remember its name on the server."""
+        self.name = tool.name
+        self.description = tool.description
+        self.inputs = tool.inputs
+        self.output_type = tool.output_type
+        self.pool = pool
+        self.remote_name = tool.name
+        # Tools of a read-only server may be called ahead of the code
+        self.side_effect_free = pool.read_only
+        super().__init__()
+
+    def forward(self, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+        """Run the tool on the next server of the pool."""
+        return self.pool.call(self.remote_name, *args, **kwargs)
+
+
+class MCPServerPool:
+    """
+    Process-wide pool of long-lived MCP server sessions shared across requests.
+
+    Servers are spawned lazily, at most ``size`` of them, and restarted when their
+    session dies. Tool calls are spread round-robin over the servers.
+    """
+
+    def __init__(
+        self,
+        server_parameters: StdioServerParameters,
+        size: int = 1,
+        *,
+        read_only: bool = False,
+    ) -> None:
+        """
+        Create an empty pool, no server is spawned until it is needed.
+
+        The tools of a ``read_only`` server are flagged as ``side_effect_free``.
+        """
+        self.server_parameters = server_parameters
+        self.size = size
+        self.read_only = read_only
+        self._clients: list[MCPClient | None] = [None] * size
+        self._server_tools: list[dict[str, Tool]] = [{} for _ in range(size)]
+        self._locks = [threading.Lock() for _ in range(size)]
+        self._next_slot = itertools.cycle(range(size))
+        self._lock = threading.Lock()
+        self._tools: list[Tool] | None = None
+
+    def start(self) -> None:
+        """Spawn every server of the pool, e.g. at app startup."""
+        for slot in range(self.size):
+            self._get_server_tools(slot)
+
+    def get_tools(self) -> list[Tool]:
+        """Return the pooled MCP tools, processed once and shared by all requests."""
+        with self._lock:
+            if self._tools is None:
+                server_tools = self._get_server_tools(0)
+                tool_collection = ToolCollection(
+                    [PooledMCPTool(self, tool) for tool in server_tools.values()],
+                )
+                self._tools = process_mcp_tools(tool_collection)
+        return self._tools
+
+    def call(self, tool_name: str, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+        """Call ``tool_name`` on the next server, restarting it once if it crashed."""
+        with self._lock:
+            slot = next(self._next_slot)
+        try:
+            return self._get_server_tools(slot)[tool_name].forward(*args, **kwargs)
+        except Exception:
+            if self._is_alive(slot):
+                raise
+            logger.warning(f"MCP server {slot} died, restarting it.")
+            return self._get_server_tools(slot)[tool_name].forward(*args, **kwargs)
+
+    def close(self) -> None:
+        """Disconnect every running server."""
+        for slot in range(self.size):
+            with self._locks[slot]:
+                self._disconnect(slot)
+
+    def _get_server_tools(self, slot: int) -> dict[str, Tool]:
+        """Return the tools of a server, (re)spawning it if it is not healthy."""
+        with self._locks[slot]:
+            if not self._is_alive(slot):
+                self._disconnect(slot)
+                logger.info(f"Starting MCP server {slot}.")
+                client = MCPClient(self.server_parameters)
+                self._clients[slot] = client
+                self._server_tools[slot] = {
+                    tool.name: tool for tool in get_async_tools(client)
+                }
+            return self._server_tools[slot]
+
+    def _is_alive(self, slot: int) -> bool:
+        """Health-check a server by checking its session loop is still running."""
+        client = self._clients[slot]
+        if client is None:
+            return False
+        adapter = client._adapter  # noqa: SLF001
+        return (
+            adapter.thread.is_alive()
+            and adapter.task is not None
+            and not adapter.task.done()
+        )
+
+    def _disconnect(self, slot: int) -> None:
+        """Disconnect a server, ignoring errors from an already dead session."""
+        client = self._clients[slot]
+        self._clients[slot] = None
+        self._server_tools[slot] = {}
+        if client is not None:
+            with contextlib.suppress(Exception):
+                client.disconnect()
+
+
+pubmed_pool = MCPServerPool(
+    get_pubmed_server_parameters(),
+    size=int(os.getenv("MCP_POOL_SIZE", "1")),
+    read_only=True,
+)
+atexit.register(pubmed_pool.close)
@@ -4,29 +4,62 @@ import os
 
 from smolagents import InferenceClientModel, LiteLLMModel, Model
 
+from src.async_bridge import async_client
+from src.llm_cache import cache_responses
+from src.router import Backend, RoutedModel
+
 
 def get_model(model_name: str) -> Model:
-    """Return a model based on the model name passed as argument."""
+    """Return a model based on the model name passed as argument, with its cache."""
     if model_name == "mistral":
-        return get_mistral_model()
+        return cache_responses(get_mistral_model())
     if model_name == "deepseek":
-        return get_deepseek_model()
+        return cache_responses(get_deepseek_model())
+    if model_name == "router":
+        return cache_responses(get_router_model())
     msg = f"Model {model_name} not found."
     raise ValueError(msg)
 
 
-def get_mistral_model() -> Model:
+def get_mistral_model(**kwargs) -> Model:  # noqa: ANN003
     """Return a Mistral model."""
-    return LiteLLMModel(
-        model_id="mistral/mistral-medium-latest",
-        api_key=os.getenv("MISTRAL_API_KEY"),
-        max_tokens=8096,
+    return async_client(
+        LiteLLMModel(
+            model_id="mistral/mistral-medium-latest",
+            api_key=os.getenv("MISTRAL_API_KEY"),
+            max_tokens=8096,
+            **kwargs,
+        ),
     )
 
 
 def get_deepseek_model() -> Model:
     """Return a DeepSeek model."""
-    return InferenceClientModel(
-        "deepseek-ai/DeepSeek-R1",
-        max_tokens=8096,
+    return async_client(
+        InferenceClientModel(
+            "deepseek-ai/DeepSeek-R1",
+            max_tokens=8096,
+        ),
+    )
+
+
+def get_backend(name: str, model: Model) -> Backend:
+    """Return a router backend, with the limits set in the environment."""
+    prefix = name.upper()
+    return Backend(
+        name,
+        model,
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "4")),
+        tokens_per_minute=int(os.getenv(f"{prefix}_TOKENS_PER_MINUTE", "0")) or None,
+    )
+
+
+def get_router_model() -> Model:
+    """Return a model routing requests to Mistral, falling back to DeepSeek."""
+    return RoutedModel(
+        [
+            # The router falls back and hedges instead of retrying
+            get_backend("mistral", get_mistral_model(max_retries=0)),
+            get_backend("deepseek", get_deepseek_model()),
+        ],
     )
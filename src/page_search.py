@@ -0,0 +1,234 @@
+"""In-page text search run by the browser in a single script call."""
+
+import os
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+CTRL_F_MAX_SNIPPETS = int(os.getenv("CTRL_F_MAX_SNIPPETS", "5"))
+CTRL_F_CONTEXT_CHARS = int(os.getenv("CTRL_F_CONTEXT_CHARS", "80"))
+# Longer queries are only matched exactly, approximate matching is O(text x query)
+FUZZY_MAX_QUERY_LENGTH = 64
+
+# Defines window.__pageSearch, which indexes the visible text of the page once, until
+# the DOM changes, then matches, ranks, scrolls to and selects the nth match.
+# Text nodes are concatenated as the user reads them, with a line break between
+# blocks, so that a match may span inline elements such as links or bold text.
+PAGE_SEARCH_SCRIPT = """
+window.__pageSearch = (() => {
+  const SKIPPED_TAGS = new Set(["SCRIPT", "STYLE", "NOSCRIPT", "TEMPLATE", "TITLE"]);
+  let index = null;
+  new MutationObserver(() => { index = null; }).observe(document, {
+    childList: true,
+    subtree: true,
+    characterData: true,
+    attributes: true,
+    attributeFilter: ["class", "hidden", "open"],
+  });
+
+  function isVisible(element) {
+    return element.checkVisibility
+      ? element.checkVisibility({visibilityProperty: true})
+      : element.getClientRects().length > 0;
+  }
+
+  function blockOf(element, blocks) {
+    let block = blocks.get(element);
+    if (block === undefined) {
+      block = element.parentElement && element !== document.body
+        && getComputedStyle(element).display.startsWith("inline")
+        ? blockOf(element.parentElement, blocks)
+        : element;
+      blocks.set(element, block);
+    }
+    return block;
+  }
+
+  function buildIndex() {
+    const walker = document.createTreeWalker(
+      document.body || document.documentElement, NodeFilter.SHOW_TEXT,
+    );
+    const nodes = [], starts = [], parts = [];
+    const blocks = new Map(), visible = new Map();
+    let length = 0, previousBlock = null;
+    for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+      const element = node.parentElement;
+      if (!element || SKIPPED_TAGS.has(element.tagName)) continue;
+      let shown = visible.get(element);
+      if (shown === undefined) {
+        shown = isVisible(element);
+        visible.set(element, shown);
+      }
+      if (!shown) continue;
+      const block = blockOf(element, blocks);
+      if (previousBlock !== null && block !== previousBlock) {
+        parts.push("\\n");
+        length += 1;
+      }
+      previousBlock = block;
+      nodes.push(node);
+      starts.push(length);
+      parts.push(node.data);
+      length += node.data.length;
+    }
+    const text = parts.join("");
+    return {nodes, starts, text, lower: text.toLowerCase()};
+  }
+
+  function locate(offset) {
+    let low = 0, high = index.starts.length - 1;
+    while (low < high) {
+      const middle = (low + high + 1) >> 1;
+      if (index.starts[middle] <= offset) low = middle; else high = middle - 1;
+    }
+    const node = index.nodes[low];
+    return [node, Math.min(offset - index.starts[low], node.data.length)];
+  }
+
+  function exactMatches(query, caseSensitive) {
+    const words = query.split(/\\s+/).map(
+      (word) => word.replace(/[.*+?^${}()|[\\]\\\\]/g, "\\\\$&"),
+    );
+    const pattern = new RegExp(words.join("\\\\s+"), caseSensitive ? "g" : "gi");
+    return Array.from(index.text.matchAll(pattern), (match) => ({
+      start: match.index, end: match.index + match[0].length, distance: 0,
+    }));
+  }
+
+  // Approximate substring matching (Sellers), with at most one edit per 4 characters
+  function fuzzyMatches(query, caseSensitive) {
+    const pattern = caseSensitive ? query : query.toLowerCase();
+    const text = caseSensitive ? index.text : index.lower;
+    const m = pattern.length, maxDistance = Math.floor(m / 4);
+    if (maxDistance === 0) return [];
+    let previous = new Int32Array(m + 1), current = new Int32Array(m + 1);
+    let previousStart = new Int32Array(m + 1), currentStart = new Int32Array(m + 1);
+    for (let i = 0; i <= m; i++) previous[i] = i;
+    const matches = [];
+    for (let j = 1; j <= text.length; j++) {
+      const character = text[j - 1];
+      current[0] = 0;
+      currentStart[0] = j;
+      for (let i = 1; i <= m; i++) {
+        let distance = previous[i - 1] + (pattern[i - 1] === character ? 0 : 1);
+        let start = previousStart[i - 1];
+        if (previous[i] + 1 < distance) {
+          distance = previous[i] + 1;
+          start = previousStart[i];
+        }
+        if (current[i - 1] + 1 < distance) {
+          distance = current[i - 1] + 1;
+          start = currentStart[i - 1];
+        }
+        current[i] = distance;
+        currentStart[i] = start;
+      }
+      if (current[m] <= maxDistance) {
+        const match = {start: currentStart[m], end: j, distance: current[m]};
+        const last = matches[matches.length - 1];
+        // Keep the closest of overlapping candidates
+        if (last && match.start < last.end) {
+          if (match.distance < last.distance) matches[matches.length - 1] = match;
+        } else {
+          matches.push(match);
+        }
+      }
+      [previous, current] = [current, previous];
+      [previousStart, currentStart] = [currentStart, previousStart];
+    }
+    return matches;
+  }
+
+  function snippet(match, contextChars) {
+    const clean = (text) => text.replace(/\\s+/g, " ");
+    const text = index.text;
+    const start = Math.max(0, match.start - contextChars);
+    const end = Math.min(text.length, match.end + contextChars);
+    return (start > 0 ? "…" : "")
+      + clean(text.slice(start, match.start)).trimStart()
+      + "«" + clean(text.slice(match.start, match.end)) + "»"
+      + clean(text.slice(match.end, end)).trimEnd()
+      + (end < text.length ? "…" : "");
+  }
+
+  return (options) => {
+    if (index === null) index = buildIndex();
+    const query = options.text.trim();
+    let matches = exactMatches(query, options.caseSensitive);
+    if ((options.fuzzy || matches.length === 0)
+        && query.length <= options.fuzzyMaxQueryLength) {
+      const approximate = fuzzyMatches(query, options.caseSensitive).filter(
+        (candidate) => candidate.distance > 0 && !matches.some(
+          (match) => candidate.start < match.end && match.start < candidate.end,
+        ),
+      );
+      approximate.sort((a, b) => a.distance - b.distance || a.start - b.start);
+      matches = matches.concat(approximate);
+    }
+    const result = {
+      total: matches.length,
+      approximate: matches.filter((match) => match.distance > 0).length,
+      snippets: [],
+    };
+    const focused = matches[options.nth - 1];
+    if (focused === undefined) return result;
+
+    const range = document.createRange();
+    const [endNode, endOffset] = locate(focused.end - 1);
+    range.setStart(...locate(focused.start));
+    range.setEnd(endNode, Math.min(endOffset + 1, endNode.data.length));
+    range.startContainer.parentElement.scrollIntoView({block: "center"});
+    const selection = window.getSelection();
+    selection.removeAllRanges();
+    selection.addRange(range);
+
+    const shown = matches.slice(options.nth - 1, options.nth - 1 + options.maxSnippets);
+    result.snippets = shown.map((match, i) => ({
+      rank: options.nth + i,
+      distance: match.distance,
+      text: snippet(match, options.contextChars),
+    }));
+    return result;
+  };
+})();
+"""
+PAGE_SEARCH_CALL = (
+    "return window.__pageSearch ? window.__pageSearch(arguments[0]) : null;"
+)
+
+
+def search_page(  # noqa: PLR0913
+    driver: "webdriver.Chrome",
+    text: str,
+    *,
+    nth_result: int = 1,
+    case_sensitive: bool = False,
+    fuzzy: bool = False,
+    max_snippets: int = CTRL_F_MAX_SNIPPETS,
+    context_chars: int = CTRL_F_CONTEXT_CHARS,
+) -> dict[str, Any]:
+    """
+    Search the visible text of the page and scroll to the nth match.
+
+    Exact matches come first, in document order. Approximate matches, within one
+    edit per 4 characters of ``text``, follow when ``fuzzy`` is set or when there is
+    no exact match, closest first. Returns the number of matches, the number of
+    approximate ones, and context snippets of the matches from the nth one on.
+
+    The search script is injected on the first search of each page, so a search
+    takes a single round trip to the browser afterwards.
+    """
+    options = {
+        "text": text,
+        "nth": nth_result,
+        "caseSensitive": case_sensitive,
+        "fuzzy": fuzzy,
+        "fuzzyMaxQueryLength": FUZZY_MAX_QUERY_LENGTH,
+        "maxSnippets": max_snippets,
+        "contextChars": context_chars,
+    }
+    result = driver.execute_script(PAGE_SEARCH_CALL, options)
+    if result is None:
+        result = driver.execute_script(PAGE_SEARCH_SCRIPT + PAGE_SEARCH_CALL, options)
+    return result
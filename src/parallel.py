@@ -0,0 +1,373 @@
+"""Concurrent execution of the independent tool calls of a code action."""
+
+import ast
+import inspect
+import os
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+from smolagents import MultiStepAgent
+from smolagents.local_python_executor import PythonExecutor
+
+from src.async_bridge import wait_future
+from src.logger import logger
+
+# Maximum number of tool calls of a step run at once, 1 to run them sequentially
+TOOL_MAX_PARALLELISM = int(os.getenv("TOOL_MAX_PARALLELISM", "4"))
+
+# Tool call: tool name, positional and keyword arguments
+ToolCall = tuple[str, tuple, dict[str, Any]]
+
+
+class NotStaticError(Exception):
+    """Expression whose value is not known before the code runs."""
+
+
+def call_key(name: str, args: tuple, kwargs: dict[str, Any]) -> str:
+    """Return the key identifying a tool call by its tool and arguments."""
+    return repr((name, args, sorted(kwargs.items())))
+
+
+def is_side_effect_free(tool: Any) -> bool:  # noqa: ANN401
+    """
+    Return whether a tool opted in to be called ahead of the code.
+
+    Tools that only read set a ``side_effect_free`` attribute, so that calling them
+    when the code does not get to their call is harmless.
+    """
+    return getattr(inspect.unwrap(tool), "side_effect_free", False)
+
+
+class IndependentCallFinder:
+    """
+    Find the tool calls of a code action that can run before the code.
+
+    Only calls whose arguments are known beforehand are found: literals, f-strings,
+    loop variables or variables defined by previous steps and not assigned by the
+    code. The calls of top-level statements and of loops over literal sequences,
+    outside of conditions, are found for tools flagged as ``side_effect_free``. A
+    managed agent call is found only when it is a statement of its own, and no
+    statement before it but other agent calls may raise: each one runs a whole
+    agent. Calls are returned in program order.
+    """
+
+    def __init__(
+        self,
+        tool_names: set[str],
+        agent_names: set[str],
+        state: dict[str, Any],
+    ) -> None:
+        """Look for calls to ``tool_names`` and ``agent_names``, with ``state``."""
+        self.tool_names = set(tool_names)
+        self.agent_names = set(agent_names)
+        self.state = state
+
+    def find(self, code: str) -> list[ToolCall]:
+        """Return the independent tool calls of ``code``."""
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return []
+        self.assigned = {
+            node.id
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)
+        } | {
+            node.name
+            for node in ast.walk(tree)
+            if isinstance(node, ast.FunctionDef | ast.ClassDef)
+        }
+        self.tool_names -= self.assigned
+        self.agent_names -= self.assigned
+        # Whether a statement run so far may raise, and stop the code
+        self.may_raise = False
+        return list(self._statements(tree.body, {}))
+
+    def _statements(
+        self,
+        statements: list[ast.stmt],
+        bindings: dict[str, Any],
+    ) -> Iterator[ToolCall]:
+        for statement in statements:
+            agent_call = self._agent_call(statement, bindings)
+            if agent_call is not None and not self.may_raise:
+                # Started with the agent calls next to it, whether it raises or not
+                yield agent_call
+                continue
+            if isinstance(statement, ast.Expr | ast.Assign | ast.AnnAssign):
+                if statement.value is not None:
+                    yield from self._calls(statement.value, bindings)
+            elif isinstance(statement, ast.For):
+                yield from self._loop_calls(statement, bindings)
+            if not self._cannot_raise(statement, bindings):
+                self.may_raise = True
+
+    def _loop_calls(
+        self,
+        loop: ast.For,
+        bindings: dict[str, Any],
+    ) -> Iterator[ToolCall]:
+        """Yield the calls of a loop over a literal sequence, without early exits."""
+        if (
+            not isinstance(loop.target, ast.Name)
+            or loop.orelse
+            or any(
+                isinstance(node, ast.Break | ast.Continue | ast.Return)
+                for node in ast.walk(loop)
+            )
+        ):
+            return
+        try:
+            values = self._value(loop.iter, bindings)
+        except NotStaticError:
+            return
+        if isinstance(values, list | tuple):
+            for value in values:
+                yield from self._statements(
+                    loop.body,
+                    {**bindings, loop.target.id: value},
+                )
+
+    def _agent_call(
+        self,
+        statement: ast.stmt,
+        bindings: dict[str, Any],
+    ) -> ToolCall | None:
+        """Return the managed agent call making up a statement, if static."""
+        if isinstance(statement, ast.Assign) and not all(
+            isinstance(target, ast.Name) for target in statement.targets
+        ):
+            return None
+        if not isinstance(statement, ast.Expr | ast.Assign):
+            return None
+        call = statement.value
+        if not (
+            isinstance(call, ast.Call)
+            and isinstance(call.func, ast.Name)
+            and call.func.id in self.agent_names
+        ):
+            return None
+        try:
+            return (
+                call.func.id,
+                tuple(self._value(arg, bindings) for arg in call.args),
+                {
+                    keyword.arg: self._value(keyword.value, bindings)
+                    for keyword in call.keywords
+                },
+            )
+        except NotStaticError:
+            return None
+
+    def _cannot_raise(self, statement: ast.stmt, bindings: dict[str, Any]) -> bool:
+        """Return whether a statement certainly runs without raising."""
+        if isinstance(statement, ast.Pass):
+            return True
+        if isinstance(statement, ast.Expr):
+            return isinstance(statement.value, ast.Constant)
+        if isinstance(statement, ast.Assign | ast.AnnAssign):
+            targets = (
+                statement.targets
+                if isinstance(statement, ast.Assign)
+                else [statement.target]
+            )
+            if statement.value is None or not all(
+                isinstance(target, ast.Name) for target in targets
+            ):
+                return False
+            try:
+                self._value(statement.value, bindings)
+            except NotStaticError:
+                return False
+            return True
+        return False
+
+    def _calls(self, node: ast.AST, bindings: dict[str, Any]) -> Iterator[ToolCall]:
+        """Yield the static tool calls of an expression, except conditional ones."""
+        if isinstance(node, ast.Lambda | ast.IfExp | ast.BoolOp):
+            return
+        if isinstance(node, ast.ListComp | ast.GeneratorExp | ast.SetComp):
+            yield from self._comprehension_calls(node, bindings)
+            return
+        for child in ast.iter_child_nodes(node):
+            yield from self._calls(child, bindings)
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in self.tool_names
+        ):
+            try:
+                yield (
+                    node.func.id,
+                    tuple(self._value(arg, bindings) for arg in node.args),
+                    {
+                        keyword.arg: self._value(keyword.value, bindings)
+                        for keyword in node.keywords
+                    },
+                )
+            except NotStaticError:
+                return
+
+    def _comprehension_calls(
+        self,
+        node: ast.ListComp | ast.GeneratorExp | ast.SetComp,
+        bindings: dict[str, Any],
+    ) -> Iterator[ToolCall]:
+        """Yield the tool calls of a comprehension over a literal sequence."""
+        if len(node.generators) != 1:
+            return
+        generator = node.generators[0]
+        if generator.ifs or not isinstance(generator.target, ast.Name):
+            return
+        try:
+            values = self._value(generator.iter, bindings)
+        except NotStaticError:
+            return
+        if isinstance(values, list | tuple):
+            for value in values:
+                yield from self._calls(
+                    node.elt,
+                    {**bindings, generator.target.id: value},
+                )
+
+    def _value(self, node: ast.AST, bindings: dict[str, Any]) -> Any:  # noqa: ANN401, PLR0911
+        """Return the value of an expression known before the code runs."""
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id in bindings:
+                return bindings[node.id]
+            if node.id in self.state and node.id not in self.assigned:
+                return self.state[node.id]
+        elif isinstance(node, ast.List):
+            return [self._value(element, bindings) for element in node.elts]
+        elif isinstance(node, ast.Tuple):
+            return tuple(self._value(element, bindings) for element in node.elts)
+        elif isinstance(node, ast.Dict) and None not in node.keys:
+            return {
+                self._value(key, bindings): self._value(value, bindings)
+                for key, value in zip(node.keys, node.values, strict=True)
+            }
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -self._value(node.operand, bindings)
+        elif isinstance(node, ast.JoinedStr):
+            return "".join(
+                self._formatted(value, bindings)
+                if isinstance(value, ast.FormattedValue)
+                else self._value(value, bindings)
+                for value in node.values
+            )
+        raise NotStaticError
+
+    def _formatted(self, node: ast.FormattedValue, bindings: dict[str, Any]) -> str:
+        """Return the value of an f-string field."""
+        value = self._value(node.value, bindings)
+        if node.conversion == ord("r"):
+            value = repr(value)
+        elif node.conversion == ord("a"):
+            value = ascii(value)
+        format_spec = (
+            self._value(node.format_spec, bindings) if node.format_spec else ""
+        )
+        try:
+            return format(value, format_spec)
+        except (TypeError, ValueError) as error:
+            raise NotStaticError from error
+
+
+class ParallelExecutor:
+    """
+    Python executor running the independent tool calls of a code action at once.
+
+    Before running a code action, its independent calls, as found by
+    ``IndependentCallFinder``, are started in a thread pool, at most
+    ``max_parallelism`` at a time. The code then runs as usual: a call matching a
+    started one, by tool and arguments, waits for its result instead of calling
+    the tool, so results and errors surface in program order. Other calls run in
+    program order. Only tools flagged as ``side_effect_free`` are called ahead of
+    statements that may fail, their results being discarded if the code does not
+    get to them. Managed agents run concurrently on copies made by
+    ``copy_agent``, as an agent holds the state of its run.
+    """
+
+    def __init__(
+        self,
+        executor: PythonExecutor,
+        copy_agent: Callable[[MultiStepAgent], MultiStepAgent],
+        max_parallelism: int = TOOL_MAX_PARALLELISM,
+    ) -> None:
+        """Wrap ``executor``."""
+        self.executor = executor
+        self.copy_agent = copy_agent
+        self.max_parallelism = max_parallelism
+        self.tools: dict[str, Any] = {}
+        self._started: defaultdict[str, deque[Future]] = defaultdict(deque)
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        """Return the attributes of the executor."""
+        return getattr(self.executor, name)
+
+    def send_tools(self, tools: dict[str, Any]) -> None:
+        """Send the tools to the executor, calls to them served by started calls."""
+        self.tools = tools
+        self.executor.send_tools(
+            {name: self._dispatcher(name, tool) for name, tool in tools.items()},
+        )
+
+    def __call__(self, code_action: str) -> Any:  # noqa: ANN401
+        """Run a code action, its independent tool calls started beforehand."""
+        calls = []
+        if self.max_parallelism > 1:
+            calls = IndependentCallFinder(
+                {
+                    name
+                    for name, tool in self.tools.items()
+                    if is_side_effect_free(tool)
+                },
+                {
+                    name
+                    for name, tool in self.tools.items()
+                    if isinstance(inspect.unwrap(tool), MultiStepAgent)
+                },
+                self.executor.state,
+            ).find(code_action)
+        if len(calls) < 2:  # noqa: PLR2004
+            return self.executor(code_action)
+        logger.info(f"Running {len(calls)} tool calls in parallel.")
+        pool = ThreadPoolExecutor(
+            min(self.max_parallelism, len(calls)),
+            thread_name_prefix="tool-call",
+        )
+        try:
+            for name, args, kwargs in calls:
+                self._started[call_key(name, args, kwargs)].append(
+                    pool.submit(self._callable(name), *args, **kwargs),
+                )
+            return self.executor(code_action)
+        finally:
+            # Calls the code did not get to are not waited for
+            self._started.clear()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _callable(self, name: str) -> Callable:
+        """Return the function running a tool call ahead of the code."""
+        tool = self.tools[name]
+        if isinstance(inspect.unwrap(tool), MultiStepAgent):
+            return lambda *args, **kwargs: self.copy_agent(inspect.unwrap(tool))(
+                *args,
+                **kwargs,
+            )
+        return tool
+
+    def _dispatcher(self, name: str, tool: Any) -> Callable:  # noqa: ANN401
+        """Return the function through which the code calls a tool."""
+
+        def dispatch(*args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+            started = self._started.get(call_key(name, args, kwargs))
+            if started:
+                return wait_future(started.popleft())
+            return tool(*args, **kwargs)
+
+        return dispatch
@@ -0,0 +1,312 @@
+"""Profiling of agent runs: where the time and tokens of each step go."""
+
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Generator, Iterator
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+from smolagents import (
+    ActionStep,
+    Model,
+    MultiStepAgent,
+    PlanningStep,
+    ToolCallingAgent,
+)
+from smolagents.local_python_executor import LocalPythonExecutor, PythonExecutor
+
+from src.async_bridge import AsyncToolsExecutor
+from src.parallel import ParallelExecutor
+from src.sandbox import PooledExecutor
+
+# Categories of the frames recorded by the profiler
+MODEL = "model"
+CODE = "code"
+TOOL = "tool"
+CALLBACK = "callback"
+OTHER = "other"
+CATEGORIES = (MODEL, CODE, TOOL, CALLBACK, OTHER)
+
+# Stack of frames, each one a name and the seconds spent in its children
+Stack = list[list[Any]]
+
+
+@dataclasses.dataclass
+class StepProfile:
+    """Time and tokens of an agent step, the time split by call stack."""
+
+    name: str
+    seconds: float
+    self_seconds: dict[tuple[str, ...], float]
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    def category_seconds(self, category: str) -> float:
+        """Return the time spent in the frames of a category, children excluded."""
+        return sum(
+            seconds
+            for stack, seconds in self.self_seconds.items()
+            if stack[-1].split(" ", 1)[0] == category
+        )
+
+
+class ProfiledModel:
+    """Model whose generation calls are timed, the time of streams included."""
+
+    def __init__(self, profiler: "AgentProfiler", model: Model) -> None:
+        """Wrap ``model``."""
+        self.profiler = profiler
+        self.model = model
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        """Return the attributes of the model, its generation methods timed."""
+        attribute = getattr(self.model, name)
+        if name == "generate":
+            return self.profiler.timed(MODEL)(attribute)
+        if name == "generate_stream":
+            return functools.wraps(attribute)(
+                lambda *args, **kwargs: self.profiler.timed_iterator(
+                    MODEL,
+                    attribute(*args, **kwargs),
+                ),
+            )
+        return attribute
+
+    def __call__(self, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+        """Generate a response, as ``Model.__call__``."""
+        return self.generate(*args, **kwargs)
+
+
+class ProfiledExecutor:
+    """Python executor whose code runs and tool calls are timed."""
+
+    def __init__(self, profiler: "AgentProfiler", executor: PythonExecutor) -> None:
+        """Wrap ``executor``."""
+        self.profiler = profiler
+        self.executor = executor
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        """Return the attributes of the executor."""
+        return getattr(self.executor, name)
+
+    def __call__(self, code_action: str) -> Any:  # noqa: ANN401
+        """Run code, timed."""
+        with self.profiler.frame(CODE):
+            return self.executor(code_action)
+
+    def send_tools(self, tools: dict[str, Any]) -> None:
+        """Send the tools and managed agents to the executor, each one timed."""
+        self.executor.send_tools(
+            {
+                name: self.profiler.timed(f"{TOOL} {name}")(tool)
+                for name, tool in tools.items()
+            },
+        )
+
+
+class AgentProfiler:
+    """
+    Profile the steps of an agent run, as a context manager around the run.
+
+    While the profiler is active, the model calls, code executions, tool and
+    managed agent calls and step callbacks of the agent are timed, and a step
+    callback attributes these timings to each ``ActionStep`` and ``PlanningStep``
+    with its token usage. The time of a step spent elsewhere, in the agent itself
+    or in the consumer of a streamed run, is reported as ``other``. Managed agents
+    are timed as a whole, like tools.
+    """
+
+    def __init__(self, agent: MultiStepAgent) -> None:
+        """Prepare the profiling of ``agent``."""
+        self.agent = agent
+        self.steps: list[StepProfile] = []
+        self._pending: defaultdict[tuple[str, ...], float] = defaultdict(float)
+        self._lock = threading.Lock()
+        # Call stacks are per thread, and per greenlet of asynchronous runs
+        self._stacks: contextvars.ContextVar[Stack] = contextvars.ContextVar(
+            "profiler_stack",
+        )
+        self._restore: list[Callable[[], None]] = []
+
+    def __enter__(self) -> "AgentProfiler":
+        """Instrument the agent."""
+        agent = self.agent
+        model = agent.model
+        agent.model = ProfiledModel(self, model)
+        self._restore.append(lambda: setattr(agent, "model", model))
+        holder, attribute = agent, "python_executor"
+        executor = getattr(agent, attribute, None)
+        # Tool calls started ahead, or run in threads, are timed where the code
+        # waits for them
+        while isinstance(executor, AsyncToolsExecutor | ParallelExecutor):
+            holder, attribute, executor = executor, "executor", executor.executor
+        if isinstance(executor, LocalPythonExecutor | PooledExecutor):
+            setattr(holder, attribute, ProfiledExecutor(self, executor))
+            self._restore.append(lambda: setattr(holder, attribute, executor))
+        if isinstance(agent, ToolCallingAgent):
+            agent.execute_tool_call = self._timed_tool_call(agent.execute_tool_call)
+            self._restore.append(lambda: vars(agent).pop("execute_tool_call"))
+        callbacks = agent.step_callbacks._callbacks  # noqa: SLF001
+        original_callbacks = {
+            step_cls: list(step_callbacks)
+            for step_cls, step_callbacks in callbacks.items()
+        }
+        for step_callbacks in callbacks.values():
+            step_callbacks[:] = [
+                self.timed(f"{CALLBACK} {getattr(callback, '__name__', 'callback')}")(
+                    callback,
+                )
+                for callback in step_callbacks
+            ]
+        agent.step_callbacks.register(ActionStep, self.on_step)
+        agent.step_callbacks.register(PlanningStep, self.on_step)
+        self._restore.append(
+            lambda: setattr(agent.step_callbacks, "_callbacks", original_callbacks),
+        )
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Remove the instrumentation of the agent."""
+        while self._restore:
+            self._restore.pop()()
+
+    def on_step(self, step: ActionStep | PlanningStep, agent: MultiStepAgent) -> None:
+        """Attribute the timings recorded since the previous step to ``step``."""
+        with self._lock:
+            self_seconds, self._pending = self._pending, defaultdict(float)
+        if isinstance(step, PlanningStep):
+            name = f"planning {agent.step_number}"
+        else:
+            name = f"step {step.step_number}"
+        # Step callbacks run after the end of the step
+        seconds = (step.timing.duration or 0.0) + sum(
+            step_seconds
+            for stack, step_seconds in self_seconds.items()
+            if stack[0].startswith(CALLBACK)
+        )
+        self_seconds[(OTHER,)] += max(seconds - sum(self_seconds.values()), 0.0)
+        self.steps.append(
+            StepProfile(
+                name,
+                seconds,
+                dict(self_seconds),
+                step.token_usage.input_tokens if step.token_usage else 0,
+                step.token_usage.output_tokens if step.token_usage else 0,
+            ),
+        )
+
+    @contextlib.contextmanager
+    def frame(self, name: str) -> Iterator[None]:
+        """Time a block, as a frame of the call stack of its thread or greenlet."""
+        stack = self._stack()
+        frame = [name, 0.0]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            path = tuple(frame_name for frame_name, _ in stack)
+            stack.pop()
+            if stack:
+                stack[-1][1] += seconds
+            with self._lock:
+                self._pending[path] += seconds - frame[1]
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """Return a decorator timing the calls of a function as ``name`` frames."""
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+                with self.frame(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def timed_iterator(self, name: str, iterator: Iterator) -> Generator:
+        """Yield the items of an iterator, timing their production only."""
+        iterator = iter(iterator)
+        while True:
+            with self.frame(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self) -> str:
+        """Return a table of the time and tokens of each step, and their total."""
+        header = (
+            f"{'step':<12}{'seconds':>9}{'share':>7}"
+            + "".join(f"{category:>9}" for category in CATEGORIES)
+            + f"{'in tokens':>11}{'out tokens':>11}"
+        )
+        total_seconds = sum(step.seconds for step in self.steps)
+        total = StepProfile(
+            "total",
+            total_seconds,
+            {},
+            sum(step.input_tokens for step in self.steps),
+            sum(step.output_tokens for step in self.steps),
+        )
+        for step in self.steps:
+            for stack, seconds in step.self_seconds.items():
+                total.self_seconds[stack] = total.self_seconds.get(stack, 0) + seconds
+        rows = [
+            f"{step.name:<12}{step.seconds:>9.2f}"
+            f"{step.seconds / max(total_seconds, 1e-9):>7.0%}"
+            + "".join(
+                f"{step.category_seconds(category):>9.2f}" for category in CATEGORIES
+            )
+            + f"{step.input_tokens:>11}{step.output_tokens:>11}"
+            for step in [*self.steps, total]
+        ]
+        return "\n".join([header, *rows])
+
+    def export_folded(self, path: str | Path) -> None:
+        """
+        Write the profile in the folded stacks format of flame graphs.
+
+        Each line is a call stack and the microseconds spent in its last frame,
+        as read by ``flamegraph.pl``, speedscope or ``inferno``.
+        """
+        root = getattr(self.agent, "name", None) or "agent"
+        lines = [
+            ";".join((root, step.name, *stack)) + f" {round(seconds * 1e6)}"
+            for step in self.steps
+            for stack, seconds in step.self_seconds.items()
+            if seconds > 0
+        ]
+        Path(path).write_text("\n".join(lines) + "\n")
+
+    def _stack(self) -> Stack:
+        """Return the call stack of the current thread or greenlet."""
+        stack = self._stacks.get(None)
+        if stack is None:
+            stack = []
+            self._stacks.set(stack)
+        return stack
+
+    def _timed_tool_call(self, execute_tool_call: Callable) -> Callable:
+        """Time the tool calls of a tool-calling agent, by tool name."""
+
+        @functools.wraps(execute_tool_call)
+        def wrapper(tool_name: str, arguments: Any) -> Any:  # noqa: ANN401
+            with self.frame(f"{TOOL} {tool_name}"):
+                return execute_tool_call(tool_name, arguments)
+
+        return wrapper
@@ -0,0 +1,96 @@
+"""
+Registries of the tools, step callbacks and agents, imported on first use.
+
+Entries are ``module:attribute`` paths, so that heavy dependencies like
+langchain, helium and selenium or the MCP SDK are only imported once a tool or
+an agent needing them is built, rather than when the app starts.
+"""
+
+import functools
+import importlib
+import threading
+from typing import Any
+
+from smolagents import Tool
+
+
+class LazyRegistry:
+    """Objects registered by name as ``module:attribute`` paths, imported lazily."""
+
+    def __init__(self, kind: str, paths: dict[str, str]) -> None:
+        """Register the paths of the objects of a kind, like tools."""
+        self.kind = kind
+        self.paths = dict(paths)
+        self._loaded: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        """Return whether an object is registered under ``name``."""
+        return name in self.paths
+
+    def register(self, name: str, path: str) -> None:
+        """Register the ``module:attribute`` path of an object."""
+        self.paths[name] = path
+        self._loaded.pop(name, None)
+
+    def get(self, name: str) -> Any:  # noqa: ANN401
+        """Return the registered object, importing its module if needed."""
+        if name not in self.paths:
+            msg = f"Unknown {self.kind} {name!r}, registered ones: {sorted(self.paths)}"
+            raise KeyError(msg)
+        with self._lock:
+            if name not in self._loaded:
+                module_name, _, attribute = self.paths[name].partition(":")
+                self._loaded[name] = functools.reduce(
+                    getattr,
+                    attribute.split("."),
+                    importlib.import_module(module_name),
+                )
+            return self._loaded[name]
+
+    def create(self, name: str, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+        """Return the registered tool instance, or call the registered factory."""
+        registered = self.get(name)
+        if isinstance(registered, Tool):
+            return registered
+        return registered(*args, **kwargs)
+
+
+tools = LazyRegistry(
+    "tool",
+    {
+        "web_search": "src.web:CachedGoogleSearchTool",
+        "visit_webpage": "src.web:CachedVisitWebpageTool",
+        "duckduckgo_search": "smolagents:DuckDuckGoSearchTool",
+        "calculate_cargo_travel_time": "src.tools:calculate_cargo_travel_time",
+        "calculate_cargo_travel_times": "src.tools:calculate_cargo_travel_times",
+        "nearest_locations": "src.tools:NearestLocationsTool",
+        "read_output": "src.tools:read_output",
+        "go_back": "src.browser_tools:go_back",
+        "close_popups": "src.browser_tools:close_popups",
+        "search_item_ctrl_f": "src.browser_tools:search_item_ctrl_f",
+        "pubmed": "src.mcp:pubmed_pool.get_tools",
+        "list_occasions": "src.tools:list_occasions",
+        "suggest_menu": "src.tools:suggest_menu",
+        "catering_service": "src.tools:catering_service_tool",
+        "superhero_party_theme": "src.tools:SuperheroPartyThemeTool",
+        "party_planning_retriever": "src.tools:PartyPlanningRetrieverTool",
+        "serpapi": "src.tools:get_langchain_serpapi_tool",
+        "image_generation": "src.tools:get_image_generation_tool",
+    },
+)
+step_callbacks = LazyRegistry(
+    "step callback",
+    {
+        "save_screenshot": "src.browser_tools:save_screenshot",
+        "compact_memory": "src.compaction:compact_memory",
+    },
+)
+agents = LazyRegistry(
+    "agent",
+    {
+        "manager": "src.agents:get_manager_agent",
+        "web": "src.agents:get_web_agent",
+        "browser": "src.agents:get_browser_agent",
+    },
+)
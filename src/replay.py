@@ -0,0 +1,417 @@
+"""
+Record the model responses and tool calls of agent runs, and replay them offline.
+
+Run ``python -m src.replay tasks.jsonl fixture.json`` to run the manager agent live
+on the tasks of a JSONL file, as ``src.batch`` reads them, and record them into a
+fixture. A replayed run executes the agents, their code, step callbacks and
+memory handling as a live one, but the model and the tools answer from the
+fixture, after an injected latency.
+"""
+
+import argparse
+import dataclasses
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Generator
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from smolagents import ChatMessage, ChatMessageStreamDelta, Model, MultiStepAgent, Tool
+from smolagents.models import agglomerate_stream_deltas
+from smolagents.monitoring import TokenUsage
+
+from src.llm_cache import (
+    LLM_CACHE_PATH,
+    delta_from_dict,
+    delta_to_dict,
+    message_to_dict,
+    request_key,
+)
+from src.logger import logger
+from src.registry import agents, tools
+
+FIXTURE_VERSION = 1
+MODEL = "model"
+TOOL = "tool"
+
+# Requests are matched whatever the model answering them, live or replayed
+ANY_MODEL = SimpleNamespace(model_id=None, kwargs={})
+
+
+class ReplayMissError(KeyError):
+    """Request or tool call absent from the fixture being replayed."""
+
+
+def tool_call_key(tool_name: str, args: tuple, kwargs: dict[str, Any]) -> str:
+    """Return the hash of a tool call."""
+    call = {"tool": tool_name, "args": args, "kwargs": kwargs}
+    serialized = json.dumps(call, sort_keys=True, default=repr)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def tool_schema(tool: Tool) -> dict[str, Any]:
+    """Return what an agent sees of a tool: its name, description and inputs."""
+    return {
+        "name": tool.name,
+        "description": tool.description,
+        "inputs": tool.inputs,
+        "output_type": tool.output_type,
+    }
+
+
+@dataclasses.dataclass(frozen=True)
+class Latency:
+    """Delay injected before each replayed response, in seconds."""
+
+    # Share of the latency recorded with the response
+    scale: float = 0.0
+    model_seconds: float = 0.0
+    tool_seconds: float = 0.0
+
+    def wait(self, kind: str, recorded_seconds: float) -> None:
+        """Sleep before replaying a response of a kind, model or tool."""
+        seconds = recorded_seconds * self.scale + (
+            self.model_seconds if kind == MODEL else self.tool_seconds
+        )
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class Fixture:
+    """
+    Model responses and tool calls recorded from agent runs, in a JSON file.
+
+    Responses are keyed by the hash of their request or tool call. A request made
+    several times gets its responses in the order they were recorded, the last one
+    being repeated, and ``rewind`` starts the responses over for another replay.
+    The schemas of the MCP tools are kept, so that replays need no MCP server.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        """Load the fixture at ``path``, or start an empty one if it does not exist."""
+        self.path = Path(path)
+        data = json.loads(self.path.read_text()) if self.path.exists() else {}
+        if data and data["version"] != FIXTURE_VERSION:
+            msg = f"Fixture {self.path} has version {data['version']}."
+            raise ValueError(msg)
+        self.tasks: list[str] = data.get("tasks", [])
+        self.model: dict[str, Any] = data.get("model", {})
+        self.mcp_tools: list[dict[str, Any]] = data.get("mcp_tools", [])
+        self.responses: dict[str, dict[str, list[dict[str, Any]]]] = {
+            kind: defaultdict(list, data.get("responses", {}).get(kind, {}))
+            for kind in (MODEL, TOOL)
+        }
+        self._cursors: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, key: str, response: dict[str, Any]) -> None:
+        """Record the response to a request of a kind, model or tool."""
+        with self._lock:
+            self.responses[kind][key].append(response)
+
+    def play(self, kind: str, key: str) -> dict[str, Any]:
+        """Return the next recorded response to a request of a kind."""
+        with self._lock:
+            responses = self.responses[kind].get(key)
+            if not responses:
+                msg = f"No recorded {kind} response to {key} in {self.path}"
+                raise ReplayMissError(msg)
+            cursor = self._cursors[kind, key]
+            self._cursors[kind, key] = cursor + 1
+            return responses[min(cursor, len(responses) - 1)]
+
+    def rewind(self) -> None:
+        """Replay the responses from the first one again."""
+        with self._lock:
+            self._cursors.clear()
+
+    def save(self) -> None:
+        """Write the fixture."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": FIXTURE_VERSION,
+            "tasks": self.tasks,
+            "model": self.model,
+            "mcp_tools": self.mcp_tools,
+            "responses": self.responses,
+        }
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data, indent=1, sort_keys=True))
+        tmp_path.replace(self.path)
+
+
+def message_from_dict(data: dict[str, Any]) -> ChatMessage:
+    """Rebuild a recorded response message, with its token usage."""
+    message = ChatMessage.from_dict(dict(data))
+    message.token_usage = (
+        TokenUsage(**data["token_usage"]) if data["token_usage"] else None
+    )
+    return message
+
+
+def recorded_delta(data: dict[str, Any]) -> ChatMessageStreamDelta:
+    """Rebuild a recorded stream delta, with its token usage."""
+    delta = delta_from_dict(data)
+    if data["token_usage"]:
+        delta.token_usage = TokenUsage(**data["token_usage"])
+    return delta
+
+
+class RecordingModel(Model):
+    """Model recording the responses of the model it wraps into a fixture."""
+
+    def __init__(self, model: Model, fixture: Fixture) -> None:
+        """Wrap ``model``, recording into ``fixture``."""
+        super().__init__(
+            flatten_messages_as_text=model.flatten_messages_as_text,
+            tool_name_key=model.tool_name_key,
+            tool_arguments_key=model.tool_arguments_key,
+            model_id=model.model_id,
+            **model.kwargs,
+        )
+        self.model = model
+        self.fixture = fixture
+        fixture.model = {
+            "model_id": model.model_id,
+            "flatten_messages_as_text": model.flatten_messages_as_text,
+            "tool_name_key": model.tool_name_key,
+            "tool_arguments_key": model.tool_arguments_key,
+        }
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        """Expose the attributes of the wrapped model, like its client."""
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        **kwargs,  # noqa: ANN003
+    ) -> ChatMessage:
+        """Generate the response to the request, and record it."""
+        start = time.perf_counter()
+        message = self.model.generate(messages, **kwargs)
+        self.fixture.record(
+            MODEL,
+            request_key(ANY_MODEL, messages, **kwargs),
+            {
+                "message": message_to_dict(message),
+                "seconds": time.perf_counter() - start,
+            },
+        )
+        return message
+
+    def generate_stream(
+        self,
+        messages: list[ChatMessage],
+        **kwargs,  # noqa: ANN003
+    ) -> Generator[ChatMessageStreamDelta]:
+        """Stream the response to the request, and record it once complete."""
+        start = time.perf_counter()
+        deltas = []
+        for delta in self.model.generate_stream(messages, **kwargs):
+            deltas.append(delta_to_dict(delta))
+            yield delta
+        self.fixture.record(
+            MODEL,
+            request_key(ANY_MODEL, messages, **kwargs),
+            {"deltas": deltas, "seconds": time.perf_counter() - start},
+        )
+
+
+class ReplayModel(Model):
+    """Model answering from the responses recorded in a fixture."""
+
+    def __init__(self, fixture: Fixture, latency: Latency) -> None:
+        """Answer from ``fixture``, after ``latency``."""
+        super().__init__(**fixture.model)
+        self.fixture = fixture
+        self.latency = latency
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        **kwargs,  # noqa: ANN003
+    ) -> ChatMessage:
+        """Return the recorded response to the request."""
+        response = self.fixture.play(MODEL, request_key(ANY_MODEL, messages, **kwargs))
+        self.latency.wait(MODEL, response["seconds"])
+        if "deltas" in response:
+            return agglomerate_stream_deltas(
+                [recorded_delta(delta) for delta in response["deltas"]],
+            )
+        return message_from_dict(response["message"])
+
+    def generate_stream(
+        self,
+        messages: list[ChatMessage],
+        **kwargs,  # noqa: ANN003
+    ) -> Generator[ChatMessageStreamDelta]:
+        """Replay the recorded response to the request, as a stream."""
+        response = self.fixture.play(MODEL, request_key(ANY_MODEL, messages, **kwargs))
+        self.latency.wait(MODEL, response["seconds"])
+        if "deltas" in response:
+            for delta in response["deltas"]:
+                yield recorded_delta(delta)
+        else:
+            message = response["message"]
+            yield recorded_delta(
+                {
+                    "content": message["content"],
+                    "tool_calls": [
+                        {**tool_call, "index": index}
+                        for index, tool_call in enumerate(message["tool_calls"] or [])
+                    ]
+                    or None,
+                    "token_usage": message["token_usage"],
+                },
+            )
+
+
+class FixtureTool(Tool):
+    """Tool exposing the schema of another tool, its calls recorded or replayed."""
+
+    skip_forward_signature_validation = True
+
+    def __init__(self, schema: dict[str, Any], fixture: Fixture) -> None:
+        """Copy the schema of a tool."""
+        self.name = schema["name"]
+        self.description = schema["description"]
+        self.inputs = schema["inputs"]
+        self.output_type = schema["output_type"]
+        self.fixture = fixture
+        super().__init__()
+
+
+class RecordingTool(FixtureTool):
+    """Tool recording the outputs and errors of the tool it wraps into a fixture."""
+
+    def __init__(self, tool: Tool, fixture: Fixture) -> None:
+        """Wrap ``tool``, recording into ``fixture``."""
+        super().__init__(tool_schema(tool), fixture)
+        self.tool = tool
+        # The MCP tools await their calls in asynchronous runs
+        self.async_aware = getattr(tool, "async_aware", False)
+        self.side_effect_free = getattr(tool, "side_effect_free", False)
+
+    def forward(self, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+        """Call the tool, and record its output or error."""
+        key = tool_call_key(self.name, args, kwargs)
+        start = time.perf_counter()
+        try:
+            output = self.tool(*args, **kwargs)
+        except Exception as error:
+            self.fixture.record(
+                TOOL,
+                key,
+                {
+                    "error": str(error),
+                    "error_type": type(error).__name__,
+                    "seconds": time.perf_counter() - start,
+                },
+            )
+            raise
+        try:
+            recorded_output = json.loads(json.dumps(output))
+        except (TypeError, ValueError):
+            logger.warning(
+                "Output of tool %s is not JSON, its string is recorded.",
+                self.name,
+            )
+            recorded_output = str(output)
+        self.fixture.record(
+            TOOL,
+            key,
+            {"output": recorded_output, "seconds": time.perf_counter() - start},
+        )
+        return output
+
+
+class ReplayTool(FixtureTool):
+    """Tool answering from the outputs and errors recorded in a fixture."""
+
+    def __init__(self, tool: Tool, fixture: Fixture, latency: Latency) -> None:
+        """Stand in for ``tool``, answering from ``fixture`` after ``latency``."""
+        super().__init__(tool_schema(tool), fixture)
+        self.latency = latency
+        # Called ahead of the code as the recorded tool was
+        self.side_effect_free = getattr(tool, "side_effect_free", False)
+
+    def forward(self, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+        """Return the recorded output of the call, or raise its recorded error."""
+        response = self.fixture.play(TOOL, tool_call_key(self.name, args, kwargs))
+        self.latency.wait(TOOL, response["seconds"])
+        if "error" in response:
+            # Raised under the recorded name, which the agent sees in its memory
+            error_class = type(response["error_type"], (Exception,), {})
+            raise error_class(response["error"])
+        return response["output"]
+
+
+def wrap_tools(agent: MultiStepAgent, wrap: Callable[[Tool], Tool]) -> None:
+    """Replace the tools of an agent and of its managed agents by wrapped ones."""
+    for name, tool in agent.tools.items():
+        if name != "final_answer":
+            agent.tools[name] = wrap(tool)
+    for managed_agent in agent.managed_agents.values():
+        wrap_tools(managed_agent, wrap)
+
+
+def build_recording_agent(fixture: Fixture) -> MultiStepAgent:
+    """Return the manager agent served by the app, recording into ``fixture``."""
+    from src.models import get_model  # noqa: PLC0415
+
+    model = RecordingModel(get_model(os.getenv("AGENT_MODEL", "mistral")), fixture)
+    mcp_tools = tools.create("pubmed")
+    fixture.mcp_tools = [tool_schema(tool) for tool in mcp_tools]
+    agent = agents.create("manager", model, mcp_tools)
+    wrap_tools(agent, lambda tool: RecordingTool(tool, fixture))
+    return agent
+
+
+def build_replay_agent(fixture: Fixture, latency: Latency) -> MultiStepAgent:
+    """Return the manager agent served by the app, replaying ``fixture``."""
+    # The web search tool is built, but never called, without an API key
+    os.environ.setdefault("SERPER_API_KEY", "replay")
+    mcp_tools = [FixtureTool(schema, fixture) for schema in fixture.mcp_tools]
+    agent = agents.create("manager", ReplayModel(fixture, latency), mcp_tools)
+    wrap_tools(agent, lambda tool: ReplayTool(tool, fixture, latency))
+    return agent
+
+
+def main() -> None:
+    """Record the runs of the tasks given on the command line."""
+    from src.agents import AgentFactory  # noqa: PLC0415
+    from src.batch import iter_tasks  # noqa: PLC0415
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("tasks", help="JSONL file of tasks")
+    parser.add_argument("fixture", help="JSON fixture to record into")
+    arguments = parser.parse_args()
+
+    if LLM_CACHE_PATH:
+        logger.warning(
+            "Responses answered by the LLM cache are recorded without their latency"
+            " and tokens, set LLM_CACHE_PATH to an empty string to record live ones.",
+        )
+    fixture = Fixture(arguments.fixture)
+    factory = AgentFactory(lambda: build_recording_agent(fixture))
+    for _, task in iter_tasks(arguments.tasks):
+        agent = factory.new_agent()
+        try:
+            agent.run(task)
+            fixture.tasks.append(task)
+            logger.info("Recorded %r into %s", task, fixture.path)
+        finally:
+            agent.cleanup()
+            fixture.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""Routing of model requests over several backends, with hedging and fallback."""
+
+import asyncio
+import dataclasses
+import functools
+import itertools
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Generator, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from smolagents import ChatMessage, ChatMessageStreamDelta, Model
+from smolagents.monitoring import TokenUsage
+
+from src.async_bridge import call_blocking, wait_future
+from src.logger import logger
+
+ROUTER_HEDGE_QUANTILE = float(os.getenv("ROUTER_HEDGE_QUANTILE", "0.95"))
+# Hedging delay used until a backend has answered MIN_LATENCY_SAMPLES requests
+ROUTER_HEDGE_DELAY = float(os.getenv("ROUTER_HEDGE_DELAY", "30"))
+# Hedged requests are at most this share of the requests, to bound the extra load
+ROUTER_HEDGE_BUDGET = float(os.getenv("ROUTER_HEDGE_BUDGET", "0.1"))
+RATE_LIMIT_COOLDOWN = float(os.getenv("RATE_LIMIT_COOLDOWN", "30"))
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 200
+HTTP_TOO_MANY_REQUESTS = 429
+
+Result = TypeVar("Result")
+
+
+def estimate_tokens(messages: list[ChatMessage]) -> int:
+    """Estimate the number of input tokens of messages, at 4 characters a token."""
+    return sum(len(str(message.content)) for message in messages) // 4
+
+
+def is_rate_limit(error: Exception) -> bool:
+    """Return whether an error is a rate limit of the provider."""
+    status_code = getattr(error, "status_code", None) or getattr(
+        getattr(error, "response", None),
+        "status_code",
+        None,
+    )
+    return status_code == HTTP_TOO_MANY_REQUESTS or "RateLimit" in type(error).__name__
+
+
+class TokenBucket:
+    """Token-rate limit, acquired before a request and settled after it."""
+
+    def __init__(self, tokens_per_minute: int) -> None:
+        """Start with a full minute of tokens."""
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.level = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait until ``tokens`` are available, in the order of the requests."""
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.level < tokens:
+                await asyncio.sleep((tokens - self.level) / self.rate)
+                self._refill()
+            self.level -= tokens
+
+    def settle(self, tokens: int) -> None:
+        """Take the tokens used beyond the estimate, or give back the unused ones."""
+        self._refill()
+        self.level -= tokens
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+@dataclasses.dataclass
+class BackendStats:
+    """Counters of a backend."""
+
+    requests: int = 0
+    errors: int = 0
+    rate_limits: int = 0
+    wins: int = 0
+
+
+class Backend:
+    """
+    Model served by one provider, with its concurrency and token-rate limits.
+
+    The semaphore and token bucket are used on the event loop of the router. The
+    latencies of the last requests give the delay after which a request still
+    running is hedged.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: Model,
+        max_concurrency: int = 4,
+        tokens_per_minute: int | None = None,
+    ) -> None:
+        """Configure the limits of a provider."""
+        self.name = name
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.stats = BackendStats()
+        self.cooldown_until = 0.0
+        self._latencies = {
+            kind: deque(maxlen=LATENCY_WINDOW) for kind in ("generate", "stream")
+        }
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait for a concurrency slot and for the tokens of a request."""
+        await self.semaphore.acquire()
+        try:
+            if self.token_bucket:
+                await self.token_bucket.acquire(tokens)
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self, estimated_tokens: int, usage: TokenUsage | None) -> None:
+        """Free the slot of a request, and settle its actual token usage."""
+        self.semaphore.release()
+        if self.token_bucket and usage:
+            self.token_bucket.settle(usage.total_tokens - estimated_tokens)
+
+    def record_latency(self, kind: str, seconds: float) -> None:
+        """Record the latency of a response, or of the first delta of a stream."""
+        self._latencies[kind].append(seconds)
+
+    def record_error(self, error: Exception) -> None:
+        """Count an error, putting the backend aside for a while if rate limited."""
+        self.stats.errors += 1
+        if is_rate_limit(error):
+            self.stats.rate_limits += 1
+            self.cooldown_until = time.monotonic() + RATE_LIMIT_COOLDOWN
+        logger.warning("Model backend %s failed: %r", self.name, error)
+
+    def hedge_delay(self, kind: str) -> float:
+        """Return the delay after which a request to this backend is hedged."""
+        latencies = self._latencies[kind]
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return ROUTER_HEDGE_DELAY
+        return statistics.quantiles(latencies, n=100)[
+            round(ROUTER_HEDGE_QUANTILE * 100) - 1
+        ]
+
+
+@dataclasses.dataclass
+class RouterStats:
+    """Counters of a router."""
+
+    requests: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    fallbacks: int = 0
+    failures: int = 0
+
+
+class HedgedRequest:
+    """
+    Request run on the backends of a router until one succeeds, hedging slow ones.
+
+    ``attempt`` sends the request to a backend. The attempts still running when
+    one succeeds are left to complete, and their results passed to ``discard``.
+    """
+
+    def __init__(
+        self,
+        router: "RoutedModel",
+        kind: str,
+        attempt: Callable[[Backend], Awaitable[Result]],
+        discard: Callable[[tuple[Backend, Result]], None],
+    ) -> None:
+        """Order the backends, those cooling down after a rate limit last."""
+        self.stats = router.stats
+        self.hedge_budget = router.hedge_budget
+        self.kind = kind
+        self.attempt = attempt
+        self.discard = discard
+        now = time.monotonic()
+        self.candidates = sorted(
+            router.backends,
+            key=lambda backend: backend.cooldown_until > now,
+        )
+        self.pending: dict[asyncio.Task, Backend] = {}
+        self.hedged: list[Backend] = []
+        self.errors: list[BaseException] = []
+        self.hedge_at = 0.0
+
+    async def run(self) -> tuple[Backend, Result]:
+        """Return the first backend to succeed and its result."""
+        self.stats.requests += 1
+        while True:
+            if not self.pending:
+                if not self.candidates:
+                    self.stats.failures += 1
+                    msg = f"All model backends failed: {self.errors}"
+                    raise RuntimeError(msg) from self.errors[-1]
+                if self.errors:
+                    self.stats.fallbacks += 1
+                self._launch()
+            timeout = None
+            hedge_budget = self.hedge_budget * self.stats.requests
+            if self.candidates and self.stats.hedges < hedge_budget:
+                timeout = max(self.hedge_at - time.monotonic(), 0)
+            done, _ = await asyncio.wait(
+                self.pending,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                self.stats.hedges += 1
+                self.hedged.append(self.candidates[0])
+                self._launch()
+            elif winner := self._collect(done):
+                return winner
+
+    def _launch(self) -> None:
+        """Send the request to the next candidate backend."""
+        backend = self.candidates.pop(0)
+        backend.stats.requests += 1
+        self.pending[asyncio.ensure_future(self.attempt(backend))] = backend
+        self.hedge_at = time.monotonic() + backend.hedge_delay(self.kind)
+
+    def _collect(self, done: set[asyncio.Task]) -> tuple[Backend, Result] | None:
+        """Return the winner among completed attempts, if any succeeded."""
+        winner = None
+        for task in done:
+            backend = self.pending.pop(task)
+            if task.exception() is not None:
+                backend.record_error(task.exception())
+                self.errors.append(task.exception())
+            elif winner is None:
+                winner = backend, task.result()
+            else:
+                self.discard((backend, task.result()))
+        if winner is not None:
+            winner[0].stats.wins += 1
+            if winner[0] in self.hedged:
+                self.stats.hedge_wins += 1
+            for task, backend in self.pending.items():
+                task.add_done_callback(
+                    lambda task, backend=backend: self._dispose(task, backend),
+                )
+        return winner
+
+    def _dispose(self, task: asyncio.Task, backend: Backend) -> None:
+        """Dispose of the result of an attempt completed after the winner."""
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            backend.record_error(task.exception())
+        else:
+            self.discard((backend, task.result()))
+
+
+class RoutedModel(Model):
+    """
+    Model sending each request to the first available of several backends.
+
+    A request still running after the p95 latency of its backend is hedged: it is
+    sent again to the next backend and the first response wins, within a budget of
+    hedged requests. A request failing, or rate limited, falls back to the next
+    backend, and a rate-limited backend is tried last for a while. Each backend
+    bounds its concurrent requests and token rate with asyncio primitives, on an
+    event loop the router runs in a thread of its own. Streams are hedged on their
+    first delta and do not fall back once started.
+    """
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        hedge_budget: float = ROUTER_HEDGE_BUDGET,
+    ) -> None:
+        """Route requests over ``backends``, in order of preference."""
+        super().__init__(
+            model_id="|".join(str(backend.model.model_id) for backend in backends),
+        )
+        self.backends = backends
+        self.hedge_budget = hedge_budget
+        self.stats = RouterStats()
+        self._loop = asyncio.new_event_loop()
+        # Blocking model calls run in this pool, bounded by the backend semaphores
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(
+                sum(backend.max_concurrency for backend in backends),
+                thread_name_prefix="model-router",
+            ),
+        )
+        threading.Thread(
+            target=self._loop.run_forever,
+            name="model-router-loop",
+            daemon=True,
+        ).start()
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list[Any] | None = None,
+        **kwargs,  # noqa: ANN003
+    ) -> ChatMessage:
+        """Return the first response of the backends to the request."""
+        return wait_future(
+            asyncio.run_coroutine_threadsafe(
+                self.agenerate(
+                    messages,
+                    stop_sequences=stop_sequences,
+                    response_format=response_format,
+                    tools_to_call_from=tools_to_call_from,
+                    **kwargs,
+                ),
+                self._loop,
+            ),
+        )
+
+    async def agenerate(
+        self,
+        messages: list[ChatMessage],
+        **kwargs,  # noqa: ANN003
+    ) -> ChatMessage:
+        """Return the first response of the backends, from any event loop."""
+        if asyncio.get_running_loop() is not self._loop:
+            return await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(
+                    self.agenerate(messages, **kwargs),
+                    self._loop,
+                ),
+            )
+        estimated_tokens = estimate_tokens(messages)
+
+        async def attempt(backend: Backend) -> ChatMessage:
+            await backend.acquire(estimated_tokens)
+            start = time.perf_counter()
+            message = None
+            try:
+                message = await asyncio.to_thread(
+                    backend.model.generate,
+                    messages,
+                    **kwargs,
+                )
+            finally:
+                backend.release(estimated_tokens, message and message.token_usage)
+            backend.record_latency("generate", time.perf_counter() - start)
+            return message
+
+        _, message = await HedgedRequest(
+            self,
+            "generate",
+            attempt,
+            lambda _: None,
+        ).run()
+        return message
+
+    def generate_stream(
+        self,
+        messages: list[ChatMessage],
+        **kwargs,  # noqa: ANN003
+    ) -> Generator[ChatMessageStreamDelta]:
+        """Stream the response of the first backend to start answering."""
+        estimated_tokens = estimate_tokens(messages)
+
+        async def attempt(backend: Backend) -> tuple[Iterator, list]:
+            await backend.acquire(estimated_tokens)
+            start = time.perf_counter()
+            try:
+                stream = backend.model.generate_stream(messages, **kwargs)
+                first_delta = await asyncio.to_thread(next, stream, None)
+            except BaseException:
+                backend.release(estimated_tokens, None)
+                raise
+            backend.record_latency("stream", time.perf_counter() - start)
+            return stream, [first_delta] if first_delta else []
+
+        def discard(result: tuple[Backend, tuple[Iterator, list]]) -> None:
+            backend, (stream, _) = result
+            stream.close()
+            backend.release(estimated_tokens, None)
+
+        backend, (stream, first_deltas) = wait_future(
+            asyncio.run_coroutine_threadsafe(
+                HedgedRequest(self, "stream", attempt, discard).run(),
+                self._loop,
+            ),
+        )
+        usage = None
+        try:
+            # The stream was started in a thread of the router, and is read there
+            # when the run is asynchronous
+            for delta in itertools.chain(
+                first_deltas,
+                iter(functools.partial(call_blocking, next, stream, None), None),
+            ):
+                usage = delta.token_usage or usage
+                yield delta
+        finally:
+            stream.close()
+            self._loop.call_soon_threadsafe(
+                backend.release,
+                estimated_tokens,
+                usage,
+            )
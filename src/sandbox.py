@@ -0,0 +1,412 @@
+"""
+Warm worker processes running the code of the agents.
+
+The code of an agent run is executed by a ``LocalPythonExecutor`` in a worker
+process leased from a pool, so that the heavy modules the agents import are
+already loaded, a runaway snippet cannot stall the server and its CPU time and
+memory can be limited. The tools stay in the server: the code calls them back
+through the pipe of its worker.
+"""
+
+import atexit
+import contextlib
+import gc
+import importlib
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.reduction
+import os
+import queue
+import resource
+import signal
+import threading
+import time
+import weakref
+from typing import Any
+
+from smolagents.local_python_executor import (
+    CodeOutput,
+    InterpreterError,
+    LocalPythonExecutor,
+)
+
+from src.async_bridge import call_blocking
+from src.logger import logger
+
+# Set CODE_WORKERS to 0 to run the code of the agents in the server process
+CODE_WORKERS = int(os.getenv("CODE_WORKERS", "2"))
+CODE_WORKER_MAX_TASKS = int(os.getenv("CODE_WORKER_MAX_TASKS", "20"))
+CODE_CPU_SECONDS = int(os.getenv("CODE_CPU_SECONDS", "60"))
+CODE_MEMORY_MB = int(os.getenv("CODE_MEMORY_MB", "4096"))
+CODE_TIMEOUT = float(os.getenv("CODE_TIMEOUT", "300"))
+CODE_WORKER_PRELOAD = os.getenv(
+    "CODE_WORKER_PRELOAD",
+    "numpy,pandas,shapely,geopandas,plotly.express,plotly.graph_objects,"
+    "matplotlib.pyplot",
+).split(",")
+# Run by each worker before it is leased: the first figure loads plotly's validators
+CODE_WORKER_WARMUP = """
+import plotly.express as px
+px.scatter_geo(lat=[0.0], lon=[0.0], hover_name=["port"]).to_dict()
+"""
+
+
+class ToolProxy:
+    """Tool of a worker process, called in the server through the pipe."""
+
+    def __init__(
+        self,
+        connection: multiprocessing.connection.Connection,
+        name: str,
+    ) -> None:
+        """Proxy the tool ``name``."""
+        self.connection = connection
+        self.name = name
+
+    def __call__(self, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003, ANN401
+        """Call the tool in the server and return its result."""
+        self.connection.send(("call", self.name, args, kwargs))
+        kind, value = self.connection.recv()
+        if kind == "error":
+            raise value
+        return value
+
+
+def serve(
+    connection: multiprocessing.connection.Connection,
+    cpu_seconds: int,
+    memory_mb: int,
+) -> None:
+    """Run the code sent by the server, in a worker process, until told to exit."""
+    # Interrupts are handled by the server, which stops its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    installed = []
+    for module in CODE_WORKER_PRELOAD:
+        with contextlib.suppress(ImportError):
+            importlib.import_module(module)
+            installed.append(module)
+    with contextlib.suppress(Exception):
+        LocalPythonExecutor(installed)(CODE_WORKER_WARMUP)
+    with contextlib.suppress(ValueError, OSError):
+        resource.setrlimit(resource.RLIMIT_AS, (memory_mb * 2**20,) * 2)
+    connection.send(("ready",))
+    executor = None
+    while True:
+        try:
+            kind, *payload = connection.recv()
+        except EOFError:
+            return
+        if kind == "reset":
+            executor = LocalPythonExecutor(*payload)
+            gc.collect()
+        elif kind == "variables":
+            executor.send_variables(payload[0])
+        elif kind == "tools":
+            executor.send_tools(
+                {name: ToolProxy(connection, name) for name in payload[0]},
+            )
+        elif kind == "run":
+            # The CPU time limit is cumulative: it is moved before each run
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            with contextlib.suppress(ValueError, OSError):
+                resource.setrlimit(
+                    resource.RLIMIT_CPU,
+                    (
+                        int(usage.ru_utime + usage.ru_stime) + cpu_seconds + 1,
+                        resource.RLIM_INFINITY,
+                    ),
+                )
+            connection.send(run(executor, payload[0]))
+        else:
+            return
+
+
+def run(executor: LocalPythonExecutor, code: str) -> tuple:
+    """Run code, and return the message reporting its output or failure."""
+    try:
+        output = executor(code)
+    except Exception as error:  # noqa: BLE001
+        return ("failed", str(error), str(executor.state.get("_print_outputs", "")))
+    message = ("done", output.output, output.logs, output.is_final_answer)
+    try:
+        multiprocessing.reduction.ForkingPickler.dumps(message)
+    except Exception as error:  # noqa: BLE001
+        return (
+            "failed",
+            f"The output of the code cannot be returned: {error}",
+            output.logs,
+        )
+    return message
+
+
+class CodeWorker:
+    """Worker process of a ``WarmExecutorPool``, with the server end of its pipe."""
+
+    def __init__(
+        self,
+        context: multiprocessing.context.BaseContext,
+        cpu_seconds: int,
+        memory_mb: int,
+    ) -> None:
+        """Start the worker process and wait until it is ready."""
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=serve,
+            args=(child_connection, cpu_seconds, memory_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.connection.recv()
+        self.tasks = 0
+
+    def close(self) -> None:
+        """Stop the worker process."""
+        with contextlib.suppress(OSError):
+            self.connection.send(("exit",))
+        self.connection.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+class WarmExecutorPool:
+    """
+    Pool of worker processes with the modules used by the agents already imported.
+
+    The workers are forked from a fork server which imports the ``preload``
+    modules once, so a new worker is ready in milliseconds. ``size`` workers are
+    kept idle, and more are started when they are all leased. Each run of an agent
+    leases a worker for all its steps and starts from a clean state in it. A
+    worker is stopped after ``max_tasks`` runs, so that the modules changed by the
+    code of a run do not leak indefinitely into the next ones.
+    """
+
+    def __init__(
+        self,
+        size: int = CODE_WORKERS,
+        max_tasks: int = CODE_WORKER_MAX_TASKS,
+        cpu_seconds: int = CODE_CPU_SECONDS,
+        memory_mb: int = CODE_MEMORY_MB,
+        preload: list[str] = CODE_WORKER_PRELOAD,
+    ) -> None:
+        """Create the pool, its workers are only started by ``start``."""
+        self.size = size
+        self.max_tasks = max_tasks
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.preload = preload
+        self._context: multiprocessing.context.BaseContext | None = None
+        self._idle: queue.LifoQueue[CodeWorker] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def warms(self, imports: list[str]) -> bool:
+        """Return whether the pool is enabled and preloads some of ``imports``."""
+        roots = {module.split(".")[0] for module in self.preload}
+        return self.size > 0 and any(
+            module.split(".")[0] in roots for module in imports
+        )
+
+    def start(self) -> None:
+        """Start the fork server and the idle workers, in the background."""
+        with self._lock:
+            if self._context is None:
+                self._context = multiprocessing.get_context("forkserver")
+                self._context.set_forkserver_preload([__name__, *self.preload])
+        threading.Thread(
+            target=self._fill,
+            name="code-worker-pool",
+            daemon=True,
+        ).start()
+
+    def lease(self) -> CodeWorker:
+        """Return an idle worker, or a new one if none is idle."""
+        self.start()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._new_worker()
+
+    def release(self, worker: CodeWorker) -> None:
+        """Take a worker back after a run, stopping it if it has run enough."""
+        worker.tasks += 1
+        if self._closed or self._idle.qsize() >= self.size:
+            worker.close()
+        elif worker.tasks >= self.max_tasks:
+            worker.close()
+            self.start()
+        else:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        """Stop the idle workers, and those given back from now on."""
+        self._closed = True
+        while not self._idle.empty():
+            with contextlib.suppress(Exception):
+                self._idle.get_nowait().close()
+
+    def _new_worker(self) -> CodeWorker:
+        return CodeWorker(self._context, self.cpu_seconds, self.memory_mb)
+
+    def _fill(self) -> None:
+        """Start workers until ``size`` of them are idle."""
+        try:
+            while not self._closed and self._idle.qsize() < self.size:
+                self._idle.put(self._new_worker())
+        except Exception:  # noqa: BLE001
+            # Such as a RuntimeError raised while the workers bootstrap
+            if not self._closed:
+                logger.exception("Could not start a code worker")
+
+
+code_worker_pool = WarmExecutorPool()
+atexit.register(code_worker_pool.close)
+
+
+class PooledExecutor:
+    """
+    Python executor running the code of an agent run in a worker of the pool.
+
+    A worker is leased on the first code execution and released by ``cleanup``,
+    or when the executor is garbage collected. The code of each step may use
+    ``CODE_CPU_SECONDS`` of CPU time and, not counting the tool calls,
+    ``CODE_TIMEOUT`` seconds, and its worker ``CODE_MEMORY_MB`` of memory: past
+    that, the worker is stopped and a new one runs the next steps, without the
+    variables of the previous ones.
+    """
+
+    def __init__(
+        self,
+        additional_authorized_imports: list[str],
+        max_print_outputs_length: int | None = None,
+        pool: WarmExecutorPool = code_worker_pool,
+    ) -> None:
+        """Prepare the executor, no worker is leased until code is run."""
+        self.additional_authorized_imports = additional_authorized_imports
+        self.max_print_outputs_length = max_print_outputs_length
+        self.pool = pool
+        self.state: dict[str, Any] = {}
+        self.variables: dict[str, Any] = {}
+        self.tools: dict[str, Any] = {}
+        self._worker: CodeWorker | None = None
+        self._release: weakref.finalize | None = None
+
+    def send_variables(self, variables: dict[str, Any]) -> None:
+        """Send variables to the code."""
+        self.variables.update(variables)
+        self.state.update(variables)
+        if self._worker is not None:
+            self._worker.connection.send(("variables", variables))
+
+    def send_tools(self, tools: dict[str, Any]) -> None:
+        """Send the tools and managed agents that the code may call."""
+        self.tools = dict(tools)
+        if self._worker is not None:
+            self._worker.connection.send(("tools", list(self.tools)))
+
+    def __call__(self, code_action: str) -> CodeOutput:
+        """Run code in the worker of the run, answering its tool calls."""
+        worker = self._worker or self._lease()
+        try:
+            worker.connection.send(("run", code_action))
+            return self._wait(worker)
+        except InterpreterError:
+            # The code failed, but its worker is ready for the next step
+            raise
+        except (EOFError, OSError, TimeoutError) as error:
+            self._discard()
+            raise InterpreterError(self._failure(worker, error)) from error
+        except BaseException:
+            # The worker may be left in the middle of a run
+            self._discard()
+            raise
+
+    def cleanup(self) -> None:
+        """Give the worker back to the pool."""
+        if self._release is not None:
+            self._release()
+        self._worker = self._release = None
+
+    def _lease(self) -> CodeWorker:
+        worker = call_blocking(self.pool.lease)
+        worker.connection.send(
+            (
+                "reset",
+                self.additional_authorized_imports,
+                self.max_print_outputs_length,
+            ),
+        )
+        worker.connection.send(("variables", self.variables))
+        worker.connection.send(("tools", list(self.tools)))
+        self._worker = worker
+        self._release = weakref.finalize(self, self.pool.release, worker)
+        return worker
+
+    def _discard(self) -> None:
+        if self._worker is not None:
+            self._release.detach()
+            self._worker.close()
+        self._worker = self._release = None
+
+    def _wait(self, worker: CodeWorker) -> CodeOutput:
+        """Answer the tool calls of the code until it is done."""
+        remaining = CODE_TIMEOUT
+        while True:
+            start = time.monotonic()
+            kind, *payload = call_blocking(receive, worker.connection, remaining)
+            remaining -= time.monotonic() - start
+            if kind == "call":
+                name, args, kwargs = payload
+                worker.connection.send(self._call_tool(name, args, kwargs))
+                continue
+            self.state["_print_outputs"] = payload[-1]
+            if kind == "failed":
+                raise InterpreterError(payload[0])
+            output, logs, is_final_answer = payload
+            return CodeOutput(output=output, logs=logs, is_final_answer=is_final_answer)
+
+    def _call_tool(self, name: str, args: tuple, kwargs: dict[str, Any]) -> tuple:
+        """Call a tool, and return the message answering the call."""
+        try:
+            message = ("result", self.tools[name](*args, **kwargs))
+        except Exception as error:  # noqa: BLE001
+            message = ("error", error)
+        try:
+            multiprocessing.reduction.ForkingPickler.dumps(message)
+        except Exception:  # noqa: BLE001
+            kind, value = message
+            message = (
+                "error",
+                RuntimeError(
+                    f"{type(value).__name__}: {value}"
+                    if kind == "error"
+                    else f"The result of {name} cannot be sent to the code",
+                ),
+            )
+        return message
+
+    def _failure(self, worker: CodeWorker, error: Exception) -> str:
+        """Describe why the worker running the code was stopped."""
+        if isinstance(error, TimeoutError):
+            reason = f"ran for more than {CODE_TIMEOUT:g}s"
+        elif worker.process.exitcode == -signal.SIGXCPU:
+            reason = f"exceeded its CPU time limit of {self.pool.cpu_seconds}s"
+        else:
+            reason = f"stopped its worker (exit code {worker.process.exitcode})"
+        logger.warning("Code execution %s", reason)
+        return (
+            f"The code {reason} and was stopped. The variables defined by the"
+            " previous steps are lost."
+        )
+
+
+def receive(
+    connection: multiprocessing.connection.Connection,
+    timeout: float,
+) -> tuple:
+    """Return the next message of a worker, or raise TimeoutError."""
+    if not connection.poll(max(timeout, 0)):
+        raise TimeoutError
+    return connection.recv()
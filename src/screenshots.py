@@ -0,0 +1,104 @@
+"""Compact storage of the browser screenshots shown to the model."""
+
+import os
+from collections import deque
+from io import BytesIO
+
+from PIL import Image
+from smolagents.agents import ActionStep
+
+SCREENSHOT_MAX_IMAGES = int(os.getenv("SCREENSHOT_MAX_IMAGES", "2"))
+SCREENSHOT_MAX_WIDTH = int(os.getenv("SCREENSHOT_MAX_WIDTH", "800"))
+# smolagents re-encodes images to PNG for the model, where JPEG artifacts compress
+# badly: lossy formats only save memory, at the cost of larger model requests
+SCREENSHOT_FORMAT = os.getenv("SCREENSHOT_FORMAT", "PNG")
+SCREENSHOT_QUALITY = int(os.getenv("SCREENSHOT_QUALITY", "80"))
+SCREENSHOT_GRAYSCALE = os.getenv("SCREENSHOT_GRAYSCALE", "false").lower() == "true"
+
+
+def difference_hash(image: Image.Image, hash_size: int = 8) -> int:
+    """Return the perceptual difference hash of an image."""
+    pixels = list(
+        image.convert("L").resize((hash_size + 1, hash_size)).getdata(),
+    )
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+class ScreenshotStore:
+    """
+    Compress browser screenshots and keep them on the last steps of an agent only.
+
+    Screenshots are downscaled, optionally converted to grayscale and re-encoded
+    once. The images handed to the model are lazily decoded from these bytes, so
+    memory holds compressed data only. A screenshot identical to the previous one is
+    skipped, and the images of the steps that fall out of the ring buffer of the last
+    ``max_images`` screenshots are dropped in O(1).
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        max_images: int = SCREENSHOT_MAX_IMAGES,
+        max_width: int = SCREENSHOT_MAX_WIDTH,
+        image_format: str = SCREENSHOT_FORMAT,
+        quality: int = SCREENSHOT_QUALITY,
+        *,
+        grayscale: bool = SCREENSHOT_GRAYSCALE,
+        max_hash_distance: int = 2,
+    ) -> None:
+        """Configure the compression and the number of screenshots kept."""
+        self.max_width = max_width
+        self.image_format = image_format
+        self.quality = quality
+        self.grayscale = grayscale
+        self.max_hash_distance = max_hash_distance
+        self._steps: deque[ActionStep] = deque(maxlen=max_images)
+        self._last_hash: int | None = None
+
+    def downscale(self, png_bytes: bytes) -> Image.Image:
+        """Decode a screenshot, downscaled and converted to the stored color mode."""
+        image = Image.open(BytesIO(png_bytes))
+        if image.width > self.max_width:
+            image = image.resize(
+                (self.max_width, round(image.height * self.max_width / image.width)),
+                Image.Resampling.BILINEAR,
+            )
+        return image.convert("L" if self.grayscale else "RGB")
+
+    def encode(self, image: Image.Image) -> Image.Image:
+        """Encode an image once, returning an image lazily decoded from the bytes."""
+        buffer = BytesIO()
+        image.save(buffer, format=self.image_format, quality=self.quality)
+        buffer.seek(0)
+        return Image.open(buffer)
+
+    def add(self, memory_step: ActionStep, png_bytes: bytes) -> bool:
+        """
+        Attach a screenshot to a step, returning False if it was a duplicate.
+
+        Duplicates are not attached: the model still sees the previous screenshot.
+        """
+        if self._steps and self._steps[-1].step_number >= memory_step.step_number:
+            # A new run started, previous screenshots are not in memory anymore
+            self._steps.clear()
+            self._last_hash = None
+
+        image = self.downscale(png_bytes)
+        image_hash = difference_hash(image)
+        if (
+            self._last_hash is not None
+            and (image_hash ^ self._last_hash).bit_count() <= self.max_hash_distance
+        ):
+            return False
+        self._last_hash = image_hash
+
+        if len(self._steps) == self._steps.maxlen:
+            self._steps[0].observations_images = None
+        self._steps.append(memory_step)
+        memory_step.observations_images = [self.encode(image)]
+        return True
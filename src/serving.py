@@ -0,0 +1,457 @@
+"""Serving of agent runs to many users: worker pool, bounded queue and limits."""
+
+import asyncio
+import contextlib
+import dataclasses
+import functools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import AsyncGenerator, Callable, Iterator
+from typing import Any
+
+from src.logger import logger
+
+# Number of agent runs executed at once
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "4"))
+# Number of agent runs executed at once by an asynchronous server
+AGENT_ASYNC_WORKERS = int(os.getenv("AGENT_ASYNC_WORKERS", "100"))
+# Number of runs waiting for a worker beyond which new runs are refused
+AGENT_QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "16"))
+# Runs a user may start per minute, and have queued or running at once
+USER_RUNS_PER_MINUTE = int(os.getenv("USER_RUNS_PER_MINUTE", "10"))
+USER_MAX_ACTIVE_RUNS = int(os.getenv("USER_MAX_ACTIVE_RUNS", "2"))
+# Seconds after which a run whose updates are no longer read is cancelled
+RUN_ABANDON_TIMEOUT = float(os.getenv("RUN_ABANDON_TIMEOUT", "60"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = frozenset({DONE, FAILED, CANCELLED})
+
+# Seconds between two checks of a waiting consumer for a cancelled run
+POLL_INTERVAL = 1.0
+
+
+class AdmissionError(Exception):
+    """Run refused by the server."""
+
+
+class QueueFullError(AdmissionError):
+    """Run refused because the queue is full."""
+
+
+class RateLimitError(AdmissionError):
+    """Run refused because its user exceeded their limits."""
+
+
+@dataclasses.dataclass(frozen=True)
+class QueuePosition:
+    """Position of a queued run, 1 for the next run to start."""
+
+    position: int
+    queue_length: int
+
+
+class RateLimiter:
+    """Sliding window limit on the runs started by each user."""
+
+    def __init__(self, max_runs: int, period: float = 60.0) -> None:
+        """Allow ``max_runs`` runs per user every ``period`` seconds."""
+        self.max_runs = max_runs
+        self.period = period
+        self._starts: defaultdict[str, deque[float]] = defaultdict(deque)
+
+    def retry_after(self, user: str) -> float:
+        """Return the seconds before ``user`` may start a run, 0 if they may now."""
+        starts = self._starts.get(user, deque())
+        now = time.monotonic()
+        while starts and starts[0] <= now - self.period:
+            starts.popleft()
+        if len(starts) < self.max_runs:
+            return 0.0
+        return starts[0] + self.period - now
+
+    def record(self, user: str) -> None:
+        """Record a run started by ``user``, forgetting the users idle for a period."""
+        now = time.monotonic()
+        for idle_user in [
+            idle_user
+            for idle_user, starts in self._starts.items()
+            if not starts or starts[-1] <= now - self.period
+        ]:
+            del self._starts[idle_user]
+        self._starts[user].append(now)
+
+
+@dataclasses.dataclass
+class Reader:
+    """What the consumer of a run has seen of it."""
+
+    version: int = 0
+    position: QueuePosition | None = None
+    finished: bool = False
+
+
+class AgentRun:
+    """
+    Run submitted to an ``AgentServer``, read by iterating over its updates.
+
+    The run's job is a generator function, asynchronous for an asynchronous
+    server, whose items are published to the consumer, only the latest one being
+    kept when the consumer lags. The updates can be read by a thread or by a
+    coroutine, whatever the server. A run whose consumer stops reading for
+    ``RUN_ABANDON_TIMEOUT`` seconds, or closes the iterator of the updates, is
+    cancelled.
+    """
+
+    def __init__(
+        self,
+        server: "AgentServer",
+        user: str,
+        job: Callable[[], Iterator[Any] | AsyncGenerator],
+    ) -> None:
+        """Prepare a run of ``job`` for ``user``."""
+        self.server = server
+        self.user = user
+        self.job = job
+        self.status = QUEUED
+        self.submitted_at = time.monotonic()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.error: BaseException | None = None
+        self._changed = threading.Condition(server.lock)
+        self._async_readers: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = (
+            set()
+        )
+        self._update: Any = None
+        self._version = 0
+        self._cancelled = threading.Event()
+        self._reading = False
+        self._read_at = self.submitted_at
+
+    @property
+    def abandoned(self) -> bool:
+        """Whether the consumer of the run stopped reading its updates."""
+        return self._cancelled.is_set() or (
+            not self._reading
+            and time.monotonic() - self._read_at > self.server.abandon_timeout
+        )
+
+    def cancel(self) -> None:
+        """Cancel the run: it is dequeued, or stopped at its next update."""
+        self._cancelled.set()
+        self.server.dequeue(self)
+
+    def notify(self) -> None:
+        """Wake the consumers of the run, the lock of the server being held."""
+        self._changed.notify_all()
+        for loop, event in self._async_readers:
+            loop.call_soon_threadsafe(event.set)
+
+    def updates(self) -> Iterator[Any]:
+        """
+        Yield the queue position of the run while it waits, then its updates.
+
+        The exception raised by a failed run is raised once its last update is
+        yielded. Closing the iterator cancels the run.
+        """
+        reader = Reader()
+        try:
+            while not reader.finished:
+                with self._changed:
+                    self._reading = True
+                    self._changed.wait_for(
+                        functools.partial(self._has_news, reader),
+                        timeout=POLL_INTERVAL,
+                    )
+                    news = self._read(reader)
+                if news:
+                    yield news[0]
+            if self.error is not None:
+                raise self.error
+        finally:
+            if self.status not in FINISHED:
+                self.cancel()
+
+    async def aupdates(self) -> AsyncGenerator:
+        """Yield the queue position then the updates of the run, as ``updates``."""
+        reader = Reader()
+        changed = (asyncio.get_running_loop(), asyncio.Event())
+        try:
+            while not reader.finished:
+                with self.server.lock:
+                    self._reading = True
+                    has_news = self._has_news(reader)
+                    if not has_news:
+                        changed[1].clear()
+                        self._async_readers.add(changed)
+                if not has_news:
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(changed[1].wait(), POLL_INTERVAL)
+                with self.server.lock:
+                    self._async_readers.discard(changed)
+                    news = self._read(reader)
+                if news:
+                    yield news[0]
+            if self.error is not None:
+                raise self.error
+        finally:
+            if self.status not in FINISHED:
+                self.cancel()
+
+    def execute(self) -> None:
+        """Run the job, publishing its updates, from a worker thread."""
+        self._start()
+        status = DONE
+        try:
+            iterator = self.job()
+            try:
+                for update in iterator:
+                    self._publish(update)
+                    if self.abandoned:
+                        status = CANCELLED
+                        break
+            finally:
+                # Ends the agent run, and its model stream, at the current update
+                iterator.close()
+        except Exception as error:  # noqa: BLE001
+            self.error = error
+            status = FAILED
+        self._end(status)
+
+    async def aexecute(self) -> None:
+        """Run the asynchronous job, publishing its updates, on the server's loop."""
+        self._start()
+        status = DONE
+        try:
+            iterator = self.job()
+            try:
+                async for update in iterator:
+                    self._publish(update)
+                    if self.abandoned:
+                        status = CANCELLED
+                        break
+            finally:
+                await iterator.aclose()
+        except Exception as error:  # noqa: BLE001
+            self.error = error
+            status = FAILED
+        self._end(status)
+
+    def _start(self) -> None:
+        with self.server.lock:
+            self.status = RUNNING
+            self.started_at = time.monotonic()
+            self.notify()
+
+    def _end(self, status: str) -> None:
+        if status == CANCELLED:
+            logger.info(f"Cancelled the abandoned run of {self.user}.")
+        elif status == FAILED:
+            logger.warning(f"Run of {self.user} failed: {self.error!r}")
+        with self.server.lock:
+            self.status = status
+            self.finished_at = time.monotonic()
+            self.notify()
+
+    def _has_news(self, reader: Reader) -> bool:
+        """Return whether the run has news for a consumer, the lock being held."""
+        return (
+            self._version != reader.version
+            or self.status in FINISHED
+            or self.server.position(self) != reader.position
+        )
+
+    def _read(self, reader: Reader) -> tuple[Any] | None:
+        """Return the news of the run for a consumer, if any, the lock being held."""
+        self._reading = False
+        self._read_at = time.monotonic()
+        if self._version != reader.version:
+            reader.version = self._version
+            return (self._update,)
+        position = self.server.position(self)
+        if position != reader.position:
+            reader.position = position
+            return (position,) if position is not None else None
+        reader.finished = self.status in FINISHED
+        return None
+
+    def _publish(self, update: Any) -> None:  # noqa: ANN401
+        with self.server.lock:
+            self._update = update
+            self._version += 1
+            self.notify()
+
+
+class AgentServer:
+    """
+    Run the agent jobs of many users on a bounded pool of workers.
+
+    Runs wait in a bounded FIFO queue, and are refused once it is full or when
+    their user exceeds their rate or active run limits, so that a burst of users
+    cannot exhaust the memory or the model quotas of the app.
+
+    Workers are threads running generator jobs, or, for an ``asynchronous``
+    server, tasks running asynchronous generator jobs on an event loop the server
+    runs in a thread of its own, so that many runs waiting on I/O cost no thread.
+    ``release_resources`` is called by a worker thread after each run, cancelled
+    or not, to free the resources the run leased to the thread.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        workers: int = AGENT_WORKERS,
+        queue_size: int = AGENT_QUEUE_SIZE,
+        runs_per_minute: int = USER_RUNS_PER_MINUTE,
+        max_active_runs: int = USER_MAX_ACTIVE_RUNS,
+        abandon_timeout: float = RUN_ABANDON_TIMEOUT,
+        release_resources: Callable[[], None] | None = None,
+        *,
+        asynchronous: bool = False,
+    ) -> None:
+        """Create a server, its workers being started on the first run."""
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_active_runs = max_active_runs
+        self.abandon_timeout = abandon_timeout
+        self.release_resources = release_resources
+        self.asynchronous = asynchronous
+        self.rate_limiter = RateLimiter(runs_per_minute)
+        self.lock = threading.Lock()
+        self._queue: deque[AgentRun] = deque()
+        self._active: defaultdict[str, int] = defaultdict(int)
+        self._work_available = threading.Condition(self.lock)
+        self._threads: list[threading.Thread] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._running = 0
+
+    def submit(
+        self,
+        user: str,
+        job: Callable[[], Iterator[Any] | AsyncGenerator],
+    ) -> AgentRun:
+        """
+        Queue a run of ``job`` for ``user``.
+
+        Raises ``QueueFullError`` if the queue is full, and ``RateLimitError`` if
+        the user has too many runs or started too many runs recently.
+        """
+        with self.lock:
+            if len(self._queue) >= self.queue_size:
+                msg = "The server is busy, please retry in a few minutes."
+                raise QueueFullError(msg)
+            if self._active.get(user, 0) >= self.max_active_runs:
+                msg = "Please wait for your runs in progress to finish."
+                raise RateLimitError(msg)
+            if retry_after := self.rate_limiter.retry_after(user):
+                msg = f"Too many runs, please retry in {retry_after:.0f} seconds."
+                raise RateLimitError(msg)
+            self.rate_limiter.record(user)
+            self._active[user] += 1
+            run = AgentRun(self, user, job)
+            self._queue.append(run)
+            if self.asynchronous:
+                self._dispatch()
+            else:
+                self._start_workers()
+            self._notify_queue()
+        return run
+
+    def position(self, run: AgentRun) -> QueuePosition | None:
+        """Return the position of a queued run, ``None`` once it left the queue."""
+        try:
+            return QueuePosition(self._queue.index(run) + 1, len(self._queue))
+        except ValueError:
+            return None
+
+    def dequeue(self, run: AgentRun) -> None:
+        """Remove a cancelled run from the queue, if it is still waiting."""
+        with self.lock:
+            if run in self._queue:
+                self._queue.remove(run)
+                self._finish(run, CANCELLED)
+                self._notify_queue()
+
+    @property
+    def queue_length(self) -> int:
+        """Number of runs waiting for a worker."""
+        return len(self._queue)
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work,
+                name=f"agent-worker-{len(self._threads)}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        """Execute queued runs, forever."""
+        while True:
+            with self.lock:
+                self._work_available.wait_for(lambda: self._queue)
+                run = self._queue.popleft()
+                self._notify_queue()
+                if run.abandoned:
+                    self._finish(run, CANCELLED)
+                    continue
+            try:
+                run.execute()
+            finally:
+                if self.release_resources is not None:
+                    self.release_resources()
+                with self.lock:
+                    self._release_user(run.user)
+
+    def _dispatch(self) -> None:
+        """Start queued runs on the event loop, up to ``workers``, the lock held."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=self._loop.run_forever,
+                name="agent-loop",
+                daemon=True,
+            ).start()
+        while self._queue and self._running < self.workers:
+            run = self._queue.popleft()
+            if run.abandoned:
+                self._finish(run, CANCELLED)
+                continue
+            self._running += 1
+            asyncio.run_coroutine_threadsafe(self._awork(run), self._loop)
+
+    async def _awork(self, run: AgentRun) -> None:
+        """Execute a run on the event loop, then start the next queued ones."""
+        try:
+            await run.aexecute()
+        finally:
+            with self.lock:
+                self._running -= 1
+                self._release_user(run.user)
+                self._dispatch()
+                self._notify_queue()
+
+    def _finish(self, run: AgentRun, status: str) -> None:
+        """Mark a run that never started as finished, the lock being held."""
+        run.status = status
+        run.finished_at = time.monotonic()
+        self._release_user(run.user)
+        run.notify()
+
+    def _release_user(self, user: str) -> None:
+        """Count a run of ``user`` as finished, the lock being held."""
+        self._active[user] -= 1
+        if not self._active[user]:
+            del self._active[user]
+
+    def _notify_queue(self) -> None:
+        """Wake the workers and the consumers of queued runs, the lock being held."""
+        self._work_available.notify()
+        for run in self._queue:
+            run.notify()
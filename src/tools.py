@@ -1,14 +1,50 @@
 """Tools for the agent."""
 
 import math
+import os
 from collections.abc import Callable
+from pathlib import Path
 from typing import ClassVar
 
-from langchain_community.agent_toolkits.load_tools import load_tools
-from langchain_community.retrievers import BM25Retriever
+import numpy as np
 from smolagents import Tool, tool
 
-from src.documents import get_documents
+from src.compaction import output_store
+from src.locations import LocationIndex
+
+PARTY_INDEX_DIR = os.getenv("PARTY_INDEX_DIR", ".index/party_planning")
+PARTY_DOCUMENTS_DIR = os.getenv("PARTY_DOCUMENTS_DIR")
+# "bm25" for lexical search only, "rrf" or "weighted" to fuse it with dense search
+PARTY_RETRIEVAL = os.getenv("PARTY_RETRIEVAL", "bm25")
+# Travel times listed by calculate_cargo_travel_times in pairs mode
+CARGO_MAX_TRAVEL_TIMES = 1000
+
+
+@tool
+def read_output(handle: str, start: int = 0, length: int = 4000) -> str:
+    """
+    Read a tool output that was shortened in memory, from its handle.
+
+    Args:
+        handle: The handle given in place of the output, like 'out-0123456789ab'.
+        start: The index of the first character to read.
+        length: The number of characters to read.
+
+    """
+    output = output_store.get(handle)
+    if output is None:
+        msg = f"Unknown or expired output handle: {handle}"
+        raise ValueError(msg)
+    end = start + length
+    if end < len(output):
+        return (
+            f"{output[start:end]}\n[{len(output) - end} more characters,"
+            f" read_output('{handle}', start={end}) returns them]"
+        )
+    return output[start:end]
+
+
+read_output.side_effect_free = True
 
 
 # Tool to list the available occasions
@@ -108,6 +144,11 @@ class SuperheroPartyThemeTool(Tool):
 
 def get_langchain_serpapi_tool() -> Callable:
     """Return a tool that uses the SerpAPI to search the web."""
+    # Importing the langchain toolkits takes half a second
+    from langchain_community.agent_toolkits.load_tools import (  # noqa: PLC0415
+        load_tools,
+    )
+
     serpapi_search_tool = Tool.from_langchain(load_tools(["serpapi"])[0])
     serpapi_search_tool.name = "serpapi_search_tool"
     return serpapi_search_tool
@@ -125,9 +166,11 @@ def get_image_generation_tool() -> Callable:
 class PartyPlanningRetrieverTool(Tool):
     """Retrieve relevant party planning ideas for Alfred's party."""
 
+    side_effect_free = True
+
     name = "party_planning_retriever"
     description = """
-        Uses semantic search to retrieve relevant party planning ideas for
+        Searches a knowledge base to retrieve relevant party planning ideas for
         Alfred's superhero-themed party at Wayne Manor.
         """
 
@@ -142,20 +185,59 @@ class PartyPlanningRetrieverTool(Tool):
     }
     output_type = "string"
 
-    def __init__(self, **kwargs) -> None:  # noqa: ANN003
-        """Initialize the retriever tool."""
+    def __init__(
+        self,
+        index_dir: str = PARTY_INDEX_DIR,
+        documents_dir: str | None = PARTY_DOCUMENTS_DIR,
+        retrieval: str = PARTY_RETRIEVAL,
+        **kwargs,  # noqa: ANN003
+    ) -> None:
+        """Initialize the retriever tool, the index is only opened on first use."""
         super().__init__(**kwargs)
-        docs = get_documents()
-        self.retriever = BM25Retriever.from_documents(
-            docs,
-            k=5,  # Retrieve the top 5 documents
+        self.index_dir = index_dir
+        self.documents_dir = documents_dir
+        self.retrieval = retrieval
+
+    def setup(self) -> None:
+        """
+        Open the on-disk BM25 index and bring it up to date.
+
+        The files of ``documents_dir`` are ingested if it is set, only new and
+        changed files being read. Otherwise, an empty index is built from the
+        built-in documents. In hybrid mode, the new documents are then embedded.
+        """
+        # The retrieval stack is only imported by the agents using the tool
+        from src.bm25 import BM25Index  # noqa: PLC0415
+        from src.dense import DenseIndex  # noqa: PLC0415
+        from src.documents import get_documents  # noqa: PLC0415
+        from src.embeddings import (  # noqa: PLC0415
+            EMBEDDING_CACHE_PATH,
+            EmbeddingCache,
+            StaticEmbeddingModel,
         )
+        from src.hybrid import HybridRetriever  # noqa: PLC0415
+        from src.ingestion import DirectoryIngestor  # noqa: PLC0415
+
+        self.index = BM25Index(self.index_dir)
+        if self.documents_dir is not None:
+            DirectoryIngestor(self.index).ingest(self.documents_dir)
+        elif not len(self.index):
+            self.index.add(get_documents())
+        self.retriever = self.index
+        if self.retrieval != "bm25":
+            model = StaticEmbeddingModel.load()
+            self.retriever = HybridRetriever(
+                self.index,
+                DenseIndex(Path(self.index_dir) / "dense", model.dimension),
+                EmbeddingCache(EMBEDDING_CACHE_PATH, model),
+                fusion=self.retrieval,
+            )
+            self.retriever.sync()
+        self.is_initialized = True
 
     def forward(self, query: str) -> str:
         """Retrieve relevant party planning ideas for Alfred's party."""
-        docs = self.retriever.invoke(
-            query,
-        )
+        docs = self.retriever.search(query, k=5)  # Retrieve the top 5 documents
         return "\nRetrieved ideas:\n" + "".join(
             [
                 f"\n\n===== Idea {i!s} =====\n" + doc.page_content
@@ -164,6 +246,96 @@ class PartyPlanningRetrieverTool(Tool):
         )
 
 
+class NearestLocationsTool(Tool):
+    """Find the locations nearest to a point, or within a cargo flight time of it."""
+
+    side_effect_free = True
+
+    name = "nearest_locations"
+    description = """
+        Finds the known locations (e.g. airports) nearest to a coordinate, or all the
+        locations reachable from it within a given cargo plane flight time. Much faster
+        than computing distances to every location yourself.
+        """
+
+    inputs: ClassVar[dict] = {
+        "latitude": {"type": "number", "description": "Latitude of the point."},
+        "longitude": {"type": "number", "description": "Longitude of the point."},
+        "k": {
+            "type": "integer",
+            "description": """
+                Number of nearest locations to return, at least 1 (defaults to 10).
+            """,
+            "nullable": True,
+        },
+        "max_hours": {
+            "type": "number",
+            "description": """
+                If given, return all the locations (up to 1000) reachable within this
+                cargo flight time, in hours, instead of the k nearest.
+            """,
+            "nullable": True,
+        },
+        "cruising_speed_kmh": {
+            "type": "number",
+            "description": "Cruising speed in km/h (defaults to 750 km/h).",
+            "nullable": True,
+        },
+    }
+    output_type = "string"
+
+    max_results = 1000
+
+    def __init__(self, locations_path: str, **kwargs) -> None:  # noqa: ANN003
+        """Initialize the tool, the index is only loaded on first use."""
+        super().__init__(**kwargs)
+        self.locations_path = locations_path
+
+    def setup(self) -> None:
+        """Load the memory-mapped location index."""
+        self.index = LocationIndex.load(self.locations_path)
+        self.is_initialized = True
+
+    def forward(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int | None = 10,
+        max_hours: float | None = None,
+        cruising_speed_kmh: float | None = 750.0,
+    ) -> str:
+        """Find the locations nearest to a point, or within a flight time of it."""
+        cruising_speed_kmh = cruising_speed_kmh or 750.0
+        k = 10 if k is None else k
+        if max_hours is None and k < 1:
+            msg = f"k must be at least 1, got {k}: pass k=1 or more, or max_hours."
+            raise ValueError(msg)
+        if max_hours is None:
+            indices, distances = self.index.nearest(latitude, longitude, k)
+        else:
+            # Inverse of the flight time formula of calculate_cargo_travel_time
+            max_distance_km = max(max_hours - 1.0, 0.0) * cruising_speed_kmh / 1.1
+            indices, distances = self.index.within(
+                latitude,
+                longitude,
+                max_distance_km,
+            )
+            indices, distances = (
+                indices[: self.max_results],
+                distances[: self.max_results],
+            )
+        hours = distances * 1.1 / cruising_speed_kmh + 1.0
+        return f"Found {len(indices)} locations:\n" + "\n".join(
+            f"{self.index.names[index]}: {distance:.0f} km, {flight_hours:.2f} h"
+            for index, distance, flight_hours in zip(
+                indices,
+                distances,
+                hours,
+                strict=True,
+            )
+        )
+
+
 @tool
 def calculate_cargo_travel_time(
     origin_coords: tuple[float, float],
@@ -220,3 +392,152 @@ def calculate_cargo_travel_time(
 
     # Format the results
     return round(flight_time, 2)
+
+
+calculate_cargo_travel_time.side_effect_free = True
+
+
+def haversine_travel_times(
+    origins_coords: np.ndarray,
+    destinations_coords: np.ndarray,
+    cruising_speed_kmh: float,
+) -> np.ndarray:
+    """
+    Return cargo flight times in hours, computed in one vectorised pass.
+
+    Coordinates are (latitude, longitude) in degrees along the last axis, and the
+    other axes of origins and destinations are broadcast against each other. Uses the
+    same assumptions as `calculate_cargo_travel_time`.
+    """
+    lat1, lon1 = np.radians(origins_coords[..., 0]), np.radians(origins_coords[..., 1])
+    lat2, lon2 = (
+        np.radians(destinations_coords[..., 0]),
+        np.radians(destinations_coords[..., 1]),
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    distance = 6371.0 * 2 * np.arcsin(np.sqrt(a))
+    return (distance * 1.1 / cruising_speed_kmh) + 1.0
+
+
+def as_coordinates(coords: list[list[float]], name: str) -> np.ndarray:
+    """Return a list of (latitude, longitude) points as an array of shape (n, 2)."""
+    msg = f"{name} must be a list of (latitude, longitude) pairs."
+    try:
+        array = np.asarray(coords, dtype=float)
+    except (TypeError, ValueError) as error:
+        raise ValueError(msg) from error
+    if array.size == 0:
+        return array.reshape(0, 2)
+    if array.ndim != 2 or array.shape[1] != 2:  # noqa: PLR2004
+        msg += f" Got an array of shape {array.shape}."
+        raise ValueError(msg)
+    return array
+
+
+@tool
+def calculate_cargo_travel_times(
+    origins_coords: list[list[float]],
+    destinations_coords: list[list[float]],
+    cruising_speed_kmh: float | None = 750.0,
+    matrix: bool | None = False,  # noqa: FBT001, FBT002
+    top_k: int | None = 5,
+) -> dict:
+    """
+    Calculate cargo plane travel times for many origins and destinations at once.
+
+    Use this instead of calling calculate_cargo_travel_time in a loop.
+
+    Args:
+        origins_coords: List of (latitude, longitude) starting points.
+        destinations_coords: List of (latitude, longitude) destinations.
+        cruising_speed_kmh: Optional cruising speed in km/h (defaults to 750 km/h for
+            typical cargo planes).
+        matrix: If False (default), origins and destinations are paired element-wise
+            and must have the same length. If True, every origin is paired with every
+            destination.
+        top_k: Number of fastest pairs to return, at least 1 (defaults to 5).
+
+    Returns:
+        dict: The travel times in hours with, in pairs mode, "travel_times" (one per
+            pair, for the first 1000 pairs, and "omitted_travel_times" counting the
+            others) and, in matrix mode, "fastest_destination_per_origin" (index and
+            hours for each origin). Both modes return "fastest" (the top_k fastest
+            pairs with their indices and hours) and "summary" (min, mean, max hours).
+
+    Example:
+        >>> # Fastest of two destinations to reach from Chicago
+        >>> result = calculate_cargo_travel_times(
+        ...     [(41.878, -87.629)], [(-33.868, 151.209), (51.47, -0.454)], matrix=True
+        ... )
+
+    """
+    cruising_speed_kmh = cruising_speed_kmh or 750.0
+    top_k = 5 if top_k is None else top_k
+    if top_k < 1:
+        msg = f"top_k must be at least 1, got {top_k}."
+        raise ValueError(msg)
+    origins = as_coordinates(origins_coords, "origins_coords")
+    destinations = as_coordinates(destinations_coords, "destinations_coords")
+    if matrix:
+        origins = origins[:, np.newaxis, :]
+    elif len(origins) != len(destinations):
+        msg = (
+            f"Got {len(origins)} origins and {len(destinations)} destinations, "
+            "use matrix=True to pair every origin with every destination."
+        )
+        raise ValueError(msg)
+    travel_times = haversine_travel_times(origins, destinations, cruising_speed_kmh)
+
+    flat_times = travel_times.ravel()
+    if flat_times.size == 0:
+        msg = "No origin or destination given."
+        raise ValueError(msg)
+    k = min(top_k, flat_times.size)
+    fastest_indices = np.argpartition(flat_times, k - 1)[:k]
+    fastest = []
+    for index in fastest_indices[np.argsort(flat_times[fastest_indices])]:
+        if matrix:
+            origin_index, destination_index = np.unravel_index(
+                index,
+                travel_times.shape,
+            )
+            pair = {
+                "origin_index": int(origin_index),
+                "destination_index": int(destination_index),
+            }
+        else:
+            pair = {"index": int(index)}
+        fastest.append({**pair, "hours": round(float(flat_times[index]), 2)})
+
+    result = {
+        "fastest": fastest,
+        "summary": {
+            "min": round(float(flat_times.min()), 2),
+            "mean": round(float(flat_times.mean()), 2),
+            "max": round(float(flat_times.max()), 2),
+        },
+    }
+    if matrix:
+        fastest_destinations = travel_times.argmin(axis=1)
+        result["fastest_destination_per_origin"] = [
+            {"destination_index": int(index), "hours": round(float(hours), 2)}
+            for index, hours in zip(
+                fastest_destinations,
+                travel_times.min(axis=1),
+                strict=True,
+            )
+        ]
+    else:
+        result["travel_times"] = np.round(
+            travel_times[:CARGO_MAX_TRAVEL_TIMES],
+            2,
+        ).tolist()
+        if len(travel_times) > CARGO_MAX_TRAVEL_TIMES:
+            result["omitted_travel_times"] = len(travel_times) - CARGO_MAX_TRAVEL_TIMES
+    return result
+
+
+calculate_cargo_travel_times.side_effect_free = True
@@ -0,0 +1,495 @@
+"""Cached and pooled web access for the web agent, with page text extraction."""
+
+import dataclasses
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Callable, Mapping
+from pathlib import Path
+from urllib.parse import urljoin
+
+import lxml.html
+import requests
+from requests.adapters import HTTPAdapter
+from smolagents import GoogleSearchTool, VisitWebpageTool
+
+# Set WEB_CACHE_PATH to an empty string to keep the pages in memory only
+WEB_CACHE_PATH = os.getenv("WEB_CACHE_PATH", ".cache/web_pages.sqlite")
+WEB_CACHE_MAX_MB = float(os.getenv("WEB_CACHE_MAX_MB", "256"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024"))
+WEB_PAGE_MAX_CHARS = int(os.getenv("WEB_PAGE_MAX_CHARS", "10000"))
+WEB_POOL_CONNECTIONS = int(os.getenv("WEB_POOL_CONNECTIONS", "16"))
+WEB_TIMEOUT = 20
+HTTP_NOT_MODIFIED = 304
+
+SEARCH_URLS = {
+    "serpapi": "https://serpapi.com/search.json",
+    "serper": "https://google.serper.dev/search",
+}
+BOILERPLATE_TAGS = {
+    "aside",
+    "button",
+    "footer",
+    "form",
+    "header",
+    "iframe",
+    "nav",
+    "noscript",
+    "script",
+    "style",
+    "svg",
+    "template",
+}
+# Matches whole class or id tokens, like "sidebar" or "cookie-banner" but not
+# "has-sidebar" or "commentary"
+BOILERPLATE_PATTERN = re.compile(
+    r"(?:advert|banner|breadcrumb|comment|consent|cookie|footer|menu|modal|navbar"
+    r"|newsletter|popup|promo|related|share|sidebar|social|subscribe)s?(?:[-_].*)?",
+    re.IGNORECASE,
+)
+# Elements whose class names describe the page layout rather than boilerplate
+CONTENT_TAGS = {"html", "body", "main", "article"}
+# Tags never holding visible text, removed from the body text too
+HIDDEN_TAGS = {"noscript", "script", "style", "svg", "template"}
+# Below this many characters, the main text is taken for a failed extraction
+EXTRACT_MIN_CHARS = 100
+BLOCK_TAGS = (
+    "blockquote",
+    "br",
+    "dd",
+    "div",
+    "dt",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "li",
+    "p",
+    "pre",
+    "section",
+    "table",
+    "tr",
+)
+
+
+def is_boilerplate(element: lxml.html.HtmlElement) -> bool:
+    """Return whether an element is a comment, a script or a page furniture."""
+    if not isinstance(element.tag, str):
+        return True
+    if element.tag in BOILERPLATE_TAGS:
+        return True
+    return element.tag not in CONTENT_TAGS and any(
+        BOILERPLATE_PATTERN.fullmatch(token)
+        for token in f"{element.get('class', '')} {element.get('id', '')}".split()
+    )
+
+
+def mark_up(content: lxml.html.HtmlElement, url: str) -> None:
+    """Write the links, headings and list items in markdown, blocks on their lines."""
+    for link in content.iter("a"):
+        href = link.get("href", "")
+        text = " ".join(link.text_content().split())
+        if text and href and not href.startswith(("#", "javascript:")):
+            for child in list(link):
+                link.remove(child)
+            link.text = f"[{text}]({urljoin(url, href)})"
+    for element in content.iter(*BLOCK_TAGS):
+        if element.tag[0] == "h" and element.tag[1:].isdigit():
+            element.text = "#" * int(element.tag[1:]) + " " + (element.text or "")
+        elif element.tag == "li":
+            element.text = "- " + (element.text or "")
+        element.tail = "\n" + (element.tail or "")
+
+
+def main_content(document: lxml.html.HtmlElement) -> lxml.html.HtmlElement:
+    """Return the ``main`` or ``article`` element of a page, or else its body."""
+    candidates = document.xpath("//main | //*[@role='main'] | //article")
+    for candidate in candidates:
+        # Skip the articles of sidebars and such
+        if not any(is_boilerplate(ancestor) for ancestor in candidate.iterancestors()):
+            return candidate
+    return next(iter(candidates or document.xpath("//body")), document)
+
+
+def element_text(content: lxml.html.HtmlElement, url: str) -> str:
+    """Return the text of an element, marked up, without blank lines."""
+    mark_up(content, url)
+    lines = [" ".join(line.split()) for line in content.text_content().splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def extract_text(html: str | bytes, url: str = "") -> str:
+    """
+    Return the main text of a web page, with its links, headings and paragraphs.
+
+    Scripts, navigation, headers, footers and elements whose class or id name them
+    as banners, menus, sidebars and such are removed. The text of the ``main`` or
+    ``article`` element is kept if there is one, that of the body otherwise: the
+    elements holding it are never removed. If less than ``EXTRACT_MIN_CHARS`` are
+    left, the text of the whole body is returned instead. Links are made absolute
+    and written in markdown.
+    """
+    if not html.strip():
+        return ""
+    document = lxml.html.document_fromstring(html)
+    title = document.findtext(".//title") or ""
+    content = main_content(document)
+    kept = {content, *content.iterancestors()}
+    for element in [element for element in document.iter() if is_boilerplate(element)]:
+        if element not in kept and element.getparent() is not None:
+            element.drop_tree()
+    text = element_text(content, url)
+
+    if len(text) < EXTRACT_MIN_CHARS:
+        # The content may have been taken for boilerplate, keep the whole body
+        document = lxml.html.document_fromstring(html)
+        for element in [
+            element
+            for element in document.iter()
+            if not isinstance(element.tag, str) or element.tag in HIDDEN_TAGS
+        ]:
+            if element.getparent() is not None:
+                element.drop_tree()
+        body = next(iter(document.xpath("//body")), document)
+        text = max(text, element_text(body, url), key=len)
+    if title.strip() and not text.startswith("# "):
+        text = f"Title: {' '.join(title.split())}\n\n{text}"
+    return text
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Cut a text past ``max_chars`` characters, at a line break."""
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n", 0, max_chars)
+    return (
+        f"{text[: cut if cut > 0 else max_chars]}\n"
+        f"[Page truncated to {max_chars} of its {len(text)} characters]"
+    )
+
+
+def freshness_lifetime(headers: Mapping[str, str]) -> float:
+    """Return for how many seconds a response may be reused without revalidation."""
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0
+    if match := re.search(r"max-age=(\d+)", cache_control):
+        return float(match.group(1))
+    if expires := headers.get("Expires"):
+        try:
+            return email.utils.parsedate_to_datetime(expires).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return 0
+    return 0
+
+
+@dataclasses.dataclass
+class WebCacheStats:
+    """Counters of a web cache."""
+
+    fresh_hits: int = 0
+    revalidated_hits: int = 0
+    misses: int = 0
+    search_hits: int = 0
+    search_misses: int = 0
+    downloaded_bytes: int = 0
+    saved_bytes: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        """Return the share of the page visits and searches answered from the cache."""
+        hits = self.fresh_hits + self.revalidated_hits + self.search_hits
+        return hits / max(hits + self.misses + self.search_misses, 1)
+
+    def __str__(self) -> str:
+        """Summarize the hits, misses and bytes."""
+        return (
+            f"pages: {self.fresh_hits} fresh hits, {self.revalidated_hits} revalidated"
+            f" hits, {self.misses} misses; searches: {self.search_hits} hits,"
+            f" {self.search_misses} misses (hit ratio {self.hit_ratio:.1%});"
+            f" {self.downloaded_bytes:,} page bytes downloaded,"
+            f" {self.saved_bytes:,} saved"
+        )
+
+
+class WebCache:
+    """
+    HTTP cache of the text of web pages, and time-limited cache of search results.
+
+    Pages are stored on disk in SQLite as their extracted text, with their
+    ``ETag`` and ``Last-Modified`` validators. A page is reused without a request
+    while fresh according to its ``Cache-Control`` or ``Expires`` headers, and
+    revalidated with a conditional request otherwise: a ``304 Not Modified``
+    answer costs no download. The least recently used pages are evicted past
+    ``max_bytes``. Search results are kept in memory for ``search_ttl`` seconds.
+    Requests go through a session pooling ``pool_connections`` connections per
+    host.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_bytes: int = int(WEB_CACHE_MAX_MB * 1e6),
+        search_ttl: float = SEARCH_CACHE_TTL,
+        pool_connections: int = WEB_POOL_CONNECTIONS,
+    ) -> None:
+        """Open the page database, creating it if needed."""
+        self.max_bytes = max_bytes
+        self.search_ttl = search_ttl
+        self.stats = WebCacheStats()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_connections,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._searches: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, text BLOB, size INTEGER, body_size INTEGER,"
+            " etag TEXT, last_modified TEXT, fresh_until REAL, accessed REAL"
+            ") WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed);",
+        )
+        (size,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM pages",
+        ).fetchone()
+        self._size = size
+
+    def fetch(self, url: str) -> str:
+        """Return the text of a web page, from the cache if it is unchanged."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT text, body_size, etag, last_modified, fresh_until"
+                " FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+        headers = {}
+        if row is not None:
+            text, body_size, etag, last_modified, fresh_until = row
+            if time.time() < fresh_until:
+                self._hit(url, body_size, fresh=True)
+                return zlib.decompress(text).decode()
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self.session.get(url, headers=headers, timeout=WEB_TIMEOUT)
+        if row is not None and response.status_code == HTTP_NOT_MODIFIED:
+            self._hit(url, body_size, fresh=False, response=response)
+            return zlib.decompress(text).decode()
+        response.raise_for_status()
+        text = extract_text(response.content, response.url)
+        self._store(url, text, response)
+        return text
+
+    def search(self, key: dict, search: Callable[[], str]) -> str:
+        """Return the cached result of a search, or run and cache it."""
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        now = time.time()
+        with self._lock:
+            if digest in self._searches:
+                created, result = self._searches[digest]
+                if created >= now - self.search_ttl:
+                    self._searches.move_to_end(digest)
+                    self.stats.search_hits += 1
+                    return result
+                del self._searches[digest]
+            self.stats.search_misses += 1
+        result = search()
+        with self._lock:
+            self._searches[digest] = (now, result)
+            while len(self._searches) > SEARCH_CACHE_MAX_ENTRIES:
+                self._searches.popitem(last=False)
+        return result
+
+    def _hit(
+        self,
+        url: str,
+        body_size: int,
+        *,
+        fresh: bool,
+        response: requests.Response | None = None,
+    ) -> None:
+        """Count a page answered from the cache, extending its freshness."""
+        with self._lock:
+            if fresh:
+                self.stats.fresh_hits += 1
+                self._connection.execute(
+                    "UPDATE pages SET accessed = ? WHERE url = ?",
+                    (time.time(), url),
+                )
+            else:
+                self.stats.revalidated_hits += 1
+                self._connection.execute(
+                    "UPDATE pages SET accessed = ?, fresh_until = ? WHERE url = ?",
+                    (
+                        time.time(),
+                        time.time() + freshness_lifetime(response.headers),
+                        url,
+                    ),
+                )
+            self.stats.saved_bytes += body_size
+            self._connection.commit()
+
+    def _store(self, url: str, text: str, response: requests.Response) -> None:
+        """Cache the text of a downloaded page, if the server allows it."""
+        blob = zlib.compress(text.encode())
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        lifetime = freshness_lifetime(response.headers)
+        with self._lock:
+            self.stats.misses += 1
+            self.stats.downloaded_bytes += len(response.content)
+            cacheable = etag or last_modified or lifetime > 0
+            if not cacheable or "no-store" in response.headers.get(
+                "Cache-Control",
+                "",
+            ):
+                return
+            previous = self._connection.execute(
+                "SELECT size FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+            now = time.time()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    blob,
+                    len(blob),
+                    len(response.content),
+                    etag,
+                    last_modified,
+                    now + lifetime,
+                    now,
+                ),
+            )
+            self._size += len(blob) - (previous[0] if previous else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        """Delete the least recently used pages down to 90% of the size cap."""
+        evicted = []
+        rows = self._connection.execute("SELECT url, size FROM pages ORDER BY accessed")
+        for url, size in rows:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            evicted.append((url,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM pages WHERE url = ?", evicted)
+
+
+@functools.cache
+def get_web_cache() -> WebCache:
+    """Return the web cache shared by the tools of the process."""
+    return WebCache(WEB_CACHE_PATH or ":memory:")
+
+
+class CachedVisitWebpageTool(VisitWebpageTool):
+    """
+    ``visit_webpage`` tool reading pages through the web cache.
+
+    It returns the extracted main text of the page, instead of the whole page
+    converted to markdown, cut past ``max_output_length`` characters.
+    """
+
+    side_effect_free = True
+
+    def __init__(
+        self,
+        max_output_length: int = WEB_PAGE_MAX_CHARS,
+        cache: WebCache | None = None,
+    ) -> None:
+        """Read pages through ``cache``, the shared web cache by default."""
+        super().__init__(max_output_length)
+        self.cache = cache or get_web_cache()
+
+    def forward(self, url: str) -> str:
+        """Return the text of the page."""
+        try:
+            text = self.cache.fetch(url)
+        except requests.exceptions.Timeout:
+            return "The request timed out. Please try again later or check the URL."
+        except requests.exceptions.RequestException as error:
+            return f"Error fetching the webpage: {error}"
+        return truncate_text(text, self.max_output_length)
+
+
+class CachedGoogleSearchTool(GoogleSearchTool):
+    """``web_search`` tool whose results are cached and requests pooled."""
+
+    side_effect_free = True
+
+    def __init__(
+        self,
+        provider: str = "serpapi",
+        cache: WebCache | None = None,
+    ) -> None:
+        """Search with ``provider`` through ``cache``, the shared one by default."""
+        super().__init__(provider)
+        self.base_url = SEARCH_URLS.get(provider, SEARCH_URLS["serper"])
+        self.cache = cache or get_web_cache()
+
+    def forward(self, query: str, filter_year: int | None = None) -> str:
+        """Return the top search results of the query."""
+        return self.cache.search(
+            {
+                "provider": self.provider,
+                "query": query,
+                "filter_year": filter_year,
+            },
+            functools.partial(self.search, query, filter_year),
+        )
+
+    def search(self, query: str, filter_year: int | None = None) -> str:
+        """Request the search results, formatted as ``GoogleSearchTool`` does."""
+        params = {"q": query, "api_key": self.api_key}
+        if self.provider == "serpapi":
+            params |= {"engine": "google", "google_domain": "google.com"}
+        if filter_year is not None:
+            params["tbs"] = (
+                f"cdr:1,cd_min:01/01/{filter_year},cd_max:12/31/{filter_year}"
+            )
+        response = self.cache.session.get(
+            self.base_url,
+            params=params,
+            timeout=WEB_TIMEOUT,
+        )
+        if not response.ok:
+            raise ValueError(response.json())
+        pages = response.json().get(self.organic_key)
+        year_filter = f" with filter year={filter_year}" if filter_year else ""
+        if not pages:
+            return (
+                f"No results found for '{query}'{year_filter}. Try with a more"
+                " general query, or remove the year filter."
+            )
+        snippets = []
+        for index, page in enumerate(pages):
+            snippet = f"{index}. [{page['title']}]({page['link']})"
+            if "date" in page:
+                snippet += f"\nDate published: {page['date']}"
+            if "source" in page:
+                snippet += f"\nSource: {page['source']}"
+            snippets.append(f"{snippet}\n\n{page.get('snippet', '')}")
+        return "## Search Results\n" + "\n\n".join(snippets)